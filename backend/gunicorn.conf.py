@@ -0,0 +1,63 @@
+"""
+Gunicorn settings for `python run.py serve`, also usable directly:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Every setting can be overridden through the environment. SERVE_MODE picks
+the worker model:
+
+- `sync` (default): pre-forked workers with a small thread pool each.
+  Best for short requests from clients on good connections.
+- `async`: gevent workers. Each request is a greenlet, so thousands of slow
+  mobile clients can be connected at once without a thread each.
+
+Send SIGHUP to the master for a graceful reload: new workers start with
+fresh code while the old ones finish their in-flight requests.
+
+The master runs the schema step (scripts/migrate.py) in a subprocess when it
+starts and on every reload, so workers boot against a current schema and
+skip it. Set MIGRATE_ON_START=0 when deploys run the script themselves.
+"""
+import multiprocessing
+import os
+import subprocess
+import sys
+
+bind = os.environ.get('BIND') or f"0.0.0.0:{os.environ.get('PORT', 4000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+
+if os.environ.get('SERVE_MODE', 'sync') == 'async':
+    worker_class = 'gevent'
+    worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 1000))
+else:
+    worker_class = 'gthread'
+    threads = int(os.environ.get('THREADS', 4))
+
+keepalive = int(os.environ.get('KEEPALIVE', 5))
+timeout = int(os.environ.get('TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 30))
+# Recycle workers now and then so slow leaks cannot build up; jitter keeps them from restarting together
+max_requests = int(os.environ.get('MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.environ.get('MAX_REQUESTS_JITTER', 1000))
+
+accesslog = os.environ.get('ACCESS_LOG') or None
+errorlog = '-'
+
+
+def _migrate(server):
+    if os.environ.get('MIGRATE_ON_START', '1').lower() in ('0', 'false', 'no', 'off'):
+        return
+    # A separate process keeps the app's modules out of the master, so reloads still pick up new code
+    server.log.info('Running the schema step')
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    path = os.pathsep.join(filter(None, [backend_dir, os.environ.get('PYTHONPATH')]))
+    subprocess.run([sys.executable, os.path.join(backend_dir, 'scripts', 'migrate.py')], cwd=backend_dir,
+                   env=dict(os.environ, PYTHONPATH=path), check=True)
+
+
+def on_starting(server):
+    _migrate(server)
+
+
+def on_reload(server):
+    _migrate(server)
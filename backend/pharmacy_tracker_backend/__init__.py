@@ -1,36 +1,66 @@
 from flask import Flask, jsonify, send_from_directory
 from flask_sqlalchemy import SQLAlchemy
-from flask_cors import CORS
-import os
 import logging
 import traceback
 
-db = SQLAlchemy()
+from pharmacy_tracker_backend.config import Config
+from pharmacy_tracker_backend.engine import RoutingSession, apply_sqlite_pragmas, configure_database
 
-def create_app():
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+def create_base_app(config_class=Config):
+    """An app with the configuration and database only: no routes, caches or metrics.
+
+    Enough for scripts that work on the models inside `app.app_context()`.
+    With SCHEMA_AUTO_MIGRATE the schema step runs when the database is
+    behind the models (see database/migrate.py).
+    """
     app = Flask(__name__, static_folder='../../app', static_url_path='')
     
-    # Configuration
-    basedir = os.path.abspath(os.path.dirname(__file__))
-    
-    # Use SQLite for simplicity (can switch to PostgreSQL later)
-    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL') or \
-        'sqlite:///' + os.path.join(basedir, '..', 'app.db')
-    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-    
-    # Initialize extensions
+    # Configuration, from the environment via config.Config
+    app.config.from_object(config_class)
+    configure_database(app)
     db.init_app(app)
-    CORS(app)
 
     # Basic logging
     handler = logging.StreamHandler()
     handler.setLevel(logging.INFO)
     app.logger.addHandler(handler)
     app.logger.setLevel(logging.INFO)
-    
+
+    with app.app_context():
+        apply_sqlite_pragmas(db.engines, app.config)
+        if app.config.get('SCHEMA_AUTO_MIGRATE', True):
+            from pharmacy_tracker_backend.database.migrate import ensure_schema
+            ensure_schema()
+    return app
+
+def create_app(config_class=Config):
+    app = create_base_app(config_class)
+
+    # Initialize extensions
+    from flask_cors import CORS
+    CORS(app, expose_headers=['ETag', 'Last-Modified', 'X-Cache'])
+
+    from pharmacy_tracker_backend.cache import init_response_cache
+    init_response_cache(app)
+
+    from pharmacy_tracker_backend.metrics import init_metrics, instrument_engines
+    metrics = init_metrics(app)
+
+    # Registered after metrics so response sizes are counted as sent
+    from pharmacy_tracker_backend.encoding import init_response_encoding
+    init_response_encoding(app)
+
     # Register blueprints
     from pharmacy_tracker_backend.routes.pharmacies import pharmacies_bp
     app.register_blueprint(pharmacies_bp, url_prefix='/api')
+    from pharmacy_tracker_backend.routes.inventory import inventory_bp
+    app.register_blueprint(inventory_bp, url_prefix='/api')
+    from pharmacy_tracker_backend.routes.analytics import analytics_bp
+    app.register_blueprint(analytics_bp, url_prefix='/api')
+    from pharmacy_tracker_backend.routes.tiles import tiles_bp
+    app.register_blueprint(tiles_bp, url_prefix='/api')
     
     # Health check route
     @app.route('/health', methods=['GET'])
@@ -53,9 +83,9 @@ def create_app():
             return jsonify({'success': False, 'message': 'API route not found'}), 404
         return send_from_directory(app.static_folder, 'index.html')
     
-    # Create tables
+    # Count and time every query of every engine
     with app.app_context():
-        db.create_all()
+        instrument_engines(db.engines, metrics)
 
     # Global error handler to return JSON on unhandled exceptions
     @app.errorhandler(Exception)
@@ -0,0 +1,241 @@
+"""
+Sales and purchase analytics, read from rollup tables.
+
+`refresh_analytics()` folds new rows of `transactions` into three rollups:
+
+- `analytics_daily`: count, units and amount per day and type;
+- `analytics_medicine_daily`: the same per day, medicine and type;
+- `analytics_supplier_daily`: purchases per day and supplier.
+
+Transactions are only ever inserted, so the refresh keeps a watermark, the
+last transaction id rolled up, and reads forward from it in id order. Each
+batch and its watermark commit together, so a transaction is counted once
+even if a refresh dies halfway, and the watermark only moves from the value
+the refresh read, so one that outlived its lease cannot count a batch that
+another refresh already did. The refresh runs outside the request path
+and leaves rows younger than a few seconds for the next round, which lets
+transactions still committing with a lower id land first.
+
+Reports sum rollup rows over a date range, so their cost follows the number
+of days (and medicines or suppliers) reported, not the number of
+transactions. They lag the transactions by up to `ANALYTICS_REFRESH_SECONDS`.
+Days are UTC days.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, bindparam, delete, func, insert, select, update  # type: ignore
+
+from pharmacy_tracker_backend import db
+from pharmacy_tracker_backend.database.models import (
+    AnalyticsState, DailySales, Medicine, MedicineDailySales, Supplier, SupplierDailyPurchases, Transaction
+)
+from pharmacy_tracker_backend.scheduler import claim_lease, release_lease
+
+PERIODS = ('day', 'week')
+# Transactions read per batch
+DEFAULT_BATCH_SIZE = 5000
+_STATE_ID = 1
+_LEASE_SECONDS = 600
+# Transactions younger than this are left for the next refresh
+_SETTLE = timedelta(seconds=5)
+_IN_CHUNK = 500
+_MEASURES = ('count', 'units', 'amount')
+
+_transactions = Transaction.__table__
+_daily = DailySales.__table__
+_medicine_daily = MedicineDailySales.__table__
+_supplier_daily = SupplierDailyPurchases.__table__
+
+
+def refresh_analytics(batch_size=DEFAULT_BATCH_SIZE):
+    """Roll up transactions added since the last refresh.
+
+    Returns `{'processed', 'last_transaction_id'}`, or None when another
+    refresh holds the lease.
+    """
+    now = datetime.utcnow()
+    if not claim_lease(AnalyticsState, now, _LEASE_SECONDS):
+        return None
+    try:
+        processed, last_id = _refresh(now - _SETTLE, batch_size)
+    except Exception:
+        db.session.rollback()
+        release_lease(AnalyticsState)
+        raise
+    release_lease(AnalyticsState, refreshed_at=datetime.utcnow())
+    return {'processed': processed, 'last_transaction_id': last_id}
+
+
+def _refresh(cutoff, batch_size):
+    state = db.session.get(AnalyticsState, _STATE_ID)
+    db.session.refresh(state)
+    watermark = state.last_transaction_id
+    last_id = watermark or 0
+    processed = 0
+    while True:
+        rows = db.session.execute(
+            select(_transactions.c.id, _transactions.c.transaction_date, _transactions.c.type,
+                   _transactions.c.medicine_id, _transactions.c.supplier_id, _transactions.c.quantity,
+                   _transactions.c.total_amount)
+            .where(_transactions.c.id > last_id).order_by(_transactions.c.id).limit(batch_size)).all()
+        # Stop at the first unsettled row so a lower id committed later is not skipped
+        settled = []
+        for row in rows:
+            if row.transaction_date is not None and row.transaction_date > cutoff:
+                break
+            settled.append(row)
+        if not settled:
+            return processed, last_id
+
+        # Move the watermark first and only from where this refresh read it: a
+        # refresh that outlived its lease, or raced another claimant, must not
+        # roll the same transactions up twice
+        moved = db.session.execute(
+            update(AnalyticsState.__table__).where(
+                AnalyticsState.id == _STATE_ID,
+                AnalyticsState.last_transaction_id.is_(None) if watermark is None
+                else AnalyticsState.last_transaction_id == watermark)
+            .values(last_transaction_id=settled[-1].id))
+        if moved.rowcount == 0:
+            db.session.rollback()
+            return processed, last_id
+        _roll_up(settled)
+        db.session.commit()
+        watermark = last_id = settled[-1].id
+        processed += len(settled)
+        if len(settled) < batch_size:
+            return processed, last_id
+
+
+def _roll_up(rows):
+    daily, by_medicine, by_supplier = {}, {}, {}
+    for row in rows:
+        day = (row.transaction_date or datetime.utcnow()).date()
+        values = (1, row.quantity, row.total_amount)
+        _accumulate(daily, (day, row.type), values)
+        _accumulate(by_medicine, (day, row.medicine_id, row.type), values)
+        if row.type == 'purchase' and row.supplier_id is not None:
+            _accumulate(by_supplier, (day, row.supplier_id), values)
+    _add(_daily, ('day', 'type'), daily)
+    _add(_medicine_daily, ('day', 'medicine_id', 'type'), by_medicine)
+    _add(_supplier_daily, ('day', 'supplier_id'), by_supplier)
+
+
+def _accumulate(totals, key, values):
+    current = totals.get(key)
+    totals[key] = values if current is None else tuple(a + b for a, b in zip(current, values))
+
+
+def _add(table, key_columns, totals):
+    """Add `{key: (count, units, amount)}` to the rollup `table`: an executemany UPDATE and INSERT."""
+    keys = list(totals)
+    existing = set()
+    # Narrow by each key column; the result may include extra keys, which are ignored
+    for start in range(0, len(keys), _IN_CHUNK):
+        chunk = keys[start:start + _IN_CHUNK]
+        clauses = [table.c[name].in_({key[i] for key in chunk}) for i, name in enumerate(key_columns)]
+        existing.update(tuple(row) for row in db.session.execute(
+            select(*[table.c[name] for name in key_columns]).where(and_(*clauses))))
+
+    updates, inserts = [], []
+    for key, values in totals.items():
+        if key in existing:
+            updates.append(dict({f'k_{name}': value for name, value in zip(key_columns, key)},
+                                **{f'd_{name}': value for name, value in zip(_MEASURES, values)}))
+        else:
+            inserts.append(dict(zip(key_columns + _MEASURES, key + values)))
+    if updates:
+        db.session.execute(
+            update(table).where(and_(*[table.c[name] == bindparam(f'k_{name}') for name in key_columns]))
+            .values({name: table.c[name] + bindparam(f'd_{name}') for name in _MEASURES}),
+            updates)
+    if inserts:
+        db.session.execute(insert(table), inserts)
+
+
+def rebuild_analytics(batch_size=DEFAULT_BATCH_SIZE):
+    """Empty the rollups and roll up every transaction again. Returns the refresh report."""
+    now = datetime.utcnow()
+    if not claim_lease(AnalyticsState, now, _LEASE_SECONDS):
+        return None
+    try:
+        for table in (_daily, _medicine_daily, _supplier_daily):
+            db.session.execute(delete(table))
+        db.session.execute(update(AnalyticsState.__table__).where(AnalyticsState.id == _STATE_ID)
+                           .values(last_transaction_id=0))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        release_lease(AnalyticsState)
+    return refresh_analytics(batch_size)
+
+
+def get_analytics_state():
+    state = db.session.get(AnalyticsState, _STATE_ID)
+    return {'last_transaction_id': state.last_transaction_id if state else 0,
+            'refreshed_at': state.refreshed_at.isoformat() if state and state.refreshed_at else None}
+
+
+def _totals(count, units, amount):
+    return {'count': count or 0, 'units': units or 0, 'amount': round(amount or 0.0, 2)}
+
+
+def revenue_series(start, end, period='day'):
+    """Sales and purchases per day or ISO week (starting Monday) from `start` to `end` inclusive."""
+    buckets = {}
+    day = start
+    while day <= end:
+        key = day if period == 'day' else day - timedelta(days=day.weekday())
+        buckets.setdefault(key, {'sale': [0, 0, 0.0], 'purchase': [0, 0, 0.0]})
+        day += timedelta(days=1)
+    for day, kind, count, units, amount in db.session.execute(
+            select(_daily.c.day, _daily.c.type, _daily.c.count, _daily.c.units, _daily.c.amount)
+            .where(_daily.c.day >= start, _daily.c.day <= end)):
+        key = day if period == 'day' else day - timedelta(days=day.weekday())
+        bucket = buckets[key].setdefault(kind, [0, 0, 0.0])
+        bucket[0] += count
+        bucket[1] += units
+        bucket[2] += amount
+    return [{'period_start': key.isoformat(), 'sales': _totals(*totals['sale']),
+             'purchases': _totals(*totals['purchase'])}
+            for key, totals in sorted(buckets.items())]
+
+
+def medicine_totals(start, end, kind='sale', order_by='units', limit=20):
+    """Top `limit` medicines by units or amount for transactions of `kind` between `start` and `end`."""
+    units = func.sum(_medicine_daily.c.units)
+    amount = func.sum(_medicine_daily.c.amount)
+    rows = db.session.execute(
+        select(_medicine_daily.c.medicine_id, func.sum(_medicine_daily.c.count), units, amount)
+        .where(_medicine_daily.c.day >= start, _medicine_daily.c.day <= end, _medicine_daily.c.type == kind)
+        .group_by(_medicine_daily.c.medicine_id)
+        .order_by((units if order_by == 'units' else amount).desc(), _medicine_daily.c.medicine_id)
+        .limit(limit)).all()
+    names = dict(db.session.execute(select(Medicine.id, Medicine.name)
+                                    .where(Medicine.id.in_([row[0] for row in rows]))).all()) if rows else {}
+    return [dict(_totals(count, units, amount), medicine_id=medicine_id, name=names.get(medicine_id))
+            for medicine_id, count, units, amount in rows]
+
+
+def supplier_totals(start, end, limit=20):
+    """Top `limit` suppliers by purchase amount between `start` and `end`."""
+    amount = func.sum(_supplier_daily.c.amount)
+    rows = db.session.execute(
+        select(_supplier_daily.c.supplier_id, func.sum(_supplier_daily.c.count), func.sum(_supplier_daily.c.units),
+               amount)
+        .where(_supplier_daily.c.day >= start, _supplier_daily.c.day <= end)
+        .group_by(_supplier_daily.c.supplier_id)
+        .order_by(amount.desc(), _supplier_daily.c.supplier_id)
+        .limit(limit)).all()
+    names = dict(db.session.execute(select(Supplier.id, Supplier.name)
+                                    .where(Supplier.id.in_([row[0] for row in rows]))).all()) if rows else {}
+    return [dict(_totals(count, units, amount), supplier_id=supplier_id, name=names.get(supplier_id))
+            for supplier_id, count, units, amount in rows]
+
+
+def default_range(today=None, days=30):
+    """The last `days` UTC days, ending today."""
+    end = today or datetime.utcnow().date()
+    return end - timedelta(days=days - 1), end
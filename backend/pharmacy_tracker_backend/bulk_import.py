@@ -0,0 +1,295 @@
+"""
+Bulk loading of pharmacy registries.
+
+Input is CSV (one pharmacy per row, header names matching the JSON fields),
+NDJSON (one JSON object per line) or a JSON array. CSV and NDJSON are read
+as a stream, so memory stays flat however large the dump is.
+
+Rows are validated and collected into chunks. Each chunk checks for existing
+phone numbers and emails with a single IN query, then writes with one
+executemany INSERT (and one UPDATE for upserts) inside its own transaction.
+A bad row is reported with its line number and never aborts the load; a
+chunk that still fails on commit, for example because a concurrent request
+registered the same phone number, is retried row by row to isolate the
+culprit.
+
+The search index follows through its triggers; the map clusters and the
+stale marks of the map tiles around changed rows are written in the same
+transaction. The spatial index, the read model and the response cache
+are updated after every committed chunk.
+"""
+import csv
+import json
+import re
+import uuid
+from datetime import datetime
+
+from sqlalchemy import delete, insert, or_, update  # type: ignore
+from sqlalchemy.exc import IntegrityError  # type: ignore
+
+from pharmacy_tracker_backend import db
+from pharmacy_tracker_backend.cache import invalidate_responses
+from pharmacy_tracker_backend.changes import record_changes
+from pharmacy_tracker_backend.clusters import adjust_clusters, locked_positions
+from pharmacy_tracker_backend.database.models import Pharmacy, PharmacyHours, PharmacyService, normalize_services
+from pharmacy_tracker_backend.geo import sync_points
+from pharmacy_tracker_backend.opening_hours import parse_opening_hours
+from pharmacy_tracker_backend.read_model import sync_read_model
+from pharmacy_tracker_backend.tiles import touch_tiles
+
+FORMATS = ('csv', 'ndjson', 'json')
+CONFLICT_MODES = ('skip', 'update')
+DEFAULT_CHUNK_SIZE = 1000
+# Row errors kept in the report; the count keeps going past it
+MAX_REPORTED_ERRORS = 1000
+
+# Column sizes from the model, checked up front so one long value cannot fail a whole chunk
+_MAX_LENGTHS = {'name': 255, 'contact_person': 255, 'phone_number': 50, 'email': 255,
+                'address': 255, 'opening_hours': 255}
+_TRUE = {'1', 'true', 'yes', 'y'}
+
+
+def iter_records(stream, fmt):
+    """Yield `(line, record, error)` for each input record of a text stream.
+
+    `record` is a dict, or None when the line could not be parsed, in which
+    case `error` says why.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            # Empty cells mean "not given"
+            yield reader.line_num, {k: v for k, v in record.items() if k and v not in (None, '')}, None
+    elif fmt == 'ndjson':
+        for line, text in enumerate(stream, 1):
+            if not text.strip():
+                continue
+            try:
+                record = json.loads(text)
+            except ValueError as e:
+                yield line, None, f'invalid JSON: {e}'
+                continue
+            if isinstance(record, dict):
+                yield line, record, None
+            else:
+                yield line, None, 'expected a JSON object'
+    elif fmt == 'json':
+        # A JSON array has to be parsed whole; use NDJSON for very large loads
+        records = json.load(stream)
+        if not isinstance(records, list):
+            raise ValueError('expected a JSON array of pharmacies')
+        for line, record in enumerate(records, 1):
+            if isinstance(record, dict):
+                yield line, record, None
+            else:
+                yield line, None, 'expected a JSON object'
+    else:
+        raise ValueError(f'format must be one of: {", ".join(FORMATS)}')
+
+
+def _text(record, *names):
+    for name in names:
+        value = record.get(name)
+        if value is not None:
+            value = str(value).strip()
+            if value:
+                return value
+    return None
+
+
+def _coordinate(record, names, bound):
+    value = next((record[name] for name in names if record.get(name) is not None), None)
+    if value is None:
+        # Same default as POST /pharmacies
+        return 0.0
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{names[0]} must be a number')
+    if not -bound <= value <= bound:
+        raise ValueError(f'{names[0]} must be between -{bound} and {bound}')
+    return value
+
+
+def validate_record(record):
+    """Turn an input record into `(row, services)`. Raises ValueError when it is unusable."""
+    row = {
+        'name': _text(record, 'name'),
+        'contact_person': _text(record, 'contact_person'),
+        'phone_number': _text(record, 'phone_number', 'phone'),
+        'email': _text(record, 'email'),
+        'address': _text(record, 'address'),
+        'opening_hours': _text(record, 'opening_hours'),
+    }
+    if not row['name'] or not row['phone_number'] or not row['address']:
+        raise ValueError('name, phone_number and address are required')
+    for name, size in _MAX_LENGTHS.items():
+        if row[name] is not None and len(row[name]) > size:
+            raise ValueError(f'{name} is longer than {size} characters')
+    row['latitude'] = _coordinate(record, ('latitude', 'lat'), 90)
+    row['longitude'] = _coordinate(record, ('longitude', 'lng'), 180)
+
+    registered = record.get('is_registered_by_pharmacy', False)
+    if isinstance(registered, str):
+        registered = registered.strip().lower() in _TRUE
+    row['is_registered_by_pharmacy'] = bool(registered)
+
+    services = record.get('services')
+    if isinstance(services, str) and not services.lstrip().startswith('['):
+        # CSV cells usually separate services with ; or |
+        services = re.split(r'[,;|]', services)
+    try:
+        services = normalize_services(services)
+    except (TypeError, ValueError):
+        raise ValueError('services must be a list of names')
+    row['services'] = json.dumps(services) if services else None
+    return row, services
+
+
+def _new_report():
+    return {'received': 0, 'inserted': 0, 'updated': 0, 'skipped': 0, 'failed': 0, 'errors': []}
+
+
+def _fail(report, line, message):
+    report['failed'] += 1
+    if len(report['errors']) < MAX_REPORTED_ERRORS:
+        report['errors'].append({'line': line, 'message': message})
+
+
+def import_pharmacies(records, on_conflict='skip', chunk_size=DEFAULT_CHUNK_SIZE):
+    """Load `(line, record, error)` tuples from `iter_records`. Call inside an app context.
+
+    Existing pharmacies are matched on phone number. With `on_conflict='skip'`
+    they are left alone; with `'update'` they are overwritten by the input row.
+    Returns a report with counts and per-row errors.
+    """
+    if on_conflict not in CONFLICT_MODES:
+        raise ValueError(f'on_conflict must be one of: {", ".join(CONFLICT_MODES)}')
+    chunk_size = max(1, int(chunk_size))
+    report = _new_report()
+    # Keys already taken by an earlier row of this load, mapped to that row's line
+    phones, emails = {}, {}
+    chunk = []
+    for line, record, error in records:
+        report['received'] += 1
+        if error is not None:
+            _fail(report, line, error)
+            continue
+        try:
+            row, services = validate_record(record)
+        except ValueError as e:
+            _fail(report, line, str(e))
+            continue
+        earlier = phones.get(row['phone_number']) or emails.get(row['email'])
+        if earlier is not None:
+            _fail(report, line, f'phone_number or email repeats line {earlier}')
+            continue
+        phones[row['phone_number']] = line
+        if row['email'] is not None:
+            emails[row['email']] = line
+
+        chunk.append((line, row, services))
+        if len(chunk) >= chunk_size:
+            _load_chunk(chunk, on_conflict, report)
+            chunk = []
+    if chunk:
+        _load_chunk(chunk, on_conflict, report)
+    return report
+
+
+def _load_chunk(chunk, on_conflict, report):
+    phones = [row['phone_number'] for _, row, _ in chunk]
+    emails = [row['email'] for _, row, _ in chunk if row['email'] is not None]
+    by_phone, by_email = {}, {}
+    clause = Pharmacy.phone_number.in_(phones)
+    if emails:
+        clause = or_(clause, Pharmacy.email.in_(emails))
+    for pid, phone, email in db.session.query(Pharmacy.id, Pharmacy.phone_number, Pharmacy.email).filter(clause):
+        by_phone[phone] = pid
+        if email is not None:
+            by_email[email] = pid
+
+    inserts, updates = [], []
+    for line, row, services in chunk:
+        pid = by_phone.get(row['phone_number'])
+        owner = by_email.get(row['email'])
+        if owner is not None and owner != pid:
+            _fail(report, line, 'email belongs to another pharmacy')
+        elif pid is None:
+            inserts.append((line, dict(row, id=str(uuid.uuid4())), services))
+        elif on_conflict == 'update':
+            updates.append((line, dict(row, id=pid), services))
+        else:
+            report['skipped'] += 1
+
+    try:
+        _write(inserts, updates)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        # Something changed underneath us since the lookup; isolate the rows that clash
+        for item in inserts:
+            _write_one([item], [], report)
+        for item in updates:
+            _write_one([], [item], report)
+        return
+    except Exception:
+        db.session.rollback()
+        raise
+    _committed(inserts, updates, report)
+
+
+def _write_one(inserts, updates, report):
+    try:
+        _write(inserts, updates)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        line = (inserts or updates)[0][0]
+        _fail(report, line, 'a pharmacy with this phone number or email already exists')
+        return
+    _committed(inserts, updates, report)
+
+
+def _write(inserts, updates):
+    now = datetime.utcnow()
+    entries = []
+    added = [(row['id'], row['latitude'], row['longitude']) for _, row, _ in inserts + updates]
+    removed = []
+    if inserts:
+        rows = []
+        for _, row, services in inserts:
+            rows.append(dict(row, created_at=now, updated_at=now))
+            entries.extend({'pharmacy_id': row['id'], 'service': name, 'position': position}
+                           for position, name in enumerate(services))
+        # Core insert on the table: a single executemany, no per-row ORM bookkeeping
+        db.session.execute(insert(Pharmacy.__table__), rows)
+    if updates:
+        ids = [row['id'] for _, row, _ in updates]
+        # Old positions, for the map tiles and clusters they leave
+        removed = [(pid, lat, lng) for pid, (lat, lng) in locked_positions(ids).items()]
+        db.session.execute(update(Pharmacy), [dict(row, updated_at=now) for _, row, _ in updates])
+        db.session.execute(delete(PharmacyService).where(PharmacyService.pharmacy_id.in_(ids)))
+        db.session.execute(delete(PharmacyHours).where(PharmacyHours.pharmacy_id.in_(ids)))
+        for _, row, services in updates:
+            entries.extend({'pharmacy_id': row['id'], 'service': name, 'position': position}
+                           for position, name in enumerate(services))
+    if entries:
+        db.session.execute(insert(PharmacyService.__table__), entries)
+    hours = [{'pharmacy_id': row['id'], 'opens_at': opens_at, 'closes_at': closes_at}
+             for _, row, _ in inserts + updates
+             for opens_at, closes_at in parse_opening_hours(row['opening_hours']) or ()]
+    if hours:
+        db.session.execute(insert(PharmacyHours.__table__), hours)
+    touch_tiles([(lat, lng) for _, lat, lng in added + removed])
+    adjust_clusters(added=added, removed=removed)
+    record_changes([row['id'] for _, row, _ in inserts + updates], 'upsert')
+
+
+def _committed(inserts, updates, report):
+    report['inserted'] += len(inserts)
+    report['updated'] += len(updates)
+    if inserts or updates:
+        sync_points((row['id'], row['latitude'], row['longitude']) for _, row, _ in inserts + updates)
+        sync_read_model([row['id'] for _, row, _ in inserts + updates])
+        invalidate_responses()
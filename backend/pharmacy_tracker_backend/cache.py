@@ -0,0 +1,254 @@
+"""
+Response cache for the read endpoints.
+
+Cached entries are the serialized response bodies, keyed on the request path
+plus normalized query parameters. Coordinates are quantized to a grid cell
+(`CACHE_GRID_DEG`, about 110 m by default), so nearby map positions share one
+entry. Distances in a cached response are measured from the first request
+seen in that cell.
+
+Every key embeds a generation number. Writes call `invalidate_responses()`,
+which bumps the generation, so stale entries can never be served again and
+age out of the LRU. The same scheme works for the shared Redis backend,
+where the generation is a Redis counter that every worker sees.
+
+With the in-process backend each worker has its own generation, so it does
+not see another worker's writes through it. Keys therefore also embed the
+validators below, which every worker reads from the database on each
+request; an entry built before another worker's write is simply not found.
+
+Entries are kept per representation (see encoding.py), so a hit sends the
+columnar or compressed body exactly as stored.
+
+Responses carry an ETag and Last-Modified derived from the pharmacy table's
+row count and latest `updated_at`, and from the latest entry of the change
+log (changes.py), which is the only trace a delete leaves. All three live
+in the database, so every worker derives the same validators. Only the
+Redis backend caches them, under its shared generation, which every write
+bumps. A client revalidating an unchanged resource gets a 304 without the
+view running at all.
+"""
+import hashlib
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from functools import wraps
+
+from flask import Response, current_app, request  # type: ignore
+from sqlalchemy import func, select  # type: ignore
+
+from pharmacy_tracker_backend import db
+from pharmacy_tracker_backend.database.models import Pharmacy, PharmacyChange
+from pharmacy_tracker_backend.encoding import encode_response, negotiate
+
+_COORD_PARAMS = {'lat', 'latitude', 'lng', 'longitude'}
+
+
+class LRUCache:
+    """Thread-safe in-process LRU with per-entry TTL and a size bound."""
+
+    def __init__(self, max_entries=1024, ttl=60.0, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._data = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def get(self, key, record=True):
+        # record=False keeps bookkeeping lookups out of the hit/miss counters
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += record
+                return None
+            expires, value = item
+            if expires <= self._clock():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += record
+                return None
+            self._data.move_to_end(key)
+            self.hits += record
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (self._clock() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def generation(self):
+        return self._generation
+
+    def bump_generation(self):
+        with self._lock:
+            self._generation += 1
+            # Nothing under the old generation can be read again
+            self._data.clear()
+
+    def stats(self):
+        return {'backend': 'memory', 'entries': len(self._data), 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'expirations': self.expirations}
+
+
+class RedisCache:
+    """Shared backend so every worker process sees the same entries and generation."""
+
+    def __init__(self, url, ttl=60.0, prefix='pharmacy-tracker:cache:'):
+        import redis  # type: ignore
+        self._redis = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self._prefix = prefix
+        self.hits = self.misses = 0
+
+    def get(self, key, record=True):
+        raw = self._redis.get(self._prefix + key)
+        if raw is None:
+            self.misses += record
+            return None
+        self.hits += record
+        return pickle.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        self._redis.set(self._prefix + key, pickle.dumps(value), ex=max(1, int(self.ttl if ttl is None else ttl)))
+
+    def clear(self):
+        self.bump_generation()
+
+    def generation(self):
+        return int(self._redis.get(self._prefix + 'generation') or 0)
+
+    def bump_generation(self):
+        self._redis.incr(self._prefix + 'generation')
+
+    def stats(self):
+        # Evictions and expirations happen inside Redis and are reported there
+        return {'backend': 'redis', 'hits': self.hits, 'misses': self.misses}
+
+
+def init_response_cache(app):
+    backend = app.config.get('CACHE_BACKEND', 'memory')
+    ttl = float(app.config.get('CACHE_TTL', 60))
+    if backend == 'redis':
+        cache = RedisCache(app.config['CACHE_REDIS_URL'], ttl=ttl)
+    elif backend == 'memory':
+        cache = LRUCache(int(app.config.get('CACHE_MAX_ENTRIES', 1024)), ttl=ttl)
+    else:
+        cache = None
+    app.extensions['response_cache'] = cache
+    return cache
+
+
+def get_response_cache():
+    return current_app.extensions.get('response_cache')
+
+
+def invalidate_responses():
+    """Drop every cached response. Call after committing a pharmacy write."""
+    cache = get_response_cache()
+    if cache is not None:
+        cache.bump_generation()
+
+
+def _normalized_args():
+    grid = float(current_app.config.get('CACHE_GRID_DEG', 0.001))
+    items = []
+    for name in sorted(request.args):
+        values = request.args.getlist(name)
+        if name in _COORD_PARAMS:
+            try:
+                values = [str(round(float(v) / grid)) for v in values]
+            except ValueError:
+                pass
+        elif name in ('search', 'q'):
+            values = [' '.join(v.lower().split()) for v in values]
+        items.append((name, tuple(values)))
+    return items
+
+
+def _validators(cache, generation):
+    """Return `(etag_seed, last_modified)` for the current state of the pharmacy table."""
+    # A process-local generation does not move on other workers' writes
+    shared = isinstance(cache, RedisCache)
+    key = f'{generation}:validators'
+    cached = cache.get(key, record=False) if shared else None
+    if cached is not None:
+        return cached
+    last_change = select(func.max(PharmacyChange.changed_at)).scalar_subquery()
+    count, latest, changed_at = db.session.query(
+        func.count(Pharmacy.id), func.max(Pharmacy.updated_at), last_change).one()
+    # Deletes leave max(updated_at) unchanged but are logged as changes;
+    # both are stored as naive UTC
+    last_modified = max((moment.replace(tzinfo=timezone.utc).timestamp()
+                         for moment in (latest, changed_at) if moment is not None), default=0.0)
+    # The seed keeps microsecond precision so two writes within one second
+    # still produce different ETags
+    value = (f'{count}:{latest.isoformat() if latest is not None else ""}', int(last_modified))
+    if shared:
+        cache.set(key, value)
+    return value
+
+
+def _not_modified(etag, last_modified):
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        return etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+    if_modified_since = request.headers.get('If-Modified-Since')
+    if if_modified_since:
+        try:
+            return parsedate_to_datetime(if_modified_since).timestamp() >= last_modified
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _http_date(timestamp):
+    return format_datetime(datetime.fromtimestamp(timestamp, timezone.utc), usegmt=True)
+
+
+def cached_response(view):
+    """Serve a GET view from the response cache, with ETag/Last-Modified revalidation."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        # Streams are not buffered, and open_now answers change with the clock
+        if request.args.get('stream') or request.args.get('open_now'):
+            return view(*args, **kwargs)
+        cache = get_response_cache()
+        generation = cache.generation() if cache is not None else 0
+        # Each format and compression is its own entry, with its own ETag
+        key = repr((request.path, _normalized_args(), negotiate()))
+        seed, last_modified = _validators(cache, generation)
+        etag = '"{}"'.format(hashlib.sha1(f'{seed}|{key}'.encode('utf-8')).hexdigest()[:32])
+        headers = {'ETag': etag, 'Last-Modified': _http_date(last_modified), 'Cache-Control': 'no-cache'}
+
+        if _not_modified(etag, last_modified):
+            return Response(status=304, headers=headers)
+
+        entry_key = f'{generation}:{seed}:{key}'
+        entry = cache.get(entry_key) if cache is not None else None
+        if entry is not None:
+            body, mimetype, coding = entry
+            if coding:
+                headers['Content-Encoding'] = coding
+            return Response(body, status=200, mimetype=mimetype, headers={**headers, 'X-Cache': 'HIT'})
+
+        response = current_app.make_response(view(*args, **kwargs))
+        if response.status_code == 200 and not response.is_streamed:
+            encode_response(response)
+            if cache is not None:
+                cache.set(entry_key, (response.get_data(), response.mimetype, response.headers.get('Content-Encoding')))
+            response.headers.update(headers)
+            response.headers['X-Cache'] = 'MISS'
+        return response
+    return wrapper
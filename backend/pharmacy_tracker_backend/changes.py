@@ -0,0 +1,126 @@
+"""
+Pharmacy change feed for delta sync.
+
+Every create, update and delete of a pharmacy appends a row to
+`pharmacy_changes` as the last write of its transaction. A client downloads one
+snapshot, keeps the sync token that came with it and from then on asks
+only for the changes after that token. The reply carries the current rows
+of changed pharmacies, the ids of deleted ones (tombstones) and a new token.
+
+A token is the id of the last change the client has seen, so a change must
+never become visible after one with a higher id. SQLite has one writer at
+a time, so ids are taken in commit order. On PostgreSQL `record_changes`
+takes a transaction-scoped advisory lock before it writes, so the next
+writer gets its ids only once this transaction has committed. On other
+databases, changes younger than `_SETTLE` are held back instead. Pruning (`prune_changes`) drops
+changes older than `CHANGE_LOG_RETENTION_DAYS`; a client whose token
+predates the oldest change left has to download a new snapshot.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, insert, select, text  # type: ignore
+
+from pharmacy_tracker_backend import db
+from pharmacy_tracker_backend.database.models import PharmacyChange
+from pharmacy_tracker_backend.pagination import decode_cursor, encode_cursor
+
+# Changes younger than this are not handed out yet, where commits may land out of id order
+_SETTLE = timedelta(seconds=2)
+# Advisory lock that orders change ids by commit on PostgreSQL
+_ORDER_LOCK_KEY = 7204180001
+
+_changes = PharmacyChange.__table__
+
+
+class TokenExpired(Exception):
+    """Raised for sync tokens older than the oldest change still kept."""
+
+
+def _commit_ordered():
+    """True when change ids become visible in id order on this database."""
+    return db.engine.dialect.name in ('sqlite', 'postgresql')
+
+
+def record_changes(pharmacy_ids, op):
+    """Log `op` for each of `pharmacy_ids` in the caller's transaction. Call it last, just before committing."""
+    now = datetime.utcnow()
+    rows = [{'pharmacy_id': pharmacy_id, 'op': op, 'changed_at': now} for pharmacy_id in pharmacy_ids]
+    if not rows:
+        return
+    if db.engine.dialect.name == 'postgresql':
+        # Held until commit, so ids are handed out one transaction at a time
+        db.session.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': _ORDER_LOCK_KEY})
+    db.session.execute(insert(_changes), rows)
+
+
+def encode_token(position):
+    return encode_cursor('sync', position)
+
+
+def decode_token(token):
+    """Change id stored in a sync token. Raises ValueError for malformed tokens."""
+    position = decode_cursor(token, 'sync')[0]
+    if not isinstance(position, int) or position < 0:
+        raise ValueError('invalid sync token')
+    return position
+
+
+def settled_position():
+    """Id of the last change that every client may be given, for a snapshot taken now."""
+    if _commit_ordered():
+        return latest_position()
+    unsettled = db.session.execute(
+        select(func.min(_changes.c.id)).where(_changes.c.changed_at > datetime.utcnow() - _SETTLE)).scalar()
+    if unsettled is not None:
+        return unsettled - 1
+    return latest_position()
+
+
+def latest_position():
+    """Id of the newest change, settled or not."""
+    return db.session.execute(select(func.max(_changes.c.id))).scalar() or 0
+
+
+def changes_since(position, limit):
+    """Return `(upserted_ids, deleted_ids, new_position, has_more)` for changes after `position`.
+
+    Each pharmacy appears once, with its latest change. Raises TokenExpired
+    when changes after `position` have been pruned.
+    """
+    oldest = db.session.execute(select(func.min(_changes.c.id))).scalar()
+    if oldest is not None and position < oldest - 1:
+        raise TokenExpired()
+
+    rows = db.session.execute(
+        select(_changes.c.id, _changes.c.pharmacy_id, _changes.c.op, _changes.c.changed_at)
+        .where(_changes.c.id > position).order_by(_changes.c.id).limit(limit)).all()
+    cutoff = None if _commit_ordered() else datetime.utcnow() - _SETTLE
+    latest = {}
+    settled = 0
+    for change_id, pharmacy_id, op, changed_at in rows:
+        if cutoff is not None and changed_at > cutoff:
+            break
+        # Re-inserting moves the pharmacy after earlier entries, keeping change order
+        latest.pop(pharmacy_id, None)
+        latest[pharmacy_id] = op
+        position = change_id
+        settled += 1
+    upserted = [pharmacy_id for pharmacy_id, op in latest.items() if op == 'upsert']
+    deleted = [pharmacy_id for pharmacy_id, op in latest.items() if op == 'delete']
+    return upserted, deleted, position, settled == len(rows) == limit
+
+
+def prune_changes(retention_days):
+    """Delete changes older than `retention_days`, always keeping the newest one, and commit.
+
+    Returns the number of changes deleted.
+    """
+    # The newest change stays as a marker of where the feed has got to
+    newest = db.session.execute(select(func.max(_changes.c.id))).scalar()
+    if newest is None:
+        return 0
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    deleted = db.session.execute(
+        delete(_changes).where(_changes.c.changed_at < cutoff, _changes.c.id < newest)).rowcount
+    db.session.commit()
+    return deleted
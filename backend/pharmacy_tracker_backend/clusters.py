@@ -0,0 +1,271 @@
+"""
+Map clustering from a precomputed cell hierarchy.
+
+The map is cut into Web Mercator grid cells at every level from
+`CLUSTER_CELL_BITS` to `CLUSTER_MAX_ZOOM - 1 + CLUSTER_CELL_BITS`, a level-L
+cell being the zoom-L map tile. `pharmacy_clusters` keeps, for each occupied
+cell, how many pharmacies it holds, the sums of their coordinates and a few
+of their ids. A map at zoom z is clustered on the cells of level
+z + CLUSTER_CELL_BITS, 2 ** CLUSTER_CELL_BITS of them across a 256 pixel
+tile, so the number of clusters depends on the size of the screen and not
+on how many pharmacies it shows. From `CLUSTER_MAX_ZOOM` up, pharmacies are
+returned one by one.
+
+Writes move pharmacies between cells at every level inside the writing
+transaction (`adjust_clusters`). Counts and sums change by increments; a
+cell that loses one of its sample ids refills them from its child cells, or
+at the finest level from the pharmacies in it. The old position of a moved
+or deleted pharmacy is read with `locked_positions`, so two writers moving
+the same pharmacy cannot both take it out of the cell it started in.
+"""
+import json
+
+import numpy as np  # type: ignore
+from flask import current_app  # type: ignore
+from sqlalchemy import bindparam, delete, func, insert, select, tuple_, update  # type: ignore
+
+from pharmacy_tracker_backend import db
+from pharmacy_tracker_backend.database.models import Pharmacy, PharmacyCluster
+from pharmacy_tracker_backend.geo import tile_bounds, world_position
+
+_clusters = PharmacyCluster.__table__
+_pharmacies = Pharmacy.__table__
+# Ids kept per cell
+_SAMPLE = 3
+# Cell keys per IN (...) lookup; each key takes three bound parameters
+_IN_CHUNK = 300
+# Rows per executemany when rebuilding
+_BATCH = 5000
+# Slack around cell edges, so rounding never drops a pharmacy on a boundary
+_EDGE_DEG = 1e-9
+# Float rounding allowed per pharmacy when checking the coordinate sums
+_SUM_TOLERANCE = 1e-9
+
+
+def cluster_levels(config):
+    """The cell levels kept in the hierarchy."""
+    bits = config.get('CLUSTER_CELL_BITS', 3)
+    return range(bits, config.get('CLUSTER_MAX_ZOOM', 16) + bits)
+
+
+def cells(lat, lng, level):
+    """`(x, y)` arrays of the level-`level` cells containing points given as arrays."""
+    n = 1 << level
+    fx, fy = world_position(lat, lng)
+    return (np.clip(np.floor(fx * n), 0, n - 1).astype(np.int64),
+            np.clip(np.floor(fy * n), 0, n - 1).astype(np.int64))
+
+
+def _key_clause(keys):
+    return tuple_(_clusters.c.level, _clusters.c.cell_x, _clusters.c.cell_y).in_(keys)
+
+
+def locked_positions(pharmacy_ids):
+    """`{id: (lat, lng)}` of `pharmacy_ids` as last committed, locked until the caller's transaction ends.
+
+    Pharmacies that no longer exist are left out.
+    """
+    pharmacy_ids = list(pharmacy_ids)
+    positions = {}
+    for start in range(0, len(pharmacy_ids), _IN_CHUNK):
+        chunk = pharmacy_ids[start:start + _IN_CHUNK]
+        query = select(_pharmacies.c.id, _pharmacies.c.latitude, _pharmacies.c.longitude).where(
+            _pharmacies.c.id.in_(chunk))
+        if db.engine.dialect.name == 'sqlite':
+            # No row locks: a write first takes the database's write lock, and the read after it is current
+            db.session.execute(update(_pharmacies).where(_pharmacies.c.id.in_(chunk))
+                               .values(updated_at=_pharmacies.c.updated_at))
+        else:
+            query = query.with_for_update()
+        positions.update((pid, (lat, lng)) for pid, lat, lng in db.session.execute(query))
+    return positions
+
+
+def adjust_clusters(added=(), removed=()):
+    """Move `(id, lat, lng)` pharmacies into (`added`) and out of (`removed`) every level.
+
+    Runs inside the caller's transaction. An updated pharmacy appears in
+    `removed` with its old position, read with `locked_positions`, and in
+    `added` with its new one.
+    """
+    levels = cluster_levels(current_app.config)
+    deltas = {}  # (level, x, y) -> [count, lat_sum, lng_sum, added ids, removed ids]
+    for sign, points in ((1, added), (-1, removed)):
+        points = [(pid, float(lat), float(lng)) for pid, lat, lng in points]
+        if not points:
+            continue
+        lat = np.array([point[1] for point in points])
+        lng = np.array([point[2] for point in points])
+        for level in levels:
+            xs, ys = cells(lat, lng, level)
+            for (pid, point_lat, point_lng), x, y in zip(points, xs.tolist(), ys.tolist()):
+                delta = deltas.setdefault((level, x, y), [0, 0.0, 0.0, [], set()])
+                delta[0] += sign
+                delta[1] += sign * point_lat
+                delta[2] += sign * point_lng
+                if sign > 0:
+                    delta[3].append(pid)
+                else:
+                    delta[4].add(pid)
+    if not deltas:
+        return
+
+    keys = list(deltas)
+    existing = {}
+    for start in range(0, len(keys), _IN_CHUNK):
+        rows = db.session.execute(
+            select(_clusters.c.level, _clusters.c.cell_x, _clusters.c.cell_y, _clusters.c.count, _clusters.c.sample)
+            .where(_key_clause(keys[start:start + _IN_CHUNK])))
+        for level, x, y, count, sample in rows:
+            existing[(level, x, y)] = (count, json.loads(sample))
+
+    inserts, updates, emptied, short = [], [], [], []
+    for key, (count_delta, lat_delta, lng_delta, new_ids, gone_ids) in deltas.items():
+        count, sample = existing.get(key, (0, []))
+        sample = [pid for pid in sample if pid not in gone_ids]
+        sample += [pid for pid in new_ids if pid not in sample][:_SAMPLE - len(sample)]
+        count += count_delta
+        level, x, y = key
+        if key not in existing:
+            if count > 0:
+                inserts.append({'level': level, 'cell_x': x, 'cell_y': y, 'count': count, 'lat_sum': lat_delta,
+                                'lng_sum': lng_delta, 'sample': json.dumps(sample)})
+            continue
+        updates.append({'key_level': level, 'key_x': x, 'key_y': y, 'count_delta': count_delta,
+                        'lat_delta': lat_delta, 'lng_delta': lng_delta, 'new_sample': json.dumps(sample)})
+        if count <= 0:
+            emptied.append({'key_level': level, 'key_x': x, 'key_y': y})
+        elif len(sample) < min(count, _SAMPLE):
+            short.append((key, sample, gone_ids))
+
+    matches = (_clusters.c.level == bindparam('key_level'), _clusters.c.cell_x == bindparam('key_x'),
+               _clusters.c.cell_y == bindparam('key_y'))
+    if updates:
+        db.session.execute(
+            update(_clusters).where(*matches).values(
+                count=_clusters.c.count + bindparam('count_delta'),
+                lat_sum=_clusters.c.lat_sum + bindparam('lat_delta'),
+                lng_sum=_clusters.c.lng_sum + bindparam('lng_delta'),
+                sample=bindparam('new_sample')),
+            updates)
+    if inserts:
+        db.session.execute(insert(_clusters), inserts)
+    if emptied:
+        db.session.execute(delete(_clusters).where(*matches, _clusters.c.count <= 0), emptied)
+    # Finest level first, so parents refill from children already refilled
+    finest = levels[-1]
+    for (level, x, y), sample, gone_ids in sorted(short, key=lambda item: -item[0][0]):
+        exclude = set(sample) | gone_ids
+        if level == finest:
+            candidates = _members(level, x, y)
+        else:
+            candidates = [pid for (child,) in db.session.execute(
+                select(_clusters.c.sample).where(
+                    _clusters.c.level == level + 1, _clusters.c.cell_x.in_((2 * x, 2 * x + 1)),
+                    _clusters.c.cell_y.in_((2 * y, 2 * y + 1))))
+                for pid in json.loads(child)]
+        sample += [pid for pid in candidates if pid not in exclude][:_SAMPLE - len(sample)]
+        db.session.execute(update(_clusters).where(
+            _clusters.c.level == level, _clusters.c.cell_x == x, _clusters.c.cell_y == y).values(
+            sample=json.dumps(sample)))
+
+
+def _members(level, x, y):
+    """Ids of the pharmacies in one cell."""
+    min_lat, min_lng, max_lat, max_lng = tile_bounds(level, x, y)
+    rows = db.session.execute(
+        select(_pharmacies.c.id, _pharmacies.c.latitude, _pharmacies.c.longitude)
+        .where(_pharmacies.c.latitude.between(min_lat - _EDGE_DEG, max_lat + _EDGE_DEG),
+               _pharmacies.c.longitude.between(min_lng - _EDGE_DEG, max_lng + _EDGE_DEG))
+        .order_by(_pharmacies.c.id)).all()
+    if not rows:
+        return []
+    xs, ys = cells(np.array([row[1] for row in rows]), np.array([row[2] for row in rows]), level)
+    return [row[0] for row, cell_x, cell_y in zip(rows, xs.tolist(), ys.tolist()) if (cell_x, cell_y) == (x, y)]
+
+
+def rebuild_clusters():
+    """Recompute every cell from the pharmacies table and commit. Returns the number of cells written."""
+    db.session.execute(delete(_clusters))
+    rows = db.session.execute(
+        select(_pharmacies.c.id, _pharmacies.c.latitude, _pharmacies.c.longitude).order_by(_pharmacies.c.id)).all()
+    written = 0
+    if rows:
+        ids = [row[0] for row in rows]
+        lat = np.array([row[1] for row in rows], dtype=float)
+        lng = np.array([row[2] for row in rows], dtype=float)
+        for level in cluster_levels(current_app.config):
+            xs, ys = cells(lat, lng, level)
+            keys, first, inverse, counts = np.unique(
+                xs * (1 << level) + ys, return_index=True, return_inverse=True, return_counts=True)
+            lat_sums = np.bincount(inverse, weights=lat)
+            lng_sums = np.bincount(inverse, weights=lng)
+            # Members of each cell in id order, cell after cell
+            order = np.argsort(inverse, kind='stable')
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            batch = []
+            for i in range(len(keys)):
+                members = order[starts[i]:starts[i] + min(counts[i], _SAMPLE)]
+                batch.append({'level': level, 'cell_x': int(xs[first[i]]), 'cell_y': int(ys[first[i]]),
+                              'count': int(counts[i]), 'lat_sum': float(lat_sums[i]), 'lng_sum': float(lng_sums[i]),
+                              'sample': json.dumps([ids[j] for j in members])})
+                if len(batch) == _BATCH:
+                    db.session.execute(insert(_clusters), batch)
+                    batch = []
+            if batch:
+                db.session.execute(insert(_clusters), batch)
+            written += len(keys)
+    db.session.commit()
+    return written
+
+
+def ensure_cluster_hierarchy():
+    """Rebuild the hierarchy when it is missing, was built for other levels or disagrees with the table.
+
+    Returns the number of cells written, 0 when it was already in order.
+    """
+    levels = cluster_levels(current_app.config)
+    low, high = db.session.execute(select(func.min(_clusters.c.level), func.max(_clusters.c.level))).one()
+    total, lat_total, lng_total = db.session.execute(select(
+        func.count(), func.coalesce(func.sum(_pharmacies.c.latitude), 0.0),
+        func.coalesce(func.sum(_pharmacies.c.longitude), 0.0))).one()
+    if low is None and not total:
+        return 0
+    if (low, high) == (levels[0], levels[-1]):
+        # The coarsest level has a handful of rows and must count every
+        # pharmacy, at the position it is at now
+        counted, lat_sum, lng_sum = db.session.execute(select(
+            func.coalesce(func.sum(_clusters.c.count), 0), func.coalesce(func.sum(_clusters.c.lat_sum), 0.0),
+            func.coalesce(func.sum(_clusters.c.lng_sum), 0.0)).where(_clusters.c.level == low)).one()
+        tolerance = _SUM_TOLERANCE * max(total, 1) * 180
+        if counted == total and abs(lat_sum - lat_total) <= tolerance and abs(lng_sum - lng_total) <= tolerance:
+            return 0
+    return rebuild_clusters()
+
+
+def cells_in(conn, level, x0, y0, x1, y1):
+    """`(count, lat, lng, ids)` for the occupied level cells from `(x0, y0)` to `(x1, y1)`, read through `conn`."""
+    rows = conn.execute(
+        select(_clusters.c.count, _clusters.c.lat_sum, _clusters.c.lng_sum, _clusters.c.sample)
+        .where(_clusters.c.level == level, _clusters.c.cell_x.between(x0, x1), _clusters.c.cell_y.between(y0, y1)))
+    return [(count, lat_sum / count, lng_sum / count, json.loads(sample)) for count, lat_sum, lng_sum, sample in rows]
+
+
+def cluster_box(box, zoom, config):
+    """Clusters of the pharmacies in `box` on a map at `zoom`, as `(count, lat, lng, ids)`.
+
+    Raises ValueError when the box spans more than `CLUSTER_MAX_CELLS` cells at that zoom.
+    """
+    min_lat, min_lng, max_lat, max_lng = box
+    level = zoom + config.get('CLUSTER_CELL_BITS', 3)
+    xs, ys = cells(np.array([max_lat, min_lat]), np.array([min_lng, max_lng]), level)
+    x0, x1 = xs.tolist()
+    y0, y1 = ys.tolist()
+    if (x1 - x0 + 1) * (y1 - y0 + 1) > config.get('CLUSTER_MAX_CELLS', 16384):
+        raise ValueError('bbox is too large for this zoom')
+    if zoom < config.get('CLUSTER_MAX_ZOOM', 16):
+        return cells_in(db.session, level, x0, y0, x1, y1)
+    rows = db.session.execute(
+        select(_pharmacies.c.id, _pharmacies.c.latitude, _pharmacies.c.longitude)
+        .where(_pharmacies.c.latitude.between(min_lat, max_lat), _pharmacies.c.longitude.between(min_lng, max_lng)))
+    return [(1, lat, lng, [pid]) for pid, lat, lng in rows]
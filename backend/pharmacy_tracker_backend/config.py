@@ -9,8 +9,101 @@ except Exception:
 basedir = os.path.abspath(os.path.dirname(__file__))
 load_dotenv()
 
+
+def _database_url(name, default=None):
+	url = os.environ.get(name) or default
+	# Hosting providers often hand out postgres://, which SQLAlchemy no longer accepts
+	if url and url.startswith('postgres://'):
+		url = 'postgresql://' + url[len('postgres://'):]
+	return url
+
+
+def _flag(name, default):
+	return os.environ.get(name, str(default)).lower() in ('1', 'true', 'yes', 'on')
+
+
 class Config:
 	SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key'
-	SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
-		'sqlite:///' + os.path.join(basedir, 'app.db')
-	SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+	SQLALCHEMY_DATABASE_URI = _database_url('DATABASE_URL', 'sqlite:///' + os.path.join(basedir, '..', 'app.db'))
+	SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+	# Optional read replica; GET and HEAD requests read from it, everything else uses the primary
+	DATABASE_REPLICA_URL = _database_url('DATABASE_REPLICA_URL')
+
+	# Connection pool for server databases such as PostgreSQL
+	DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+	DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+	DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+	DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+	DB_POOL_PRE_PING = _flag('DB_POOL_PRE_PING', True)
+
+	# SQLite pragmas, applied to every new connection. WAL lets readers run
+	# alongside a writer; NORMAL sync is durable across application crashes
+	# and only risks the last commits on power loss.
+	SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+	SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+	SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+	SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+	SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 64 * 1024))
+
+	# Read-endpoint response cache: 'memory', 'redis' (needs CACHE_REDIS_URL) or 'none'
+	CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+	CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+	CACHE_TTL = float(os.environ.get('CACHE_TTL', 60))
+	CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 1024))
+	CACHE_GRID_DEG = float(os.environ.get('CACHE_GRID_DEG', 0.001))
+
+	# How often a worker checks the table for writes made by other workers (0 disables)
+	SPATIAL_INDEX_RECHECK_SECONDS = float(os.environ.get('SPATIAL_INDEX_RECHECK_SECONDS', 5))
+
+	# Expiry levels: stocked medicines expiring within these many days raise alerts
+	EXPIRY_WARNING_DAYS = int(os.environ.get('EXPIRY_WARNING_DAYS', 90))
+	EXPIRY_CRITICAL_DAYS = int(os.environ.get('EXPIRY_CRITICAL_DAYS', 30))
+	# Suggested markdowns for each level, in percent (0 for none)
+	EXPIRY_WARNING_MARKDOWN_PCT = float(os.environ.get('EXPIRY_WARNING_MARKDOWN_PCT', 10))
+	EXPIRY_CRITICAL_MARKDOWN_PCT = float(os.environ.get('EXPIRY_CRITICAL_MARKDOWN_PCT', 30))
+	# Seconds between background expiry sweeps in each server process (0 disables)
+	EXPIRY_SWEEP_INTERVAL_SECONDS = float(os.environ.get('EXPIRY_SWEEP_INTERVAL_SECONDS', 900))
+
+	# Seconds between refreshes of the sales analytics rollups in each server process (0 disables)
+	ANALYTICS_REFRESH_SECONDS = float(os.environ.get('ANALYTICS_REFRESH_SECONDS', 60))
+
+	# Time zone of the pharmacies' opening hours, for the open_now and open_at filters
+	OPENING_HOURS_TIMEZONE = os.environ.get('OPENING_HOURS_TIMEZONE', 'Africa/Kigali')
+
+	# Lets ?_profile=1 return a cProfile report for any request; keep off in production
+	PROFILING_ENABLED = _flag('PROFILING_ENABLED', False)
+
+	# Pharmacy change feed: changes kept for delta sync, and how often older ones are pruned (0 disables)
+	CHANGE_LOG_RETENTION_DAYS = int(os.environ.get('CHANGE_LOG_RETENTION_DAYS', 90))
+	CHANGE_LOG_PRUNE_SECONDS = float(os.environ.get('CHANGE_LOG_PRUNE_SECONDS', 3600))
+
+	# Map tiles: highest zoom served, client cache lifetime in seconds, and how often stale tiles are rebuilt (0 disables)
+	TILE_MAX_ZOOM = int(os.environ.get('TILE_MAX_ZOOM', 18))
+	TILE_MAX_AGE = int(os.environ.get('TILE_MAX_AGE', 3600))
+	TILE_REFRESH_SECONDS = float(os.environ.get('TILE_REFRESH_SECONDS', 30))
+	# From this zoom tiles carry the candidates for the K nearest pharmacies, at most TILE_NEAREST_MAX of them
+	TILE_NEAREST_MIN_ZOOM = int(os.environ.get('TILE_NEAREST_MIN_ZOOM', 12))
+	TILE_NEAREST_K = int(os.environ.get('TILE_NEAREST_K', 10))
+	TILE_NEAREST_MAX = int(os.environ.get('TILE_NEAREST_MAX', 100))
+
+	# Map clustering: below CLUSTER_MAX_ZOOM pharmacies are grouped on cells 2**CLUSTER_CELL_BITS to a
+	# tile side (3: 32 pixel cells); one request covers at most CLUSTER_MAX_CELLS cells
+	CLUSTER_MAX_ZOOM = int(os.environ.get('CLUSTER_MAX_ZOOM', 16))
+	CLUSTER_CELL_BITS = int(os.environ.get('CLUSTER_CELL_BITS', 3))
+	CLUSTER_MAX_CELLS = int(os.environ.get('CLUSTER_MAX_CELLS', 16384))
+
+	# Run the schema step (database/migrate.py) at startup when the database is behind the models.
+	# Production runs it once per deploy with scripts/migrate.py; workers then only check a fingerprint
+	SCHEMA_AUTO_MIGRATE = _flag('SCHEMA_AUTO_MIGRATE', True)
+
+	# Serve the pharmacy list and detail from an in-memory copy of the table in each server process,
+	# catching up with other processes' writes at most this often
+	READ_MODEL_ENABLED = _flag('READ_MODEL_ENABLED', False)
+	READ_MODEL_RECHECK_SECONDS = float(os.environ.get('READ_MODEL_RECHECK_SECONDS', 5))
+
+	# Compress responses of at least COMPRESSION_MIN_BYTES with brotli (when installed) or gzip
+	COMPRESSION_ENABLED = _flag('COMPRESSION_ENABLED', True)
+	COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', 1024))
+	GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+	BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 5))
@@ -0,0 +1,63 @@
+from sqlalchemy import insert  # type: ignore
+
+from pharmacy_tracker_backend import db
+from pharmacy_tracker_backend.database.models import Pharmacy, PharmacyHours
+from pharmacy_tracker_backend.opening_hours import parse_opening_hours
+
+_BATCH = 500
+
+
+def create_missing_indexes():
+    """Create model indexes missing from tables that existed before the index was declared.
+
+    `create_all` only creates indexes together with a new table.
+    """
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+
+def backfill_pharmacy_services():
+    """Populate pharmacy_services for rows that only have the legacy JSON column.
+
+    Returns the number of pharmacies updated.
+    """
+    pending = Pharmacy.query.filter(Pharmacy.services.isnot(None), ~Pharmacy.service_entries.any())
+    updated = 0
+    while True:
+        batch = pending.limit(_BATCH).all()
+        if not batch:
+            return updated
+        for pharmacy in batch:
+            pharmacy.set_services(pharmacy.services)
+            if not pharmacy.service_entries:
+                # Unparseable or empty legacy value; clear it so it is not retried
+                pharmacy.services = None
+        db.session.commit()
+        updated += len(batch)
+
+
+def backfill_opening_hours():
+    """Parse opening hours for pharmacies that have text but no pharmacy_hours rows.
+
+    Text that cannot be parsed yields no rows and is simply parsed again on
+    the next run. Returns the number of pharmacies given a schedule.
+    """
+    pending = db.session.query(Pharmacy.id, Pharmacy.opening_hours).filter(
+        Pharmacy.opening_hours.isnot(None), ~Pharmacy.hour_entries.any()).order_by(Pharmacy.id)
+    updated = 0
+    last_id = ''
+    while True:
+        # Keyset over ids: unparseable rows stay pending and must not be read twice
+        batch = pending.filter(Pharmacy.id > last_id).limit(_BATCH).all()
+        if not batch:
+            return updated
+        rows = []
+        for pid, text in batch:
+            intervals = parse_opening_hours(text) or ()
+            rows.extend({'pharmacy_id': pid, 'opens_at': opens_at, 'closes_at': closes_at} for opens_at, closes_at in intervals)
+            updated += bool(intervals)
+        if rows:
+            db.session.execute(insert(PharmacyHours.__table__), rows)
+        db.session.commit()
+        last_id = batch[-1][0]
@@ -0,0 +1,92 @@
+"""
+The schema step: tables, indexes and the search index, backfills of legacy
+columns, and the derived tables built from existing data.
+
+Run it once per deploy, before the new code serves requests:
+
+    python scripts/migrate.py
+
+gunicorn.conf.py runs it in the master before any worker starts. Each run
+stores a fingerprint of the models' DDL and of `MIGRATION_VERSION` in
+`schema_state`. An app created with `SCHEMA_AUTO_MIGRATE` reads that row
+and migrates only when the fingerprint differs. A worker or script starting
+on a migrated database therefore pays for one query, not the whole step.
+"""
+import hashlib
+import time
+from datetime import datetime
+
+from sqlalchemy import select  # type: ignore
+from sqlalchemy.exc import OperationalError, ProgrammingError  # type: ignore
+from sqlalchemy.schema import CreateIndex, CreateTable  # type: ignore
+
+from pharmacy_tracker_backend import db
+from pharmacy_tracker_backend.database.models import SchemaState
+
+# Bump when a step changes in a way existing databases must go through again
+MIGRATION_VERSION = 1
+_STATE_ID = 1
+
+
+def schema_fingerprint():
+    """A hash of every model's DDL on the current database, and of MIGRATION_VERSION."""
+    dialect = db.engine.dialect
+    digest = hashlib.sha1(f'{MIGRATION_VERSION}:{dialect.name}'.encode('utf-8'))
+    for table in db.metadata.sorted_tables:
+        digest.update(str(CreateTable(table).compile(dialect=dialect)).encode('utf-8'))
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            digest.update(str(CreateIndex(index).compile(dialect=dialect)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def schema_current():
+    """True when the database was last migrated with the current models."""
+    try:
+        stored = db.session.execute(
+            select(SchemaState.fingerprint).where(SchemaState.id == _STATE_ID)).scalar()
+    except (OperationalError, ProgrammingError):
+        # No schema_state table: never migrated
+        db.session.rollback()
+        return False
+    db.session.commit()
+    return stored == schema_fingerprint()
+
+
+def migrate_schema():
+    """Bring the database up to date with the models and record it. Returns `(step, seconds)` pairs."""
+    from pharmacy_tracker_backend.clusters import ensure_cluster_hierarchy
+    from pharmacy_tracker_backend.database.backfill import (
+        backfill_opening_hours, backfill_pharmacy_services, create_missing_indexes
+    )
+    from pharmacy_tracker_backend.inventory import ensure_inventory_summary
+    from pharmacy_tracker_backend.search import ensure_search_index
+
+    steps = [
+        ('tables', db.create_all),
+        ('indexes', create_missing_indexes),
+        ('search index', ensure_search_index),
+        ('services backfill', backfill_pharmacy_services),
+        ('opening hours backfill', backfill_opening_hours),
+        ('inventory summary', ensure_inventory_summary),
+        ('cluster hierarchy', ensure_cluster_hierarchy),
+    ]
+    timings = []
+    for name, step in steps:
+        started = time.perf_counter()
+        step()
+        timings.append((name, time.perf_counter() - started))
+
+    state = db.session.get(SchemaState, _STATE_ID) or SchemaState(id=_STATE_ID)
+    state.fingerprint = schema_fingerprint()
+    state.migrated_at = datetime.utcnow()
+    db.session.add(state)
+    db.session.commit()
+    return timings
+
+
+def ensure_schema():
+    """Run the schema step when the database is behind the models. Returns True when it ran."""
+    if schema_current():
+        return False
+    migrate_schema()
+    return True
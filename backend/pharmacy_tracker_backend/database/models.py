@@ -2,6 +2,7 @@ from datetime import datetime
 import uuid
 import json
 from .. import db
+from ..opening_hours import parse_opening_hours
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -14,6 +15,12 @@ class User(db.Model):
 
 class Medicine(db.Model):
     __tablename__ = 'medicines'
+    __table_args__ = (
+        # Expiring-soon ranges, in expiry order
+        db.Index('ix_medicines_expiry_date_id', 'expiry_date', 'id'),
+        # Rows changed since the last expiry sweep
+        db.Index('ix_medicines_updated_at', 'updated_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
@@ -23,6 +30,18 @@ class Medicine(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'description': self.description,
+            'quantity': self.quantity,
+            'price': self.price,
+            'expiry_date': self.expiry_date.isoformat() if self.expiry_date else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
 class Supplier(db.Model):
     __tablename__ = 'suppliers'
     id = db.Column(db.Integer, primary_key=True)
@@ -33,8 +52,25 @@ class Supplier(db.Model):
     address = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'contact_person': self.contact_person,
+            'email': self.email,
+            'phone': self.phone,
+            'address': self.address,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
 class Transaction(db.Model):
     __tablename__ = 'transactions'
+    __table_args__ = (
+        # Per-medicine history, newest first
+        db.Index('ix_transactions_medicine_id_id', 'medicine_id', 'id'),
+        # Medicines bought from a supplier
+        db.Index('ix_transactions_supplier_id_medicine_id', 'supplier_id', 'medicine_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     type = db.Column(db.String(20), nullable=False)  # 'purchase' or 'sale'
     medicine_id = db.Column(db.Integer, db.ForeignKey('medicines.id'), nullable=False)
@@ -48,8 +84,174 @@ class Transaction(db.Model):
     medicine = db.relationship('Medicine', backref='transactions')
     supplier = db.relationship('Supplier', backref='transactions')
 
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'type': self.type,
+            'medicine_id': self.medicine_id,
+            'quantity': self.quantity,
+            'unit_price': self.unit_price,
+            'total_amount': self.total_amount,
+            'transaction_date': self.transaction_date.isoformat() if self.transaction_date else None,
+            'supplier_id': self.supplier_id
+        }
+
+class PharmacyStock(db.Model):
+    """How much of a medicine one pharmacy has on its shelves."""
+    __tablename__ = 'pharmacy_stock'
+    __table_args__ = (
+        # "Who stocks medicine X" lookups
+        db.Index('ix_pharmacy_stock_medicine_id_quantity', 'medicine_id', 'quantity'),
+    )
+
+    pharmacy_id = db.Column(db.String(36), db.ForeignKey('pharmacies.id', ondelete='CASCADE'), primary_key=True)
+    medicine_id = db.Column(db.Integer, db.ForeignKey('medicines.id', ondelete='CASCADE'), primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    price = db.Column(db.Float)  # the pharmacy's own price, if it shares one
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    def to_dict(self):
+        return {
+            'pharmacy_id': self.pharmacy_id,
+            'medicine_id': self.medicine_id,
+            'quantity': self.quantity,
+            'price': self.price,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class InventorySummary(db.Model):
+    """Running stock and trading totals, kept in step with every stock change."""
+    __tablename__ = 'inventory_summary'
+    id = db.Column(db.Integer, primary_key=True)  # single row, id 1
+    medicine_count = db.Column(db.Integer, nullable=False, default=0)
+    total_units = db.Column(db.Integer, nullable=False, default=0)
+    # Stock valued at each medicine's current price
+    stock_value = db.Column(db.Float, nullable=False, default=0.0)
+    purchase_count = db.Column(db.Integer, nullable=False, default=0)
+    purchase_units = db.Column(db.Integer, nullable=False, default=0)
+    purchase_amount = db.Column(db.Float, nullable=False, default=0.0)
+    sale_count = db.Column(db.Integer, nullable=False, default=0)
+    sale_units = db.Column(db.Integer, nullable=False, default=0)
+    sale_amount = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'medicine_count': self.medicine_count,
+            'total_units': self.total_units,
+            'stock_value': round(self.stock_value, 2),
+            'purchases': {'count': self.purchase_count, 'units': self.purchase_units,
+                          'amount': round(self.purchase_amount, 2)},
+            'sales': {'count': self.sale_count, 'units': self.sale_units, 'amount': round(self.sale_amount, 2)},
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class ExpiryAlert(db.Model):
+    """A stocked medicine that is expired or close to expiry, as of the last sweep."""
+    __tablename__ = 'expiry_alerts'
+    __table_args__ = (
+        db.Index('ix_expiry_alerts_level_expiry_date', 'level', 'expiry_date', 'medicine_id'),
+    )
+
+    medicine_id = db.Column(db.Integer, db.ForeignKey('medicines.id', ondelete='CASCADE'), primary_key=True)
+    level = db.Column(db.String(20), nullable=False)  # 'warning', 'critical' or 'expired'
+    expiry_date = db.Column(db.Date, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    price = db.Column(db.Float, nullable=False)
+    # Suggested discount; none for expired stock, which should be pulled
+    markdown_pct = db.Column(db.Float)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'medicine_id': self.medicine_id,
+            'level': self.level,
+            'expiry_date': self.expiry_date.isoformat() if self.expiry_date else None,
+            'quantity': self.quantity,
+            'price': self.price,
+            'markdown_pct': self.markdown_pct,
+            'suggested_price': round(self.price * (1 - self.markdown_pct / 100.0), 2) if self.markdown_pct else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class ExpirySummary(db.Model):
+    """Stock totals per expiry level, rewritten by every sweep."""
+    __tablename__ = 'expiry_summary'
+    level = db.Column(db.String(20), primary_key=True)
+    medicine_count = db.Column(db.Integer, nullable=False, default=0)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    stock_value = db.Column(db.Float, nullable=False, default=0.0)
+    as_of = db.Column(db.Date, nullable=False)
+
+    def to_dict(self):
+        return {
+            'level': self.level,
+            'medicine_count': self.medicine_count,
+            'units': self.units,
+            'stock_value': round(self.stock_value, 2),
+            'as_of': self.as_of.isoformat() if self.as_of else None
+        }
+
+class ExpirySweep(db.Model):
+    """Progress of the incremental expiry sweeps; a single row, id 1."""
+    __tablename__ = 'expiry_sweeps'
+    id = db.Column(db.Integer, primary_key=True)
+    swept_on = db.Column(db.Date)  # calendar day of the last sweep
+    watermark = db.Column(db.DateTime)  # medicines updated from here on are rechecked
+    settings = db.Column(db.String(100))  # thresholds the alerts were computed with
+    lease_until = db.Column(db.DateTime)  # set while a sweep runs
+    finished_at = db.Column(db.DateTime)
+    checked = db.Column(db.Integer, nullable=False, default=0)
+    changed = db.Column(db.Integer, nullable=False, default=0)
+
+class DailySales(db.Model):
+    """Transaction totals per UTC day and type, rolled up from `transactions`."""
+    __tablename__ = 'analytics_daily'
+    day = db.Column(db.Date, primary_key=True)
+    type = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    amount = db.Column(db.Float, nullable=False, default=0.0)
+
+class MedicineDailySales(db.Model):
+    """Transaction totals per UTC day, medicine and type."""
+    __tablename__ = 'analytics_medicine_daily'
+    day = db.Column(db.Date, primary_key=True)
+    medicine_id = db.Column(db.Integer, primary_key=True)
+    type = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    amount = db.Column(db.Float, nullable=False, default=0.0)
+
+class SupplierDailyPurchases(db.Model):
+    """Purchase totals per UTC day and supplier."""
+    __tablename__ = 'analytics_supplier_daily'
+    day = db.Column(db.Date, primary_key=True)
+    supplier_id = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    amount = db.Column(db.Float, nullable=False, default=0.0)
+
+class AnalyticsState(db.Model):
+    """How far the rollups have read `transactions`; a single row, id 1."""
+    __tablename__ = 'analytics_state'
+    id = db.Column(db.Integer, primary_key=True)
+    last_transaction_id = db.Column(db.Integer, nullable=False, default=0)
+    refreshed_at = db.Column(db.DateTime)
+    lease_until = db.Column(db.DateTime)  # set while a refresh runs
+
 class Pharmacy(db.Model):
     __tablename__ = 'pharmacies'
+    __table_args__ = (
+        # Range predicates for radius and bounding-box queries
+        db.Index('ix_pharmacies_lat_lng', 'latitude', 'longitude'),
+        # Keyset pagination order for the list endpoint
+        db.Index('ix_pharmacies_created_at_id', 'created_at', 'id'),
+        # max(updated_at) and "changed since" reads of the in-process caches
+        db.Index('ix_pharmacies_updated_at', 'updated_at'),
+    )
 
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     name = db.Column(db.String(255), nullable=False)
@@ -60,23 +262,41 @@ class Pharmacy(db.Model):
     latitude = db.Column(db.Float, nullable=False)
     longitude = db.Column(db.Float, nullable=False)
     opening_hours = db.Column(db.String(255))
-    services = db.Column(db.Text)  # Storing as JSON string
+    # JSON copy of the service names; feeds the search index. Reads use service_entries.
+    services = db.Column(db.Text)
     is_registered_by_pharmacy = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
 
+    service_entries = db.relationship('PharmacyService', lazy='selectin', cascade='all, delete-orphan',
+                                      order_by='PharmacyService.position')
+    # Parsed from opening_hours; only read by the open-now filter
+    hour_entries = db.relationship('PharmacyHours', cascade='all, delete-orphan', order_by='PharmacyHours.opens_at')
+
     def __repr__(self):
         return f'<Pharmacy {self.name}>'
 
+    def set_services(self, services):
+        """Replace the offered services with a list (or JSON list string) of names."""
+        names = normalize_services(services)
+        existing = {entry.service: entry for entry in self.service_entries}
+        entries = []
+        for position, name in enumerate(names):
+            entry = existing.get(name) or PharmacyService(service=name)
+            entry.position = position
+            entries.append(entry)
+        self.service_entries = entries
+        self.services = json.dumps(names) if names else None
+
+    def set_opening_hours(self, text):
+        """Set the opening hours text and its parsed weekly schedule."""
+        self.opening_hours = text
+        existing = {(entry.opens_at, entry.closes_at): entry for entry in self.hour_entries}
+        self.hour_entries = [existing.get(interval) or PharmacyHours(opens_at=interval[0], closes_at=interval[1])
+                             for interval in parse_opening_hours(text) or ()]
+
     def to_dict(self):
-        # Safely parse services stored as JSON string or return empty list
-        services = []
-        if self.services:
-            try:
-                services = json.loads(self.services)
-            except (ValueError, TypeError):
-                # fall back if already a Python structure stored as string
-                services = self.services if isinstance(self.services, (list, dict)) else []
+        services = [entry.service for entry in self.service_entries]
 
         # Safely format datetimes
         created = self.created_at.isoformat() if self.created_at else None
@@ -96,4 +316,119 @@ class Pharmacy(db.Model):
             'is_registered_by_pharmacy': self.is_registered_by_pharmacy,
             'created_at': created,
             'updated_at': updated
-        }
\ No newline at end of file
+        }
+
+class PharmacyChange(db.Model):
+    """One create, update or delete of a pharmacy. Ids order the change feed."""
+    __tablename__ = 'pharmacy_changes'
+    __table_args__ = (
+        # Pruning by age
+        db.Index('ix_pharmacy_changes_changed_at', 'changed_at'),
+        # Ids must never be reused, even once old changes are pruned
+        {'sqlite_autoincrement': True},
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    # No foreign key: the change outlives a deleted pharmacy
+    pharmacy_id = db.Column(db.String(36), nullable=False)
+    op = db.Column(db.String(10), nullable=False)  # 'upsert' or 'delete'
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+class PharmacyService(db.Model):
+    __tablename__ = 'pharmacy_services'
+    __table_args__ = (
+        # "Pharmacies offering X" lookups
+        db.Index('ix_pharmacy_services_service', 'service', 'pharmacy_id'),
+    )
+
+    pharmacy_id = db.Column(db.String(36), db.ForeignKey('pharmacies.id', ondelete='CASCADE'), primary_key=True)
+    service = db.Column(db.String(100), primary_key=True)
+    position = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<PharmacyService {self.pharmacy_id} {self.service}>'
+
+class PharmacyHours(db.Model):
+    """One interval of a pharmacy's weekly opening hours, in minutes since Monday 00:00."""
+    __tablename__ = 'pharmacy_hours'
+    __table_args__ = (
+        # "Open at minute m" lookups. Intervals never pass midnight, so only
+        # opens_at values within a day before m need scanning.
+        db.Index('ix_pharmacy_hours_opens_at', 'opens_at', 'closes_at', 'pharmacy_id'),
+    )
+
+    pharmacy_id = db.Column(db.String(36), db.ForeignKey('pharmacies.id', ondelete='CASCADE'), primary_key=True)
+    opens_at = db.Column(db.Integer, primary_key=True)
+    closes_at = db.Column(db.Integer, nullable=False)  # exclusive
+
+    def __repr__(self):
+        return f'<PharmacyHours {self.pharmacy_id} {self.opens_at}-{self.closes_at}>'
+
+class PharmacyCluster(db.Model):
+    """The pharmacies in one cell of the map clustering grid; a level-L cell is the zoom-L map tile."""
+    __tablename__ = 'pharmacy_clusters'
+
+    level = db.Column(db.Integer, primary_key=True)
+    cell_x = db.Column(db.Integer, primary_key=True)
+    cell_y = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False)
+    # Coordinate sums; the centroid is sum / count
+    lat_sum = db.Column(db.Float, nullable=False)
+    lng_sum = db.Column(db.Float, nullable=False)
+    # JSON list of a few ids of pharmacies in the cell
+    sample = db.Column(db.Text, nullable=False)
+
+    def __repr__(self):
+        return f'<PharmacyCluster {self.level}/{self.cell_x}/{self.cell_y} ({self.count})>'
+
+class MapTile(db.Model):
+    """A precomputed map tile: its response body and the area whose pharmacies it was built from."""
+    __tablename__ = 'map_tiles'
+    __table_args__ = (
+        # Tiles a write at a point can affect
+        db.Index('ix_map_tiles_reach', 'reach_min_lat', 'reach_max_lat', 'reach_min_lng', 'reach_max_lng'),
+        # Stale tiles waiting for the refresh job
+        db.Index('ix_map_tiles_stale', 'stale'),
+    )
+
+    z = db.Column(db.Integer, primary_key=True)
+    x = db.Column(db.Integer, primary_key=True)
+    y = db.Column(db.Integer, primary_key=True)
+    body = db.Column(db.LargeBinary, nullable=False)
+    etag = db.Column(db.String(40), nullable=False)
+    stale = db.Column(db.Boolean, nullable=False, default=False)
+    # A create, update or delete inside this box may change the body
+    reach_min_lat = db.Column(db.Float, nullable=False)
+    reach_min_lng = db.Column(db.Float, nullable=False)
+    reach_max_lat = db.Column(db.Float, nullable=False)
+    reach_max_lng = db.Column(db.Float, nullable=False)
+    generated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<MapTile {self.z}/{self.x}/{self.y}>'
+
+class SchemaState(db.Model):
+    """The schema the database was last migrated to; a single row, id 1."""
+    __tablename__ = 'schema_state'
+    id = db.Column(db.Integer, primary_key=True)
+    fingerprint = db.Column(db.String(40), nullable=False)  # see database/migrate.py
+    migrated_at = db.Column(db.DateTime, nullable=False)
+
+
+def normalize_services(value):
+    """Turn a list, JSON list string or comma-separated string into unique service names."""
+    if value is None:
+        return []
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            value = value.split(',')
+    if not isinstance(value, (list, tuple)):
+        return []
+    names = []
+    for item in value:
+        name = str(item).strip() if item is not None else ''
+        if name and name not in names:
+            names.append(name)
+    return names
@@ -0,0 +1,180 @@
+"""
+Content negotiation for response formats and compression.
+
+A list response such as `GET /api/pharmacies` repeats every field name in
+every item. Clients may ask for a columnar layout instead:
+
+- `Accept: application/vnd.pharmacy-tracker.columns+json` replaces `data`
+  with `count` and `columns`, one array per field in item order. Latitude
+  and longitude are typed arrays: `{"dtype": "<f8", "values": "<base64>"}`
+  holding little-endian float64s, ready for a `Float64Array`. Other keys of
+  the response, such as `next_cursor`, are unchanged.
+- `Accept: application/msgpack` sends the same layout as MessagePack, with
+  the typed arrays as raw bytes. Offered only when the msgpack package is
+  installed.
+
+Responses whose `data` is not a list of objects with the same fields stay
+JSON. The layout is built from the response's Python objects, before
+anything is serialized: `json_response` (serialization.py) and `jsonify`,
+through `ColumnarJSONProvider`, both go through `render`. Lists the read
+model already holds as JSON fragments are only served to JSON requests.
+
+With `COMPRESSION_ENABLED`, bodies of at least `COMPRESSION_MIN_BYTES` are
+compressed with brotli or gzip, whichever the client's `Accept-Encoding`
+prefers, by `encode_response` in an after_request hook. Views under
+`cached_response` (see cache.py) call it before storing, so their cache
+holds one entry per representation with the bytes ready to send. A body
+compressed by the hook gets a weak ETag.
+
+msgpack and brotli are in requirements.txt; without them MessagePack is not
+offered and compression falls back to gzip.
+"""
+import base64
+import gzip
+import sys
+from array import array
+
+from flask import Response, current_app, has_request_context, request  # type: ignore
+from flask.json.provider import DefaultJSONProvider  # type: ignore
+
+from pharmacy_tracker_backend.serialization import dumps
+
+try:
+    import brotli  # type: ignore
+except ImportError:  # pragma: no cover
+    brotli = None
+try:
+    import msgpack  # type: ignore
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+JSON_MIMETYPE = 'application/json'
+COLUMNS_MIMETYPE = 'application/vnd.pharmacy-tracker.columns+json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+_MSGPACK_ALIASES = ('application/msgpack', 'application/x-msgpack')
+_COMPRESSIBLE = {JSON_MIMETYPE, COLUMNS_MIMETYPE, MSGPACK_MIMETYPE}
+# Columns sent as typed arrays when every value is a number
+_TYPED_COLUMNS = ('latitude', 'longitude')
+
+
+def negotiate():
+    """`(mimetype, coding)` of the representation the current request prefers; coding may be None."""
+    offered = [JSON_MIMETYPE, COLUMNS_MIMETYPE] + (list(_MSGPACK_ALIASES) if msgpack is not None else [])
+    mimetype = request.accept_mimetypes.best_match(offered, default=JSON_MIMETYPE)
+    if mimetype in _MSGPACK_ALIASES:
+        mimetype = MSGPACK_MIMETYPE
+    coding = None
+    if current_app.config.get('COMPRESSION_ENABLED', True):
+        coding = request.accept_encodings.best_match(['br', 'gzip'] if brotli is not None else ['gzip'])
+    return mimetype, coding
+
+
+def _typed(values, binary):
+    if any(not isinstance(value, (int, float)) or isinstance(value, bool) for value in values):
+        return values
+    typed = array('d', values)
+    if sys.byteorder == 'big':
+        typed.byteswap()
+    raw = typed.tobytes()
+    return {'dtype': '<f8', 'values': raw if binary else base64.b64encode(raw).decode('ascii')}
+
+
+def columnar(payload, binary=False):
+    """The columnar layout of a decoded list response, or None when its `data` is not a list of like objects.
+
+    `binary` keeps typed arrays as bytes rather than base64 text.
+    """
+    data = payload.get('data') if isinstance(payload, dict) else None
+    if not isinstance(data, list) or not all(isinstance(item, dict) for item in data):
+        return None
+    names = list(data[0]) if data else []
+    if any(len(item) != len(names) or any(name not in item for name in names) for item in data):
+        return None
+    columns = {}
+    for name in names:
+        values = [item[name] for item in data]
+        columns[name] = _typed(values, binary) if name in _TYPED_COLUMNS else values
+    out = {}
+    for key, value in payload.items():
+        if key == 'data':
+            out['count'] = len(data)
+            out['columns'] = columns
+        else:
+            out[key] = value
+    return out
+
+
+def wants_json():
+    """True when the current request takes the plain JSON layout."""
+    return not has_request_context() or negotiate()[0] == JSON_MIMETYPE
+
+
+def convert(payload, mimetype):
+    """`payload` encoded as `mimetype`, or None when it has no columnar form."""
+    if mimetype == JSON_MIMETYPE:
+        return None
+    payload = columnar(payload, binary=mimetype == MSGPACK_MIMETYPE)
+    if payload is None:
+        return None
+    if mimetype == MSGPACK_MIMETYPE:
+        return msgpack.packb(payload, use_bin_type=True, default=_isoformat)
+    return dumps(payload)
+
+
+def _isoformat(value):
+    # Rows serialized for orjson keep their datetimes; send them as JSON would
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} cannot be sent as MessagePack')
+
+
+def render(payload, status=200):
+    """A response of `payload` in the layout the current request prefers, or None for plain JSON."""
+    if status != 200 or not has_request_context():
+        return None
+    mimetype = negotiate()[0]
+    body = convert(payload, mimetype)
+    if body is None:
+        return None
+    return Response(body, status=status, mimetype=mimetype)
+
+
+class ColumnarJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, with `jsonify` lists sent in the negotiated layout."""
+
+    def response(self, *args, **kwargs):
+        rendered = render(self._prepare_response_obj(args, kwargs))
+        return rendered if rendered is not None else super().response(*args, **kwargs)
+
+
+def compress(body, coding):
+    config = current_app.config
+    if coding == 'br':
+        return brotli.compress(body, quality=config.get('BROTLI_QUALITY', 5))
+    return gzip.compress(body, compresslevel=config.get('GZIP_LEVEL', 6), mtime=0)
+
+
+def encode_response(response):
+    """Compress `response` in place for the current request. Safe to call more than once."""
+    if response.status_code != 200 or response.is_streamed or response.direct_passthrough:
+        return response
+    if response.mimetype not in _COMPRESSIBLE:
+        return response
+    response.vary.add('Accept')
+    response.vary.add('Accept-Encoding')
+    coding = negotiate()[1]
+    if coding and 'Content-Encoding' not in response.headers:
+        body = response.get_data()
+        if len(body) >= current_app.config.get('COMPRESSION_MIN_BYTES', 1024):
+            response.set_data(compress(body, coding))
+            response.headers['Content-Encoding'] = coding
+            etag = response.headers.get('ETag')
+            if etag and not etag.startswith('W/'):
+                response.headers['ETag'] = 'W/' + etag
+    return response
+
+
+def init_response_encoding(app):
+    """Negotiate the format and compression of every response of `app`."""
+    app.json = ColumnarJSONProvider(app)
+    app.after_request(encode_response)
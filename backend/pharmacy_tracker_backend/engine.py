@@ -0,0 +1,99 @@
+"""
+Database engine setup: connection pools, SQLite pragmas and read replicas.
+
+Server databases get a sized, pre-pinged, recycled connection pool. SQLite
+connections are tuned for many readers and one writer: WAL journaling,
+`synchronous=NORMAL`, a busy timeout instead of an immediate "database is
+locked", memory-mapped reads and a larger page cache.
+
+When `DATABASE_REPLICA_URL` is set, `RoutingSession` sends the queries of GET
+and HEAD requests to the replica and everything else, including any flush,
+to the primary. Replicas lag, so reads right after a write may briefly miss
+it.
+"""
+from flask import has_request_context, request  # type: ignore
+from flask_sqlalchemy.session import Session  # type: ignore
+from sqlalchemy import event  # type: ignore
+
+REPLICA_BIND = 'replica'
+_READ_METHODS = {'GET', 'HEAD'}
+_JOURNAL_MODES = {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'}
+_SYNCHRONOUS = {'OFF', 'NORMAL', 'FULL', 'EXTRA'}
+
+
+def engine_options(config, url):
+    """SQLAlchemy engine options for `url` from the DB_* settings."""
+    if url.startswith('sqlite'):
+        # Pool sizing and pre-ping buy nothing for a local file
+        return {}
+    return {
+        'pool_size': config.get('DB_POOL_SIZE', 10),
+        'max_overflow': config.get('DB_MAX_OVERFLOW', 20),
+        'pool_timeout': config.get('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': config.get('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': config.get('DB_POOL_PRE_PING', True),
+    }
+
+
+def configure_database(app):
+    """Fill in engine options and the replica bind. Call before `db.init_app`."""
+    config = app.config
+    for name, allowed in (('SQLITE_JOURNAL_MODE', _JOURNAL_MODES), ('SQLITE_SYNCHRONOUS', _SYNCHRONOUS)):
+        value = str(config.get(name, '')).upper()
+        if value and value not in allowed:
+            raise ValueError(f'{name} must be one of: {", ".join(sorted(allowed))}')
+
+    if 'SQLALCHEMY_ENGINE_OPTIONS' not in config:
+        config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(config, config['SQLALCHEMY_DATABASE_URI'])
+    replica = config.get('DATABASE_REPLICA_URL')
+    if replica:
+        binds = dict(config.get('SQLALCHEMY_BINDS') or {})
+        binds.setdefault(REPLICA_BIND, dict(engine_options(config, replica), url=replica))
+        config['SQLALCHEMY_BINDS'] = binds
+
+
+def apply_sqlite_pragmas(engines, config):
+    """Tune every new connection of the SQLite engines in `engines`, a bind key -> engine map."""
+    for key, engine in engines.items():
+        if engine.dialect.name != 'sqlite':
+            continue
+        # A replica is only read, so it keeps whatever journal its primary set
+        event.listen(engine, 'connect', _pragma_listener(config, engine.url.database, writable=key != REPLICA_BIND))
+
+
+def _pragma_listener(config, database, writable):
+    on_disk = database not in (None, '', ':memory:')
+    statements = [f"PRAGMA busy_timeout = {int(config.get('SQLITE_BUSY_TIMEOUT_MS', 5000))}"]
+    if on_disk and writable and config.get('SQLITE_JOURNAL_MODE'):
+        statements.append(f"PRAGMA journal_mode = {config['SQLITE_JOURNAL_MODE'].upper()}")
+    if config.get('SQLITE_SYNCHRONOUS'):
+        statements.append(f"PRAGMA synchronous = {config['SQLITE_SYNCHRONOUS'].upper()}")
+    if on_disk:
+        statements.append(f"PRAGMA mmap_size = {int(config.get('SQLITE_MMAP_SIZE', 0))}")
+    # A negative cache_size is in KiB rather than pages
+    statements.append(f"PRAGMA cache_size = {-int(config.get('SQLITE_CACHE_SIZE_KB', 2000))}")
+
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+
+    return set_pragmas
+
+
+def _is_read_request():
+    return has_request_context() and request.method in _READ_METHODS
+
+
+class RoutingSession(Session):
+    """Session that reads from the replica bind while serving GET and HEAD requests."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and _is_read_request():
+            engine = self._db.engines.get(REPLICA_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
@@ -0,0 +1,207 @@
+"""
+Medicine expiry: expiring-soon queries, scheduled sweeps and per-level totals.
+
+A stocked medicine is at one of three levels as its expiry date nears:
+`warning` within EXPIRY_WARNING_DAYS, `critical` within EXPIRY_CRITICAL_DAYS
+and `expired` once the date has passed.
+
+`sweep_expiry()` keeps `expiry_alerts` (one row per medicine at a level,
+with a suggested markdown) and `expiry_summary` (totals per level) current.
+A medicine's level only changes when its row is written or when the
+calendar carries its expiry date across a threshold, so a sweep reads only
+
+- medicines updated since the previous sweep started, and
+- for each threshold, medicines whose expiry date lies in the days the
+  threshold moved over since the previous sweep,
+
+both through indexes. Dashboards read the summary table instead of
+scanning `medicines` by date.
+
+Sweeps claim a lease on the `expiry_sweeps` row, so the background job of
+every worker (see `scheduler.py`) can run without two sweeps overlapping.
+"""
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import bindparam, delete, func, insert, select, update  # type: ignore
+
+from pharmacy_tracker_backend import db
+from pharmacy_tracker_backend.database.models import (
+    ExpiryAlert, ExpirySummary, ExpirySweep, Medicine, PharmacyStock, Transaction
+)
+from pharmacy_tracker_backend.scheduler import claim_lease, release_lease
+
+LEVELS = ('warning', 'critical', 'expired')
+_STATE_ID = 1
+# A sweep that has not finished after this long is assumed dead
+_LEASE_SECONDS = 600
+# Rows written just before a sweep started may commit after it read them
+_WATERMARK_SLACK = timedelta(seconds=60)
+_IN_CHUNK = 500
+
+_medicines = Medicine.__table__
+_alerts = ExpiryAlert.__table__
+_summary = ExpirySummary.__table__
+
+
+def expiry_settings(config):
+    """Return `(critical_days, warning_days, {level: markdown_pct})` from the EXPIRY_* settings."""
+    critical = int(config.get('EXPIRY_CRITICAL_DAYS', 30))
+    warning = int(config.get('EXPIRY_WARNING_DAYS', 90))
+    if not 0 <= critical <= warning:
+        raise ValueError('EXPIRY_CRITICAL_DAYS must be between 0 and EXPIRY_WARNING_DAYS')
+    markdowns = {'warning': config.get('EXPIRY_WARNING_MARKDOWN_PCT') or None,
+                 'critical': config.get('EXPIRY_CRITICAL_MARKDOWN_PCT') or None,
+                 'expired': None}
+    return critical, warning, markdowns
+
+
+def expiry_level(expiry_date, today, critical_days, warning_days):
+    """Level of a medicine expiring on `expiry_date`, or None if it is not close to expiry."""
+    if expiry_date is None:
+        return None
+    days = (expiry_date - today).days
+    if days < 0:
+        return 'expired'
+    if days <= critical_days:
+        return 'critical'
+    if days <= warning_days:
+        return 'warning'
+    return None
+
+
+def expiring_medicines(days, today=None, pharmacy_id=None, supplier_id=None, include_expired=False):
+    """Query of `(Medicine, quantity)` expiring within `days`, in `(expiry_date, id)` order.
+
+    With `pharmacy_id` the quantity is what that pharmacy holds; with
+    `supplier_id` only medicines bought from that supplier are included.
+    Out of stock medicines are left out.
+    """
+    today = today or date.today()
+    if pharmacy_id is not None:
+        quantity = PharmacyStock.quantity
+        query = (db.session.query(Medicine, quantity).join(PharmacyStock, PharmacyStock.medicine_id == Medicine.id)
+                 .filter(PharmacyStock.pharmacy_id == pharmacy_id))
+    else:
+        quantity = func.coalesce(Medicine.quantity, 0)
+        query = db.session.query(Medicine, quantity)
+    query = query.filter(Medicine.expiry_date <= today + timedelta(days=days), quantity > 0)
+    if not include_expired:
+        query = query.filter(Medicine.expiry_date >= today)
+    if supplier_id is not None:
+        bought = select(Transaction.medicine_id).where(Transaction.supplier_id == supplier_id,
+                                                       Transaction.type == 'purchase')
+        query = query.filter(Medicine.id.in_(bought))
+    return query.order_by(Medicine.expiry_date, Medicine.id)
+
+
+def sweep_expiry(config, today=None):
+    """Bring the alerts and the summary up to date and commit.
+
+    Returns a report dict, or None when another sweep holds the lease.
+    """
+    today = today or date.today()
+    started = datetime.utcnow()
+    if not claim_lease(ExpirySweep, started, _LEASE_SECONDS):
+        return None
+    try:
+        return _sweep(config, today, started)
+    except Exception:
+        db.session.rollback()
+        release_lease(ExpirySweep)
+        raise
+
+
+def _sweep(config, today, started):
+    critical, warning, markdowns = expiry_settings(config)
+    settings = f'{critical}/{warning}/{markdowns["critical"]}/{markdowns["warning"]}'
+    state = db.session.get(ExpirySweep, _STATE_ID)
+    db.session.refresh(state)
+
+    incremental = (state.swept_on is not None and state.watermark is not None and state.settings == settings
+                   and state.swept_on <= today)
+    ids = set()
+    if incremental:
+        ids.update(db.session.scalars(select(_medicines.c.id).where(_medicines.c.updated_at >= state.watermark)))
+        if today > state.swept_on:
+            # Threshold t moves from swept_on + t to today + t; "expired" starts the day after the date
+            for offset in (-1, critical, warning):
+                ids.update(db.session.scalars(select(_medicines.c.id).where(
+                    _medicines.c.expiry_date > state.swept_on + timedelta(days=offset),
+                    _medicines.c.expiry_date <= today + timedelta(days=offset))))
+    else:
+        # First sweep, or the thresholds changed: everything inside the window plus every alert
+        ids.update(db.session.scalars(select(_medicines.c.id).where(
+            _medicines.c.expiry_date <= today + timedelta(days=warning))))
+        ids.update(db.session.scalars(select(_alerts.c.medicine_id)))
+
+    changed = 0
+    ids = sorted(ids)
+    for start in range(0, len(ids), _IN_CHUNK):
+        changed += _sweep_chunk(ids[start:start + _IN_CHUNK], today, critical, warning, markdowns)
+    _refresh_summary(today)
+
+    report = {'checked': len(ids), 'changed': changed, 'incremental': incremental, 'as_of': today.isoformat()}
+    release_lease(ExpirySweep, swept_on=today, watermark=started - _WATERMARK_SLACK, settings=settings,
+                  finished_at=datetime.utcnow(), checked=len(ids), changed=changed)
+    return report
+
+
+def _sweep_chunk(ids, today, critical, warning, markdowns):
+    medicines = db.session.execute(
+        select(_medicines.c.id, _medicines.c.expiry_date, func.coalesce(_medicines.c.quantity, 0), _medicines.c.price)
+        .where(_medicines.c.id.in_(ids))).all()
+    current = {row.medicine_id: row for row in db.session.execute(
+        select(_alerts.c.medicine_id, _alerts.c.level, _alerts.c.expiry_date, _alerts.c.quantity, _alerts.c.price)
+        .where(_alerts.c.medicine_id.in_(ids)))}
+
+    now = datetime.utcnow()
+    wanted, inserts, updates = set(), [], []
+    for medicine_id, expiry_date, quantity, price in medicines:
+        level = expiry_level(expiry_date, today, critical, warning) if quantity > 0 else None
+        if level is None:
+            continue
+        wanted.add(medicine_id)
+        alert = current.get(medicine_id)
+        if alert is None:
+            inserts.append({'medicine_id': medicine_id, 'level': level, 'expiry_date': expiry_date,
+                            'quantity': quantity, 'price': price, 'markdown_pct': markdowns[level],
+                            'created_at': now, 'updated_at': now})
+        elif (alert.level, alert.expiry_date, alert.quantity, alert.price) != (level, expiry_date, quantity, price):
+            updates.append({'mid': medicine_id, 'new_level': level, 'expires': expiry_date, 'qty': quantity,
+                            'unit_price': price, 'markdown': markdowns[level], 'now': now})
+    # Medicines that left every level, were sold out or were deleted
+    stale = [medicine_id for medicine_id in current if medicine_id not in wanted]
+
+    if stale:
+        db.session.execute(delete(_alerts).where(_alerts.c.medicine_id.in_(stale)))
+    if updates:
+        db.session.execute(
+            update(_alerts).where(_alerts.c.medicine_id == bindparam('mid')).values(
+                level=bindparam('new_level'), expiry_date=bindparam('expires'), quantity=bindparam('qty'),
+                price=bindparam('unit_price'), markdown_pct=bindparam('markdown'),
+                updated_at=bindparam('now')),
+            updates)
+    if inserts:
+        db.session.execute(insert(_alerts), inserts)
+    return len(stale) + len(updates) + len(inserts)
+
+
+def _refresh_summary(today):
+    """Rewrite the per-level totals from the alerts, which only hold medicines near expiry."""
+    rows = {level: {'level': level, 'medicine_count': 0, 'units': 0, 'stock_value': 0.0, 'as_of': today}
+            for level in LEVELS}
+    for level, count, units, value in db.session.execute(
+            select(_alerts.c.level, func.count(), func.sum(_alerts.c.quantity),
+                   func.sum(_alerts.c.quantity * _alerts.c.price)).group_by(_alerts.c.level)):
+        rows[level].update(medicine_count=count, units=units, stock_value=value)
+    db.session.execute(delete(_summary))
+    db.session.execute(insert(_summary), list(rows.values()))
+
+
+def delete_expiry_alert(medicine_id):
+    """Delete a medicine's alert inside the caller's transaction; the summary catches up on the next sweep."""
+    db.session.execute(delete(_alerts).where(_alerts.c.medicine_id == medicine_id))
+
+
+def get_expiry_state():
+    return db.session.get(ExpirySweep, _STATE_ID)
@@ -0,0 +1,5 @@
+from .bbox import intersect_bbox, parse_bbox, radius_bbox
+from .haversine import EARTH_RADIUS_KM, haversine_km
+from .spatial_index import SpatialIndex, forget_pharmacy, get_spatial_index, sync_pharmacy, sync_points
+from .distance import DistanceEngine, get_distance_engine
+from .tiles import tile_bounds, tile_center, tile_for, tile_radius_km, world_position
@@ -0,0 +1,40 @@
+import math
+
+from pharmacy_tracker_backend.geo.haversine import EARTH_RADIUS_KM
+
+
+def parse_bbox(value):
+    """Parse `minLat,minLng,maxLat,maxLng` into a tuple of floats.
+
+    Raises ValueError for malformed or inverted boxes.
+    """
+    parts = [part.strip() for part in value.split(',')]
+    if len(parts) != 4:
+        raise ValueError('bbox must be minLat,minLng,maxLat,maxLng')
+    min_lat, min_lng, max_lat, max_lng = (float(part) for part in parts)
+    if min_lat > max_lat or min_lng > max_lng:
+        raise ValueError('bbox minimums must not exceed maximums')
+    return min_lat, min_lng, max_lat, max_lng
+
+
+def radius_bbox(lat, lng, radius_km):
+    """Smallest lat/lng box containing every point within `radius_km` of the origin."""
+    delta = radius_km / EARTH_RADIUS_KM
+    min_lat = lat - math.degrees(delta)
+    max_lat = lat + math.degrees(delta)
+    if min_lat <= -90.0 or max_lat >= 90.0:
+        # The circle covers a pole, so every longitude is reachable
+        return max(-90.0, min_lat), -180.0, min(90.0, max_lat), 180.0
+    ratio = math.sin(delta) / math.cos(math.radians(lat))
+    if ratio >= 1.0:
+        return min_lat, -180.0, max_lat, 180.0
+    delta_lng = math.degrees(math.asin(ratio))
+    return min_lat, max(-180.0, lng - delta_lng), max_lat, min(180.0, lng + delta_lng)
+
+
+def intersect_bbox(a, b):
+    """Intersection of two boxes, or None when they do not overlap."""
+    box = (max(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), min(a[3], b[3]))
+    if box[0] > box[2] or box[1] > box[3]:
+        return None
+    return box
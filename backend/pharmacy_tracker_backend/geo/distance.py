@@ -0,0 +1,130 @@
+"""
+Vectorized distance ranking over a columnar snapshot of pharmacy coordinates.
+
+The snapshot keeps latitude/longitude in radians plus a precomputed cos(lat)
+as float64 arrays, so a Haversine pass over every pharmacy is a handful of
+NumPy operations and top-k selection is an `argpartition` instead of a full
+sort. `rank_many` ranks several origins at once for batch jobs such as route
+planning.
+"""
+import math
+
+import numpy as np  # type: ignore
+from flask import current_app  # type: ignore
+
+from pharmacy_tracker_backend.geo.haversine import EARTH_RADIUS_KM
+from pharmacy_tracker_backend.geo.spatial_index import get_spatial_index
+
+# Upper bound on origin x pharmacy matrix cells computed at once by rank_many
+_MATRIX_BUDGET = 4_000_000
+
+
+class DistanceEngine:
+
+    def __init__(self):
+        self.version = None
+        # (ids, lat_rad, lng_rad, cos_lat), swapped as a whole so readers
+        # never see a half-built snapshot
+        self._snapshot = ([], np.empty(0), np.empty(0), np.empty(0))
+
+    def __len__(self):
+        return len(self._snapshot[0])
+
+    @property
+    def ids(self):
+        return self._snapshot[0]
+
+    def load(self, rows, version=None):
+        """Replace the snapshot with `(id, latitude, longitude)` rows."""
+        rows = [(str(pid), float(lat), float(lng)) for pid, lat, lng in rows if lat is not None and lng is not None]
+        ids = [pid for pid, _, _ in rows]
+        lat = np.radians(np.fromiter((r[1] for r in rows), dtype=np.float64, count=len(rows)))
+        lng = np.radians(np.fromiter((r[2] for r in rows), dtype=np.float64, count=len(rows)))
+        self._snapshot = (ids, lat, lng, np.cos(lat))
+        self.version = version
+
+    def distances(self, lat, lng):
+        """Distance in km from the origin to every pharmacy, in `ids` order."""
+        return _haversine(self._snapshot, np.radians(lat), np.radians(lng))
+
+    def nearest(self, lat, lng, k=None, after=None):
+        """Return up to `k` `(distance_km, pharmacy_id)` pairs, closest first.
+
+        `after` is a `(distance_km, pharmacy_id)` pair from a previous page;
+        only pairs ranked strictly after it are returned.
+        """
+        snapshot = self._snapshot
+        ids = snapshot[0]
+        if not ids or (k is not None and k <= 0):
+            return []
+        d = _haversine(snapshot, np.radians(lat), np.radians(lng))
+        if after is not None:
+            d[d < after[0]] = np.inf
+            for i in np.flatnonzero(d == after[0]):
+                if ids[i] <= after[1]:
+                    d[i] = np.inf
+        order = self._top_k(d, k)
+        if k is not None and len(order) == k:
+            # Pull in every row tied with the k-th distance so the cut below
+            # follows (distance, id) order, which is what page cursors assume
+            order = np.union1d(order, np.flatnonzero(d == d[order[-1]]))
+        ranked = sorted((float(d[i]), ids[i]) for i in order)
+        if after is not None:
+            ranked = [pair for pair in ranked if pair[0] != math.inf]
+        return ranked[:k] if k is not None else ranked
+
+    def rank_many(self, origins, k):
+        """Rank the `k` nearest pharmacies for each `(lat, lng)` origin.
+
+        Returns one list of `(distance_km, pharmacy_id)` pairs per origin.
+        """
+        origins = list(origins)
+        snapshot = self._snapshot
+        ids = snapshot[0]
+        if not ids or k <= 0:
+            return [[] for _ in origins]
+
+        results = []
+        step = max(1, _MATRIX_BUDGET // len(ids))
+        for start in range(0, len(origins), step):
+            chunk = np.radians(np.asarray(origins[start:start + step], dtype=np.float64).reshape(-1, 2))
+            a = _haversine(snapshot, chunk[:, 0:1], chunk[:, 1:2])
+            for row in a:
+                results.append([(float(row[i]), ids[i]) for i in self._top_k(row, k)])
+        return results
+
+    @staticmethod
+    def _top_k(d, k):
+        if k is None or k >= len(d):
+            return np.argsort(d, kind='stable')
+        part = np.argpartition(d, k - 1)[:k]
+        return part[np.argsort(d[part], kind='stable')]
+
+
+def _haversine(snapshot, phi, lam):
+    # phi/lam are origin radians: scalars, or (m, 1) columns for an (m, n) result
+    _, lat_rad, lng_rad, cos_lat = snapshot
+    a = np.sin((lat_rad - phi) * 0.5)
+    a *= a
+    b = np.sin((lng_rad - lam) * 0.5)
+    b *= b
+    b *= cos_lat
+    b *= np.cos(phi)
+    a += b
+    np.minimum(a, 1.0, out=a)
+    np.sqrt(a, out=a)
+    np.arcsin(a, out=a)
+    a *= 2 * EARTH_RADIUS_KM
+    return a
+
+
+def get_distance_engine():
+    """Return the app's distance engine, rebuilt if the spatial index changed since the last snapshot."""
+    engine = current_app.extensions.get('distance_engine')
+    if engine is None:
+        engine = current_app.extensions.setdefault('distance_engine', DistanceEngine())
+    index = get_spatial_index()
+    if engine.version != index.version:
+        version, rows = index.points()
+        engine.load(rows, version)
+    return engine
@@ -0,0 +1,285 @@
+"""
+In-process grid index over pharmacy coordinates.
+
+Pharmacies are bucketed into fixed-size lat/lng cells. Nearest-N queries walk
+the cells in expanding square rings around the origin and keep a bounded heap
+of the best candidates, stopping as soon as no unvisited ring can contain a
+closer point. The cost therefore depends on how dense the area around the
+origin is, not on the total number of pharmacies. Rings are clipped to the
+extent of the occupied cells and start at the first one that reaches it,
+so an origin far from every pharmacy does not walk the empty space in
+between.
+
+Longitudes are not wrapped at the antimeridian.
+
+Each worker process holds its own index and applies its own writes directly.
+At most once every `SPATIAL_INDEX_RECHECK_SECONDS` it compares the table's
+row count and latest `updated_at` with the values seen at the last check.
+When they differ, the rows updated since are read into the index; only
+when the row count still does not match, after a delete by another worker,
+is the whole index reloaded. A worker's own writes therefore cost a small
+catch-up read, not a reload.
+"""
+import heapq
+import math
+import threading
+import time
+
+from flask import current_app  # type: ignore
+from sqlalchemy import func  # type: ignore
+
+from pharmacy_tracker_backend import db
+from pharmacy_tracker_backend.database.models import Pharmacy
+from pharmacy_tracker_backend.geo.haversine import EARTH_RADIUS_KM, haversine_km
+
+DEFAULT_CELL_DEG = 0.05  # roughly 5.5 km at the equator
+
+
+class _DescendingId(str):
+    # Inverts id ordering so the negated heap entries evict the largest
+    # (distance, id) pair on distance ties
+    __slots__ = ()
+
+    def __lt__(self, other):
+        return str.__gt__(self, other)
+
+    def __gt__(self, other):
+        return str.__lt__(self, other)
+
+
+class SpatialIndex:
+
+    def __init__(self, cell_deg=DEFAULT_CELL_DEG):
+        self.cell_deg = float(cell_deg)
+        self.loaded = False
+        self.version = 0  # bumped on every mutation so snapshots can tell they are stale
+        # Table (count, max(updated_at)) when last loaded, and when it was last compared
+        self.signature = None
+        self.checked_at = 0.0
+        self._cells = {}   # (row, col) -> {pharmacy_id: (lat, lng)}
+        self._points = {}  # pharmacy_id -> (lat, lng)
+        # Bounds of every cell ever occupied; used to stop ring expansion
+        self._row_min = self._row_max = self._col_min = self._col_max = None
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, pharmacy_id):
+        return pharmacy_id in self._points
+
+    def _cell(self, lat, lng):
+        return math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg)
+
+    def load(self, rows):
+        """Replace the index contents with `(id, latitude, longitude)` rows."""
+        with self._lock:
+            self._cells = {}
+            self._points = {}
+            self._row_min = self._row_max = self._col_min = self._col_max = None
+            for pharmacy_id, lat, lng in rows:
+                self._insert(str(pharmacy_id), lat, lng)
+            self.loaded = True
+            self.version += 1
+
+    def upsert(self, pharmacy_id, lat, lng):
+        with self._lock:
+            pharmacy_id = str(pharmacy_id)
+            self._discard(pharmacy_id)
+            self._insert(pharmacy_id, lat, lng)
+            self.version += 1
+
+    def remove(self, pharmacy_id):
+        with self._lock:
+            self._discard(str(pharmacy_id))
+            self.version += 1
+
+    def points(self):
+        """Return `(version, [(id, lat, lng), ...])` as one consistent snapshot."""
+        with self._lock:
+            return self.version, [(pid, lat, lng) for pid, (lat, lng) in self._points.items()]
+
+    def _insert(self, pharmacy_id, lat, lng):
+        if lat is None or lng is None:
+            return
+        lat, lng = float(lat), float(lng)
+        row, col = self._cell(lat, lng)
+        self._cells.setdefault((row, col), {})[pharmacy_id] = (lat, lng)
+        self._points[pharmacy_id] = (lat, lng)
+        if self._row_min is None:
+            self._row_min = self._row_max = row
+            self._col_min = self._col_max = col
+        else:
+            self._row_min = min(self._row_min, row)
+            self._row_max = max(self._row_max, row)
+            self._col_min = min(self._col_min, col)
+            self._col_max = max(self._col_max, col)
+
+    def _discard(self, pharmacy_id):
+        point = self._points.pop(pharmacy_id, None)
+        if point is None:
+            return
+        key = self._cell(*point)
+        bucket = self._cells.get(key)
+        if bucket is not None:
+            bucket.pop(pharmacy_id, None)
+            if not bucket:
+                del self._cells[key]
+
+    def _ring(self, row, col, r):
+        # Only the cells of the ring inside the occupied extent
+        if r == 0:
+            yield row, col
+            return
+        col_lo, col_hi = max(col - r, self._col_min), min(col + r, self._col_max)
+        for edge in (row - r, row + r):
+            if self._row_min <= edge <= self._row_max:
+                for c in range(col_lo, col_hi + 1):
+                    yield edge, c
+        row_lo, row_hi = max(row - r + 1, self._row_min), min(row + r - 1, self._row_max)
+        for edge in (col - r, col + r):
+            if self._col_min <= edge <= self._col_max:
+                for cell_row in range(row_lo, row_hi + 1):
+                    yield cell_row, edge
+
+    def _ring_lower_bound_km(self, lat, r):
+        # Every point outside rings 0..r differs from the origin by at least
+        # r cells in latitude or in longitude.
+        delta = math.radians(r * self.cell_deg)
+        lat_bound = EARTH_RADIUS_KM * delta
+        max_lat = min(90.0, abs(lat) + (r + 1) * self.cell_deg)
+        scale = math.cos(math.radians(max_lat)) * math.sin(delta / 2)
+        lng_bound = 2 * EARTH_RADIUS_KM * math.asin(min(1.0, max(0.0, scale)))
+        return min(lat_bound, lng_bound)
+
+    def location(self, pharmacy_id):
+        """`(lat, lng)` of an indexed pharmacy, or None."""
+        return self._points.get(pharmacy_id)
+
+    def nearest(self, lat, lng, k=None, after=None, accept=None, max_km=None):
+        """Return up to `k` `(distance_km, pharmacy_id)` pairs, closest first.
+
+        With `k=None` every indexed pharmacy is ranked. `after` is a
+        `(distance_km, pharmacy_id)` pair from a previous page; only pairs
+        ranked strictly after it are returned. `accept`, if given, is a
+        predicate on pharmacy ids; other pharmacies are skipped. With
+        `max_km`, pharmacies farther than that are skipped and the rings
+        beyond it are never visited.
+        """
+        with self._lock:
+            if k is not None and k <= 0:
+                return []
+            if k is None or k >= len(self._points):
+                return self._scan(lat, lng, k, after, accept, max_km)
+
+            row, col = self._cell(lat, lng)
+            # Rings closer than the occupied extent are empty: start at the first one touching it
+            first_ring = max(0, self._row_min - row, row - self._row_max, self._col_min - col, col - self._col_max)
+            max_ring = max(abs(row - self._row_min), abs(row - self._row_max),
+                           abs(col - self._col_min), abs(col - self._col_max))
+            if max_ring - first_ring > len(self._cells):
+                # Sparse extent: more rings to walk than occupied cells to scan
+                return self._scan(lat, lng, k, after, accept, max_km)
+            heap = []  # max-heap of the k best (distance, id) pairs, stored negated
+            for r in range(first_ring, max_ring + 1):
+                for key in self._ring(row, col, r):
+                    bucket = self._cells.get(key)
+                    if not bucket:
+                        continue
+                    for pid, (p_lat, p_lng) in bucket.items():
+                        if accept is not None and not accept(pid):
+                            continue
+                        d = haversine_km(lat, lng, p_lat, p_lng)
+                        if max_km is not None and d > max_km:
+                            continue
+                        if after is not None and (d, pid) <= after:
+                            continue
+                        item = (-d, _DescendingId(pid))
+                        if len(heap) < k:
+                            heapq.heappush(heap, item)
+                        elif item > heap[0]:
+                            heapq.heapreplace(heap, item)
+                bound = self._ring_lower_bound_km(lat, r)
+                if len(heap) == k and -heap[0][0] <= bound:
+                    break
+                if max_km is not None and bound > max_km:
+                    break
+
+            return sorted((-d, str(pid)) for d, pid in heap)
+
+    def _scan(self, lat, lng, k, after, accept, max_km):
+        # Every point, for rankings the ring walk would not save work on
+        ranked = [(haversine_km(lat, lng, p_lat, p_lng), pid)
+                  for pid, (p_lat, p_lng) in self._points.items() if accept is None or accept(pid)]
+        if after is not None:
+            ranked = [item for item in ranked if item > after]
+        if max_km is not None:
+            ranked = [item for item in ranked if item[0] <= max_km]
+        return sorted(ranked) if k is None else heapq.nsmallest(k, ranked)
+
+
+def get_spatial_index():
+    """Return the spatial index of the current app, loading it on first use."""
+    index = current_app.extensions.get('spatial_index')
+    if index is None:
+        index = current_app.extensions.setdefault(
+            'spatial_index', SpatialIndex(current_app.config.get('SPATIAL_INDEX_CELL_DEG', DEFAULT_CELL_DEG)))
+    if not index.loaded:
+        with index._lock:
+            if not index.loaded:
+                _reload(index)
+    else:
+        interval = current_app.config.get('SPATIAL_INDEX_RECHECK_SECONDS', 0)
+        if interval and time.monotonic() - index.checked_at >= interval:
+            with index._lock:
+                if time.monotonic() - index.checked_at >= interval:
+                    index.checked_at = time.monotonic()
+                    if _table_signature() != index.signature and not _catch_up(index):
+                        _reload(index)
+    return index
+
+
+def _table_signature():
+    return tuple(db.session.query(func.count(Pharmacy.id), func.max(Pharmacy.updated_at)).one())
+
+
+def _reload(index):
+    # Signature first: a write landing in between causes one extra reload, never a missed one
+    index.signature = _table_signature()
+    index.checked_at = time.monotonic()
+    index.load(db.session.query(Pharmacy.id, Pharmacy.latitude, Pharmacy.longitude))
+
+
+def _catch_up(index):
+    """Read rows updated since the last check. False when the index must be reloaded instead."""
+    since = index.signature[1] if index.signature else None
+    if since is None:
+        return False
+    # Signature first, as in _reload
+    index.signature = _table_signature()
+    rows = db.session.query(Pharmacy.id, Pharmacy.latitude, Pharmacy.longitude).filter(Pharmacy.updated_at >= since)
+    for pid, lat, lng in rows:
+        index.upsert(pid, lat, lng)
+    # Deletes leave no row to read
+    return len(index) == index.signature[0]
+
+
+def sync_pharmacy(pharmacy):
+    """Reflect a created or updated pharmacy in the index, if it is loaded."""
+    index = current_app.extensions.get('spatial_index')
+    if index is not None and index.loaded:
+        index.upsert(pharmacy.id, pharmacy.latitude, pharmacy.longitude)
+
+
+def sync_points(points):
+    """Reflect many `(id, latitude, longitude)` rows in the index, if it is loaded."""
+    index = current_app.extensions.get('spatial_index')
+    if index is not None and index.loaded:
+        for pid, lat, lng in points:
+            index.upsert(pid, lat, lng)
+
+
+def forget_pharmacy(pharmacy_id):
+    index = current_app.extensions.get('spatial_index')
+    if index is not None and index.loaded:
+        index.remove(pharmacy_id)
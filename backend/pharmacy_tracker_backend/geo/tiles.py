@@ -0,0 +1,56 @@
+"""
+Web Mercator tile arithmetic for the `z/x/y` scheme used by web and mobile maps.
+
+Tile (0, 0) at zoom z is the north-west corner; x grows east and y south.
+A point on the boundary between two tiles belongs to the east or south one,
+the same way `tile_for` floors its position.
+"""
+import math
+
+import numpy as np  # type: ignore
+
+from pharmacy_tracker_backend.geo.haversine import haversine_km
+
+# Latitude at which the Mercator square ends
+MAX_LATITUDE = 85.0511287798
+
+
+def world_position(lat, lng):
+    """`(fx, fy)` of a point on the unit Mercator square, both in [0, 1]. Also takes numpy arrays."""
+    s = np.sin(np.radians(np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE)))
+    return (np.asarray(lng) + 180.0) / 360.0, 0.5 - np.log((1 + s) / (1 - s)) / (4 * math.pi)
+
+
+def tile_for(lat, lng, z):
+    """`(x, y)` of the zoom-`z` tile containing a point."""
+    n = 1 << z
+    fx, fy = world_position(lat, lng)
+    return min(n - 1, max(0, int(fx * n))), min(n - 1, max(0, int(fy * n)))
+
+
+def _latitude(fy):
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * fy))))
+
+
+def tile_bounds(z, x, y):
+    """`(min_lat, min_lng, max_lat, max_lng)` of a tile. Edge rows extend to the poles."""
+    n = 1 << z
+    min_lat = -90.0 if y == n - 1 else _latitude((y + 1) / n)
+    max_lat = 90.0 if y == 0 else _latitude(y / n)
+    return min_lat, x / n * 360.0 - 180.0, max_lat, (x + 1) / n * 360.0 - 180.0
+
+
+def tile_center(z, x, y):
+    """`(lat, lng)` of the middle of a tile on the map."""
+    n = 1 << z
+    return _latitude((y + 0.5) / n), (x + 0.5) / n * 360.0 - 180.0
+
+
+def tile_radius_km(z, x, y):
+    """Distance from the tile center to its farthest corner."""
+    n = 1 << z
+    lat, lng = tile_center(z, x, y)
+    west, east = x / n * 360.0 - 180.0, (x + 1) / n * 360.0 - 180.0
+    north, south = _latitude(y / n), _latitude((y + 1) / n)
+    return max(haversine_km(lat, lng, corner_lat, corner_lng)
+               for corner_lat in (north, south) for corner_lng in (west, east))
@@ -0,0 +1,214 @@
+"""
+Medicine stock movements and the running inventory summary.
+
+Stock only changes through `apply_transactions`. A batch of purchases and
+sales runs in one database transaction with the same handful of statements
+whatever its size:
+
+1. one SELECT of the prices of the medicines involved, locking their rows
+   where the database supports it;
+2. one executemany conditional UPDATE over each medicine's net change,
+   `quantity = quantity + :delta WHERE quantity + :delta >= 0`;
+3. one executemany INSERT of the transaction rows;
+4. one UPDATE of the summary row.
+
+The conditional UPDATE checks and changes stock in a single statement, so two
+concurrent sales of the last unit cannot both succeed. If any medicine lacks
+stock the whole batch is rolled back and the shortfalls are reported.
+
+`inventory_summary` holds running totals adjusted by deltas on every change,
+so reading them never re-sums `medicines` or `transactions`.
+`rebuild_inventory_summary()` recomputes them from scratch.
+"""
+from datetime import datetime
+
+from sqlalchemy import bindparam, func, insert, select, update  # type: ignore
+
+from pharmacy_tracker_backend import db
+from pharmacy_tracker_backend.database.models import InventorySummary, Medicine, Transaction
+
+TRANSACTION_TYPES = ('purchase', 'sale')
+# Most transactions accepted in one batch
+MAX_BATCH = 1000
+_SUMMARY_ID = 1
+
+_medicines = Medicine.__table__
+_transactions = Transaction.__table__
+_summary = InventorySummary.__table__
+
+
+class InsufficientStock(Exception):
+    """Raised when a batch would take a medicine's stock below zero."""
+
+    def __init__(self, shortfalls):
+        super().__init__('insufficient stock')
+        # [{'medicine_id', 'available', 'requested'}]
+        self.shortfalls = shortfalls
+
+
+def parse_transactions(items):
+    """Validate raw transaction dicts. Raises ValueError naming the first bad item."""
+    if not isinstance(items, list) or not items:
+        raise ValueError('transactions must be a non-empty list')
+    if len(items) > MAX_BATCH:
+        raise ValueError(f'at most {MAX_BATCH} transactions per request')
+    parsed = []
+    for position, item in enumerate(items):
+        try:
+            if not isinstance(item, dict):
+                raise ValueError('expected an object')
+            kind = item.get('type')
+            if kind not in TRANSACTION_TYPES:
+                raise ValueError(f'type must be one of: {", ".join(TRANSACTION_TYPES)}')
+            medicine_id = int(item['medicine_id'])
+            quantity = item.get('quantity')
+            if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity <= 0:
+                raise ValueError('quantity must be a positive integer')
+            unit_price = item.get('unit_price')
+            if unit_price is not None:
+                unit_price = float(unit_price)
+                if unit_price < 0:
+                    raise ValueError('unit_price must not be negative')
+            supplier_id = item.get('supplier_id')
+            if supplier_id is not None:
+                supplier_id = int(supplier_id)
+        except KeyError:
+            raise ValueError(f'transaction {position}: medicine_id is required')
+        except (TypeError, ValueError) as e:
+            raise ValueError(f'transaction {position}: {e}')
+        parsed.append({'type': kind, 'medicine_id': medicine_id, 'quantity': quantity,
+                       'unit_price': unit_price, 'supplier_id': supplier_id})
+    return parsed
+
+
+def apply_transactions(items):
+    """Apply parsed transactions atomically and commit.
+
+    Returns the recorded transactions as dicts. Raises ValueError for unknown
+    medicines and InsufficientStock when a sale exceeds the stock; nothing is
+    written in either case.
+    """
+    try:
+        return _apply(items)
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def _apply(items):
+    deltas = {}
+    for item in items:
+        sign = 1 if item['type'] == 'purchase' else -1
+        deltas[item['medicine_id']] = deltas.get(item['medicine_id'], 0) + sign * item['quantity']
+    ids = sorted(deltas)  # one lock order for every batch avoids deadlocks
+
+    prices = dict(db.session.execute(
+        select(_medicines.c.id, _medicines.c.price).where(_medicines.c.id.in_(ids)).order_by(_medicines.c.id)
+        .with_for_update()).all())
+    missing = [mid for mid in ids if mid not in prices]
+    if missing:
+        raise ValueError(f'unknown medicine_id: {", ".join(map(str, missing))}')
+
+    now = datetime.utcnow()
+    changes = [{'mid': mid, 'delta': deltas[mid], 'now': now} for mid in ids if deltas[mid]]
+    if changes and not _update_stock(changes):
+        # Undo the medicines that did update before reading what is available
+        db.session.rollback()
+        raise InsufficientStock(_shortfalls(changes))
+
+    rows = []
+    for item in items:
+        unit_price = item['unit_price'] if item['unit_price'] is not None else prices[item['medicine_id']]
+        rows.append({'type': item['type'], 'medicine_id': item['medicine_id'], 'quantity': item['quantity'],
+                     'unit_price': unit_price, 'total_amount': round(unit_price * item['quantity'], 2),
+                     'transaction_date': now, 'supplier_id': item['supplier_id']})
+    ids_returned = _insert_transactions(rows)
+
+    totals = {'total_units': sum(deltas.values()),
+              'stock_value': sum(delta * prices[mid] for mid, delta in deltas.items())}
+    for kind in TRANSACTION_TYPES:
+        of_kind = [row for row in rows if row['type'] == kind]
+        totals[f'{kind}_count'] = len(of_kind)
+        totals[f'{kind}_units'] = sum(row['quantity'] for row in of_kind)
+        totals[f'{kind}_amount'] = sum(row['total_amount'] for row in of_kind)
+    adjust_summary(**totals)
+    db.session.commit()
+
+    return [dict(row, id=tid, transaction_date=now.isoformat()) for row, tid in zip(rows, ids_returned)]
+
+
+def _update_stock(changes):
+    """Run the conditional stock UPDATE; False if any medicine would go negative."""
+    quantity = func.coalesce(_medicines.c.quantity, 0)
+    stmt = (update(_medicines)
+            .where(_medicines.c.id == bindparam('mid'), quantity + bindparam('delta') >= 0)
+            .values(quantity=quantity + bindparam('delta'), updated_at=bindparam('now')))
+    conn = db.session.connection()
+    if conn.dialect.supports_sane_multi_rowcount:
+        return conn.execute(stmt, changes).rowcount == len(changes)
+    # Drivers that batch executemany cannot report rows matched per parameter set
+    return all(conn.execute(stmt, change).rowcount == 1 for change in changes)
+
+
+def _shortfalls(changes):
+    available = dict(db.session.execute(
+        select(_medicines.c.id, func.coalesce(_medicines.c.quantity, 0))
+        .where(_medicines.c.id.in_([change['mid'] for change in changes]))).all())
+    return [{'medicine_id': change['mid'], 'available': available.get(change['mid'], 0), 'requested': -change['delta']}
+            for change in changes if available.get(change['mid'], 0) + change['delta'] < 0]
+
+
+def _insert_transactions(rows):
+    conn = db.session.connection()
+    if conn.dialect.insert_executemany_returning_sort_by_parameter_order:
+        result = conn.execute(insert(_transactions).returning(_transactions.c.id, sort_by_parameter_order=True), rows)
+        return [tid for (tid,) in result]
+    conn.execute(insert(_transactions), rows)
+    return [None] * len(rows)
+
+
+def adjust_summary(**deltas):
+    """Add `deltas` (column name -> amount) to the summary row inside the current transaction."""
+    # Amounts may also be SQL expressions, evaluated by the UPDATE itself
+    values = {name: getattr(_summary.c, name) + amount for name, amount in deltas.items()
+              if not (isinstance(amount, (int, float)) and amount == 0)}
+    if values:
+        values['updated_at'] = datetime.utcnow()
+        db.session.execute(update(_summary).where(_summary.c.id == _SUMMARY_ID).values(**values))
+
+
+def _computed_summary():
+    quantity = func.coalesce(Medicine.quantity, 0)
+    count, units, value = db.session.query(
+        func.count(Medicine.id), func.coalesce(func.sum(quantity), 0),
+        func.coalesce(func.sum(quantity * Medicine.price), 0.0)).one()
+    values = {'medicine_count': count, 'total_units': units, 'stock_value': value}
+    for kind in TRANSACTION_TYPES:
+        n, units, amount = db.session.query(
+            func.count(Transaction.id), func.coalesce(func.sum(Transaction.quantity), 0),
+            func.coalesce(func.sum(Transaction.total_amount), 0.0)).filter(Transaction.type == kind).one()
+        values.update({f'{kind}_count': n, f'{kind}_units': units, f'{kind}_amount': amount})
+    return values
+
+
+def rebuild_inventory_summary():
+    """Recompute the summary from the medicines and transactions tables and commit."""
+    values = _computed_summary()
+    summary = db.session.get(InventorySummary, _SUMMARY_ID)
+    if summary is None:
+        summary = InventorySummary(id=_SUMMARY_ID)
+        db.session.add(summary)
+    for name, value in values.items():
+        setattr(summary, name, value)
+    db.session.commit()
+    return summary
+
+
+def ensure_inventory_summary():
+    """Create the summary row on first start, from whatever data already exists."""
+    if db.session.get(InventorySummary, _SUMMARY_ID) is None:
+        rebuild_inventory_summary()
+
+
+def get_inventory_summary():
+    return db.session.get(InventorySummary, _SUMMARY_ID) or rebuild_inventory_summary()
@@ -0,0 +1,251 @@
+"""
+Request instrumentation and a Prometheus `/metrics` endpoint.
+
+Every request records its latency, status, response size, the number and
+total time of its database queries (from SQLAlchemy engine events) and the
+ORM instances it hydrated, labelled by route rule rather than raw path so
+the series stay bounded. Response cache hits and misses are counted per
+route from the `X-Cache` header, and the cache's own counters are exported
+at scrape time. Server errors are counted by route and status from the
+response, so a view that catches its own exception and answers 500 counts
+the same as one that reached the global error handler.
+
+Each worker process keeps its own numbers, and a scrape is answered by
+whichever worker picks it up. Rates and latency quantiles stay meaningful
+that way; for exact totals across workers, scrape each worker directly.
+
+With `PROFILING_ENABLED` set, adding `?_profile=1` to any request runs it
+under cProfile and returns the hottest functions as plain text instead of
+the response. Keep it off in production: the report exposes code paths.
+"""
+import cProfile
+import io
+import pstats
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, g, has_request_context, request  # type: ignore
+from sqlalchemy import event  # type: ignore
+
+from pharmacy_tracker_backend import db
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+_BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+# Functions listed in a profile report
+_PROFILE_LINES = 40
+_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count per label set."""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *values):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f'{self.name}{_labels(self.labels, values)} {_number(value)}' for values, value in items]
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label set."""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=_LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, amount, *values):
+        with self._lock:
+            state = self._values.get(values)
+            if state is None:
+                # One count per bucket plus +Inf, then the sum
+                state = self._values[values] = [0] * (len(self.buckets) + 1) + [0]
+            state[bisect_left(self.buckets, amount)] += 1
+            state[-1] += amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted((values, list(state)) for values, state in self._values.items())
+        lines = []
+        for values, state in items:
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), state):
+                total += count
+                le = 'le="{}"'.format(bound if bound == '+Inf' else _number(float(bound)))
+                lines.append(f'{self.name}_bucket{_labels(self.labels, values, le)} {total}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, values)} {_number(state[-1])}')
+            lines.append(f'{self.name}_count{_labels(self.labels, values)} {total}')
+        return lines
+
+
+class RequestMetrics:
+    """The metrics kept for one app."""
+
+    def __init__(self):
+        self.requests = Counter('http_requests_total', 'Requests served.', ('method', 'route', 'status'))
+        self.latency = Histogram('http_request_duration_seconds', 'Time to produce a response.',
+                                 ('method', 'route'))
+        self.response_bytes = Histogram('http_response_bytes', 'Size of response bodies; streams are not counted.',
+                                        ('method', 'route'), _BYTES_BUCKETS)
+        self.queries = Histogram('db_queries_per_request', 'Database queries run by one request.',
+                                 ('method', 'route'), _QUERY_BUCKETS)
+        self.query_time = Histogram('db_query_seconds_per_request', 'Time one request spent in database queries.',
+                                    ('method', 'route'))
+        self.hydrated = Counter('orm_instances_loaded_total', 'ORM instances hydrated from query rows.',
+                                ('method', 'route'))
+        self.cache = Counter('response_cache_requests_total', 'Cacheable requests by cache result.',
+                             ('route', 'result'))
+        self.errors = Counter('http_server_errors_total', 'Responses with a 5xx status.',
+                              ('method', 'route', 'status'))
+        self.background_queries = Counter('db_queries_outside_requests_total',
+                                          'Queries run by background jobs and scripts.')
+
+    def all(self):
+        return [self.requests, self.latency, self.response_bytes, self.queries, self.query_time, self.hydrated,
+                self.cache, self.errors, self.background_queries]
+
+
+def _route():
+    rule = request.url_rule
+    return rule.rule if rule is not None else 'unmatched'
+
+
+def _tracking():
+    return has_request_context() and 'metrics_queries' in g
+
+
+def instrument_engines(engines, metrics):
+    """Count queries and their time for every engine in `engines`, a bind key -> engine map."""
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['metrics_started'].pop()
+        if _tracking():
+            g.metrics_queries += 1
+            g.metrics_query_time += elapsed
+        else:
+            metrics.background_queries.inc()
+
+    for engine in engines.values():
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+
+
+@event.listens_for(db.Model, 'load', propagate=True)
+def _count_hydrated(target, context):
+    if _tracking():
+        g.metrics_hydrated += 1
+
+
+def init_metrics(app):
+    """Attach request instrumentation, the profiling hook and GET /metrics to `app`."""
+    metrics = RequestMetrics()
+    app.extensions['metrics'] = metrics
+    profiling = app.config.get('PROFILING_ENABLED', False)
+
+    @app.before_request
+    def start_request():
+        g.metrics_started = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_query_time = 0.0
+        g.metrics_hydrated = 0
+        if profiling and request.args.get('_profile'):
+            g.metrics_profiler = cProfile.Profile()
+            g.metrics_profiler.enable()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        labels = (request.method, _route())
+        metrics.requests.inc(1, *labels, str(response.status_code))
+        if response.status_code >= 500:
+            metrics.errors.inc(1, *labels, str(response.status_code))
+        metrics.latency.observe(time.perf_counter() - started, *labels)
+        metrics.queries.observe(g.metrics_queries, *labels)
+        metrics.query_time.observe(g.metrics_query_time, *labels)
+        if g.metrics_hydrated:
+            metrics.hydrated.inc(g.metrics_hydrated, *labels)
+        if not response.is_streamed:
+            metrics.response_bytes.observe(response.calculate_content_length() or 0, *labels)
+        cache_result = response.headers.get('X-Cache')
+        if cache_result:
+            metrics.cache.inc(1, labels[1], cache_result.lower())
+        elif response.status_code == 304:
+            metrics.cache.inc(1, labels[1], 'not_modified')
+
+        profiler = g.pop('metrics_profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            report = profile_report(profiler, g.metrics_queries, g.metrics_query_time)
+            app.logger.info('Profile of %s %s\n%s', request.method, request.full_path, report)
+            return Response(report, mimetype='text/plain')
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        return Response(render_metrics(metrics, app.extensions.get('response_cache')), content_type=_CONTENT_TYPE)
+
+    return metrics
+
+
+def profile_report(profiler, queries, query_time):
+    """The hottest functions of a profile by cumulative time, as text."""
+    out = io.StringIO()
+    out.write(f'{queries} database queries, {query_time * 1000:.1f} ms in the database\n\n')
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats('cumulative').print_stats(_PROFILE_LINES)
+    stats.sort_stats('tottime').print_stats(_PROFILE_LINES // 2)
+    return out.getvalue()
+
+
+def render_metrics(metrics, cache=None):
+    """Every metric of `metrics`, plus the response cache counters, in the Prometheus text format."""
+    lines = []
+    for metric in metrics.all():
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.samples())
+    if cache is not None:
+        stats = cache.stats()
+        backend = stats.pop('backend')
+        for name, value in sorted(stats.items()):
+            kind = 'gauge' if name == 'entries' else 'counter'
+            metric = f'response_cache_{name}' + ('_total' if kind == 'counter' else '')
+            lines.append(f'# TYPE {metric} {kind}')
+            lines.append(f'{metric}{{backend="{backend}"}} {value}')
+    return '\n'.join(lines) + '\n'
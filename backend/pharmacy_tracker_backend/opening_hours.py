@@ -0,0 +1,226 @@
+"""
+Parsing of free-text opening hours into a weekly schedule.
+
+A schedule is a list of `(opens_at, closes_at)` minute-of-week intervals,
+with minute 0 at Monday 00:00 and `closes_at` exclusive. Intervals are split
+at midnight, so none is longer than a day; that bound is what lets an
+"open at minute m" lookup scan a single day's worth of an index on
+`opens_at` instead of every interval that started earlier in the week.
+
+Understood forms include:
+
+    8:00 AM - 9:00 PM                      (every day)
+    8:00 AM - 9:00 PM (Mon-Sat), Sun closed
+    Mon-Sat 08:00-20:00; Sun closed
+    Mon-Fri 8am-6pm, Sat 9am-1pm
+    Mo-Fr 08:00-12:00,14:00-18:00; Sa 09:00-13:00
+    Weekdays 7:30-19:00, weekends 9-17
+    24/7, Open 24 hours, Daily 22:00-06:00
+
+Text that does not fit is not guessed at: `parse_opening_hours` returns None
+and the pharmacy is treated as having unknown hours.
+"""
+import re
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+DAY_MINUTES = 24 * 60
+WEEK_MINUTES = 7 * DAY_MINUTES
+
+_DAYS = {
+    'monday': 0, 'mon': 0, 'mo': 0,
+    'tuesday': 1, 'tues': 1, 'tue': 1, 'tu': 1,
+    'wednesday': 2, 'wed': 2, 'we': 2,
+    'thursday': 3, 'thurs': 3, 'thur': 3, 'thu': 3, 'th': 3,
+    'friday': 4, 'fri': 4, 'fr': 4,
+    'saturday': 5, 'sat': 5, 'sa': 5,
+    'sunday': 6, 'sun': 6, 'su': 6,
+}
+# Keyed by the matched words with spaces removed
+_DAY_SETS = {'daily': range(7), 'everyday': range(7), 'allweek': range(7), 'weekdays': range(5),
+             'weekend': (5, 6), 'weekends': (5, 6)}
+_ALL_DAYS = tuple(range(7))
+
+_TOKENS = re.compile(r'''
+    (?P<always>24\s*/\s*7|24\s*(?:hours|hrs|hr|h)\b|round\s+the\s+clock|always\s+open)
+  | (?P<closed>\bclosed\b|\boff\b)
+  | (?P<dayset>\bdaily\b|\bevery\s*day\b|\ball\s+week\b|\bweekdays\b|\bweekends?\b)
+  | (?P<day>\b(?:''' + '|'.join(sorted(_DAYS, key=len, reverse=True)) + r''')\b\.?)
+  | (?P<time>\b(?:2[0-4]|[01]?\d)(?![\d])(?:[:.h][0-5]\d)?(?:\s*[ap]\.?m\b\.?)?|\bnoon\b|\bmidnight\b)
+  | (?P<dash>-|–|—|\bto\b|\btill\b|\buntil\b)
+  | (?P<sep>[,;/&|]|\band\b)
+  | (?P<skip>\s+|[:()]|\bopen\b|\bhours\b|\bfrom\b)
+''', re.VERBOSE)
+_TIME = re.compile(r'(\d{1,2})(?:[:.h](\d{2}))?\s*(?:([ap])\.?m\.?)?$')
+
+
+def _tokenize(text):
+    tokens = []
+    position = 0
+    while position < len(text):
+        match = _TOKENS.match(text, position)
+        if match is None:
+            return None
+        position = match.end()
+        if match.lastgroup != 'skip':
+            tokens.append((match.lastgroup, match.group().strip().rstrip('.')))
+    return tokens
+
+
+def _clock(value):
+    """`(minutes, meridiem)` for a time token; meridiem is 'a', 'p' or None."""
+    if value == 'noon':
+        return 12 * 60, None
+    if value == 'midnight':
+        return 0, None
+    hour, minute, meridiem = _TIME.match(value).groups()
+    return int(hour) * 60 + int(minute or 0), meridiem
+
+
+def _twelve_hour(minutes, meridiem):
+    if minutes >= 13 * 60:
+        raise ValueError('hour out of range for am/pm')
+    minutes %= 12 * 60
+    return minutes + 12 * 60 if meridiem == 'p' else minutes
+
+
+def _time_range(start, end):
+    """Minutes since midnight for a time range; the end may pass midnight."""
+    (opens, start_meridiem), (closes, end_meridiem) = _clock(start), _clock(end)
+    if end_meridiem and not start_meridiem:
+        # "1-5pm" is all afternoon, "8-6pm" starts in the morning
+        start_meridiem = end_meridiem if opens % (12 * 60) <= closes % (12 * 60) else 'a'
+    if start_meridiem and not end_meridiem:
+        end_meridiem = 'p' if start_meridiem == 'a' else 'a'
+    if start_meridiem:
+        opens, closes = _twelve_hour(opens, start_meridiem), _twelve_hour(closes, end_meridiem)
+    elif closes < opens and closes + 12 * 60 > opens and closes <= 12 * 60:
+        # "8:00-6:00" without am/pm means eight to six, not overnight
+        closes += 12 * 60
+    if opens >= DAY_MINUTES:
+        raise ValueError('opening time out of range')
+    if closes <= opens:
+        closes += DAY_MINUTES
+    return opens, closes
+
+
+def parse_opening_hours(text):
+    """The weekly schedule described by `text`, or None when it cannot be read.
+
+    An empty list means closed every day.
+    """
+    if not text or not text.strip():
+        return None
+    tokens = _tokenize(text.lower())
+    if not tokens:
+        return None
+
+    applied = []  # [days, hours]: days None for every day, hours None for closed
+    days = []  # the days the next hours apply to
+    fresh = True  # whether `days` has had hours applied yet
+    # Hours given before any day, which a day group right after them names the
+    # days of: "8am-9pm (Mon-Sat)"
+    unbound = None
+    binding = False  # whether the day group being read names the days of `unbound`
+    previous = None
+    index = 0
+    try:
+        while index < len(tokens):
+            kind, value = tokens[index]
+            if kind in ('day', 'dayset'):
+                if not fresh:
+                    days, fresh = [], True
+                if not days:
+                    binding = unbound is not None and (previous != 'sep' or binding)
+                if kind == 'dayset':
+                    days.extend(_DAY_SETS[re.sub(r'\s+', '', value)])
+                elif index + 2 < len(tokens) and tokens[index + 1][0] == 'dash' and tokens[index + 2][0] == 'day':
+                    first, last = _DAYS[value], _DAYS[tokens[index + 2][1]]
+                    days.extend((first + offset) % 7 for offset in range((last - first) % 7 + 1))
+                    index += 2
+                else:
+                    days.append(_DAYS[value])
+            elif kind in ('time', 'always', 'closed'):
+                if kind == 'time':
+                    if index + 2 >= len(tokens) or tokens[index + 1][0] != 'dash' or tokens[index + 2][0] != 'time':
+                        return None
+                    hours = _time_range(value, tokens[index + 2][1])
+                    index += 2
+                else:
+                    hours = (0, DAY_MINUTES) if kind == 'always' else None
+                entry = [list(days) or None, hours]
+                if days:
+                    unbound = None
+                elif unbound is None or binding:
+                    unbound = [entry]
+                else:
+                    unbound.append(entry)
+                applied.append(entry)
+                binding, fresh = False, False
+            elif kind == 'sep':
+                if binding and days:
+                    _bind(unbound, days)
+                    days = []
+            else:
+                return None
+            previous = kind
+            index += 1
+    except ValueError:
+        return None
+    if fresh and days:
+        # A day group left after the last hours
+        if not binding:
+            return None
+        _bind(unbound, days)
+
+    open_days = {}  # day -> [(opens, closes)] in minutes since that day's midnight
+    for entry_days, hours in applied:
+        for day in entry_days or _ALL_DAYS:
+            ranges = open_days.setdefault(day, [])
+            if hours is not None:
+                ranges.append(hours)
+    if not open_days:
+        return None
+    return _week_intervals(open_days)
+
+
+def _bind(entries, days):
+    for entry in entries:
+        entry[0] = (entry[0] or []) + days
+
+
+def _week_intervals(open_days):
+    """Merge per-day hours into sorted minute-of-week intervals split at midnight."""
+    spans = []
+    for day, ranges in open_days.items():
+        for opens, closes in ranges:
+            start, end = day * DAY_MINUTES + opens, day * DAY_MINUTES + closes
+            if end > WEEK_MINUTES:
+                # Sunday night into Monday morning
+                spans.append((0, end - WEEK_MINUTES))
+                end = WEEK_MINUTES
+            spans.append((start, end))
+    spans.sort()
+    merged = []
+    for start, end in spans:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    intervals = []
+    for start, end in merged:
+        while start < end:
+            midnight = (start // DAY_MINUTES + 1) * DAY_MINUTES
+            intervals.append((start, min(end, midnight)))
+            start = midnight
+    return intervals
+
+
+def minute_of_week(timezone, moment=None):
+    """Minute of the week of `moment` (default now) in `timezone`. Naive datetimes are taken as local time there."""
+    if moment is None:
+        moment = datetime.now(ZoneInfo(timezone))
+    elif moment.tzinfo is not None:
+        moment = moment.astimezone(ZoneInfo(timezone))
+    return moment.weekday() * DAY_MINUTES + moment.hour * 60 + moment.minute
+
@@ -0,0 +1,23 @@
+import base64
+import json
+
+
+def encode_cursor(kind, *values):
+    """Opaque, URL-safe cursor carrying the sort key of the last row served."""
+    raw = json.dumps([kind, *values], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, kind):
+    """Return the values stored in a cursor of the expected kind.
+
+    Raises ValueError for malformed cursors or cursors of another kind.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError('invalid cursor')
+    if not isinstance(payload, list) or not payload or payload[0] != kind:
+        raise ValueError(f'cursor is not a {kind} cursor')
+    return payload[1:]
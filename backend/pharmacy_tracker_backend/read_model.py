@@ -0,0 +1,297 @@
+"""
+In-process read model of the pharmacy table.
+
+With `READ_MODEL_ENABLED`, each worker keeps every pharmacy in memory as
+its serialized JSON object, so `GET /api/pharmacies` and
+`GET /api/pharmacies/<id>` can answer without a query or an ORM instance:
+the response is the stored fragments joined together. A row is a
+`__slots__` record holding the id (interned), `created_at` and the JSON
+bytes; coordinates sit in two float arrays indexed by row slot, and the
+start of every field inside the JSON is kept in an unsigned int array, so
+sparse fieldsets are slices of the stored bytes. Rows are kept sorted by
+`(created_at, id)`, the order of the unfiltered list.
+
+Writes through this worker's API update the model right after they commit.
+Writes by other workers reach it through the change feed (see changes.py),
+which is read at most every `READ_MODEL_RECHECK_SECONDS`; the model is
+reloaded from scratch when the feed was pruned past it or, once every change
+has settled, its row count no longer matches the table, e.g. after rows
+were inserted directly.
+
+Searches, service and opening-hours filters still go to the database.
+"""
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_right, insort
+
+from flask import current_app  # type: ignore
+from sqlalchemy import func, select  # type: ignore
+
+from pharmacy_tracker_backend import db
+from pharmacy_tracker_backend.changes import TokenExpired, changes_since, latest_position, settled_position
+from pharmacy_tracker_backend.database.models import Pharmacy, PharmacyService
+from pharmacy_tracker_backend.serialization import (
+    PHARMACY_FIELDS, compile_serializer, dumps, pharmacy_columns
+)
+
+# Position of each field in PHARMACY_FIELDS
+_FIELD_INDEX = {name: index for index, name in enumerate(PHARMACY_FIELDS)}
+_FIELD_COUNT = len(PHARMACY_FIELDS)
+# Positions in pharmacy_columns(PHARMACY_FIELDS) rows
+_COLUMNS = [column.key for column in pharmacy_columns(PHARMACY_FIELDS)]
+_CREATED_AT, _LATITUDE, _LONGITUDE = (_COLUMNS.index(name) for name in ('created_at', 'latitude', 'longitude'))
+_pharmacies = Pharmacy.__table__
+_services = PharmacyService.__table__
+# Keeps IN (...) lists well under SQLite's bound-parameter limit
+_IN_CHUNK = 500
+# Changes read from the feed per round trip when catching up
+_CHANGES_BATCH = 5000
+
+
+class PharmacyRow:
+    """One pharmacy: its id, list sort key and serialized JSON object."""
+    __slots__ = ('id', 'created_at', 'body', 'slot')
+
+    def __init__(self, pharmacy_id, created_at, body, slot):
+        self.id = pharmacy_id
+        self.created_at = created_at
+        self.body = body
+        self.slot = slot
+
+
+class PharmacyReadModel:
+
+    def __init__(self):
+        self.loaded = False
+        self.position = 0  # last change of the feed reflected here
+        self.checked_at = 0.0
+        self._rows = {}  # id -> PharmacyRow
+        self._order = []  # (created_at, id) of every row, sorted
+        self._latitude = array('d')
+        self._longitude = array('d')
+        self._starts = array('I')  # _FIELD_COUNT field offsets per slot
+        self._free = []  # slots of removed rows, for reuse
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def load(self, rows, services):
+        """Replace the contents with `pharmacy_columns(PHARMACY_FIELDS)` rows."""
+        with self._lock:
+            self._rows = {}
+            self._order = []
+            self._latitude = array('d')
+            self._longitude = array('d')
+            self._starts = array('I')
+            self._free = []
+            for row in rows:
+                self._order.append(self._put(row, services))
+            self._order.sort()
+            self.loaded = True
+
+    def upsert(self, rows, services):
+        with self._lock:
+            for row in rows:
+                self._discard(row[0])
+                insort(self._order, self._put(row, services))
+
+    def remove(self, pharmacy_ids):
+        with self._lock:
+            for pharmacy_id in pharmacy_ids:
+                self._discard(pharmacy_id)
+
+    def _put(self, row, services):
+        """Store a row and return its sort key; the caller places the key in `_order`."""
+        serialized = compile_serializer(PHARMACY_FIELDS)(row, services)
+        parts = [dumps({name: serialized[name]})[1:-1] for name in PHARMACY_FIELDS]
+        starts = []
+        offset = 1
+        for part in parts:
+            starts.append(offset)
+            offset += len(part) + 1
+        body = b'{' + b','.join(parts) + b'}'
+
+        pharmacy_id = sys.intern(row[0])
+        created_at = row[_CREATED_AT]
+        if self._free:
+            slot = self._free.pop()
+            self._latitude[slot] = row[_LATITUDE]
+            self._longitude[slot] = row[_LONGITUDE]
+            self._starts[slot * _FIELD_COUNT:(slot + 1) * _FIELD_COUNT] = array('I', starts)
+        else:
+            slot = len(self._latitude)
+            self._latitude.append(row[_LATITUDE])
+            self._longitude.append(row[_LONGITUDE])
+            self._starts.extend(starts)
+        self._rows[pharmacy_id] = PharmacyRow(pharmacy_id, created_at, body, slot)
+        return created_at, pharmacy_id
+
+    def _discard(self, pharmacy_id):
+        row = self._rows.pop(pharmacy_id, None)
+        if row is None:
+            return
+        index = bisect_right(self._order, (row.created_at, row.id)) - 1
+        if index >= 0 and self._order[index] == (row.created_at, row.id):
+            del self._order[index]
+        self._free.append(row.slot)
+
+    def _fragment(self, row, fields):
+        if fields is PHARMACY_FIELDS or len(fields) == _FIELD_COUNT:
+            return row.body
+        base = row.slot * _FIELD_COUNT
+        parts = []
+        for name in fields:
+            index = _FIELD_INDEX[name]
+            start = self._starts[base + index]
+            end = self._starts[base + index + 1] - 1 if index + 1 < _FIELD_COUNT else len(row.body) - 1
+            parts.append(row.body[start:end])
+        return b'{' + b','.join(parts) + b'}'
+
+    def get(self, pharmacy_id, fields=PHARMACY_FIELDS):
+        """The JSON object of one pharmacy, or None."""
+        with self._lock:
+            row = self._rows.get(pharmacy_id)
+            return self._fragment(row, fields) if row is not None else None
+
+    def objects(self, ids, fields, extra=None):
+        """JSON objects of the pharmacies in `ids` that exist, in that order.
+
+        `extra` maps ids to a single `(key, value)` added to their objects.
+        """
+        out = []
+        with self._lock:
+            for pharmacy_id in ids:
+                row = self._rows.get(pharmacy_id)
+                if row is None:
+                    continue
+                fragment = self._fragment(row, fields)
+                if extra is not None:
+                    key, value = extra[pharmacy_id]
+                    fragment = fragment[:-1] + b',' + dumps(key) + b':' + dumps(value) + b'}'
+                out.append(fragment)
+        return out
+
+    def page(self, fields, after=None, limit=None, box=None):
+        """`(key, object)` pairs in `(created_at, id)` key order, after the `after` key.
+
+        `box` is a `(min_lat, min_lng, max_lat, max_lng)` filter.
+        """
+        out = []
+        with self._lock:
+            start = bisect_right(self._order, after) if after is not None else 0
+            latitude, longitude = self._latitude, self._longitude
+            for index in range(start, len(self._order)):
+                if limit is not None and len(out) >= limit:
+                    break
+                key = self._order[index]
+                row = self._rows[key[1]]
+                if box is not None and not (box[0] <= latitude[row.slot] <= box[2]
+                                            and box[1] <= longitude[row.slot] <= box[3]):
+                    continue
+                out.append((key, self._fragment(row, fields)))
+        return out
+
+    def memory_bytes(self):
+        """Approximate bytes held by the model's containers, rows and their fields."""
+        with self._lock:
+            total = sys.getsizeof(self._rows) + sys.getsizeof(self._order)
+            total += sum(sys.getsizeof(array_) for array_ in (self._latitude, self._longitude, self._starts))
+            for created_at, pharmacy_id in self._order:
+                row = self._rows[pharmacy_id]
+                total += (sys.getsizeof(row) + sys.getsizeof(row.body) + sys.getsizeof(created_at)
+                          + sys.getsizeof(pharmacy_id) + sys.getsizeof((created_at, pharmacy_id)))
+            return total
+
+
+def _read_rows(ids=None):
+    """`(rows, services)` for every pharmacy, or for those in `ids`."""
+    query = select(*pharmacy_columns(PHARMACY_FIELDS))
+    services_query = select(_services.c.pharmacy_id, _services.c.service).order_by(
+        _services.c.pharmacy_id, _services.c.position)
+    if ids is None:
+        rows = db.session.execute(query).all()
+        service_rows = db.session.execute(services_query).all()
+    else:
+        rows, service_rows = [], []
+        for start in range(0, len(ids), _IN_CHUNK):
+            chunk = ids[start:start + _IN_CHUNK]
+            rows.extend(db.session.execute(query.where(_pharmacies.c.id.in_(chunk))))
+            service_rows.extend(db.session.execute(services_query.where(_services.c.pharmacy_id.in_(chunk))))
+    services = {}
+    for pharmacy_id, service in service_rows:
+        services.setdefault(pharmacy_id, []).append(service)
+    return rows, services
+
+
+def _reload(model):
+    # Position first: a change landing in between is applied twice, never missed
+    model.position = settled_position()
+    model.checked_at = time.monotonic()
+    model.load(*_read_rows())
+
+
+def _catch_up(model):
+    """Apply changes made by other workers. False when the model must be reloaded instead."""
+    position = model.position
+    try:
+        while True:
+            upserted, deleted, position, has_more = changes_since(position, _CHANGES_BATCH)
+            if upserted:
+                rows, services = _read_rows(upserted)
+                model.upsert(rows, services)
+                # Upserts whose row is gone were deleted since
+                model.remove(set(upserted).difference(row[0] for row in rows))
+            model.remove(deleted)
+            if not has_more:
+                break
+    except TokenExpired:
+        return False
+    model.position = position
+    if position != latest_position():
+        # Unsettled inserts and deletes are in the table but not in the model
+        # yet; the counts are compared once the feed has caught up
+        return True
+    return len(model) == db.session.execute(select(func.count()).select_from(_pharmacies)).scalar()
+
+
+def get_read_model():
+    """The read model of the current app, loaded and caught up, or None when it is disabled."""
+    if not current_app.config.get('READ_MODEL_ENABLED', False):
+        return None
+    model = current_app.extensions.get('read_model')
+    if model is None:
+        model = current_app.extensions.setdefault('read_model', PharmacyReadModel())
+    if not model.loaded:
+        with model._lock:
+            if not model.loaded:
+                _reload(model)
+    else:
+        interval = current_app.config.get('READ_MODEL_RECHECK_SECONDS', 0)
+        if interval and time.monotonic() - model.checked_at >= interval:
+            with model._lock:
+                if time.monotonic() - model.checked_at >= interval:
+                    model.checked_at = time.monotonic()
+                    if not _catch_up(model):
+                        _reload(model)
+    return model
+
+
+def sync_read_model(pharmacy_ids):
+    """Reload `pharmacy_ids` into the model after a committed write, dropping those deleted."""
+    model = current_app.extensions.get('read_model')
+    if model is None or not model.loaded or not pharmacy_ids:
+        return
+    pharmacy_ids = list(pharmacy_ids)
+    rows, services = _read_rows(pharmacy_ids)
+    with model._lock:
+        model.upsert(rows, services)
+        model.remove(set(pharmacy_ids).difference(row[0] for row in rows))
+
+
+def load_read_model(app):
+    """Load the read model of `app` now rather than on the first request, when it is enabled."""
+    with app.app_context():
+        get_read_model()
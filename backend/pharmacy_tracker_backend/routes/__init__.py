@@ -1,6 +1,12 @@
 from .pharmacies import pharmacies_bp
+from .inventory import inventory_bp
+from .analytics import analytics_bp
+from .tiles import tiles_bp
 
 # List of all blueprints
 blueprints = [
-    pharmacies_bp
+    pharmacies_bp,
+    inventory_bp,
+    analytics_bp,
+    tiles_bp
 ]
\ No newline at end of file
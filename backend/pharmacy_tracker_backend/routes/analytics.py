@@ -0,0 +1,93 @@
+from flask import Blueprint, request, jsonify  # type: ignore
+from pharmacy_tracker_backend import db
+from pharmacy_tracker_backend.analytics import (
+    PERIODS, default_range, get_analytics_state, medicine_totals, rebuild_analytics, refresh_analytics,
+    revenue_series, supplier_totals
+)
+from pharmacy_tracker_backend.inventory import TRANSACTION_TYPES
+from datetime import date
+
+analytics_bp = Blueprint('analytics', __name__)
+
+# Longest date range one report covers
+_MAX_DAYS = 3660
+_MAX_LIMIT = 500
+
+
+def _date_range():
+    """`(start, end)` from the from/to query parameters, defaulting to the last 30 days."""
+    start, end = default_range()
+    if request.args.get('to'):
+        end = date.fromisoformat(request.args['to'])
+        start = default_range(end)[0]
+    if request.args.get('from'):
+        start = date.fromisoformat(request.args['from'])
+    if start > end:
+        raise ValueError('from must not be after to')
+    if (end - start).days >= _MAX_DAYS:
+        raise ValueError(f'at most {_MAX_DAYS} days per report')
+    return start, end
+
+
+def _limit():
+    limit = min(request.args.get('limit', type=int, default=20), _MAX_LIMIT)
+    if limit <= 0:
+        raise ValueError('limit must be positive')
+    return limit
+
+
+def _report(data, start, end):
+    return jsonify({'success': True, 'data': data, 'from': start.isoformat(), 'to': end.isoformat(),
+                    'as_of': get_analytics_state()}), 200
+
+
+@analytics_bp.route('/analytics/revenue', methods=['GET'])
+def get_revenue():
+    try:
+        start, end = _date_range()
+        period = request.args.get('period', 'day')
+        if period not in PERIODS:
+            return jsonify({'success': False, 'message': f'period must be one of: {", ".join(PERIODS)}'}), 400
+        return _report(revenue_series(start, end, period), start, end)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@analytics_bp.route('/analytics/medicines', methods=['GET'])
+def get_medicine_sales():
+    try:
+        start, end = _date_range()
+        kind = request.args.get('type', 'sale')
+        if kind not in TRANSACTION_TYPES:
+            return jsonify({'success': False, 'message': f'type must be one of: {", ".join(TRANSACTION_TYPES)}'}), 400
+        order_by = request.args.get('order_by', 'units')
+        if order_by not in ('units', 'amount'):
+            return jsonify({'success': False, 'message': 'order_by must be units or amount'}), 400
+        return _report(medicine_totals(start, end, kind, order_by, _limit()), start, end)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@analytics_bp.route('/analytics/suppliers', methods=['GET'])
+def get_supplier_purchases():
+    try:
+        start, end = _date_range()
+        return _report(supplier_totals(start, end, _limit()), start, end)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@analytics_bp.route('/analytics/refresh', methods=['POST'])
+def refresh():
+    try:
+        rebuild = request.args.get('rebuild', '').lower() in ('1', 'true', 'yes')
+        report = rebuild_analytics() if rebuild else refresh_analytics()
+        if report is None:
+            return jsonify({'success': False, 'message': 'A refresh is already running'}), 409
+        return jsonify({'success': True, 'data': report}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
@@ -0,0 +1,380 @@
+from flask import Blueprint, current_app, request, jsonify  # type: ignore
+from sqlalchemy import and_, func, or_, select  # type: ignore
+from pharmacy_tracker_backend import db
+from pharmacy_tracker_backend.database.models import (
+    ExpiryAlert, ExpirySummary, Medicine, Pharmacy, PharmacyStock, Supplier, Transaction
+)
+from pharmacy_tracker_backend.expiry import (
+    LEVELS, delete_expiry_alert, expiring_medicines, expiry_level, expiry_settings, get_expiry_state, sweep_expiry
+)
+from pharmacy_tracker_backend.inventory import (
+    InsufficientStock, adjust_summary, apply_transactions, get_inventory_summary, parse_transactions
+)
+from pharmacy_tracker_backend.pagination import decode_cursor, encode_cursor
+from pharmacy_tracker_backend.stock import delete_stock, forget_stock, set_pharmacy_stock
+from datetime import date
+
+inventory_bp = Blueprint('inventory', __name__)
+
+_MAX_PAGE = 500
+_MAX_EXPIRY_DAYS = 3650
+
+
+def _page_args(kind):
+    """Return `(limit, after_id)` from the limit and cursor query parameters."""
+    limit = min(request.args.get('limit', type=int, default=100), _MAX_PAGE)
+    if limit <= 0:
+        raise ValueError('limit must be positive')
+    cursor = request.args.get('cursor', type=str)
+    after = int(decode_cursor(cursor, kind)[0]) if cursor else None
+    return limit, after
+
+
+def _page(rows, limit, kind):
+    next_cursor = encode_cursor(kind, rows[limit - 1].id) if len(rows) > limit else None
+    return {'success': True, 'data': [row.to_dict() for row in rows[:limit]], 'next_cursor': next_cursor}
+
+
+def _medicine_fields(data, partial=False):
+    """Validated medicine columns from a request body. Stock is changed through transactions only."""
+    fields = {}
+    if 'name' in data or not partial:
+        if not data.get('name'):
+            raise ValueError('name is required')
+        fields['name'] = str(data['name'])
+    if 'description' in data:
+        fields['description'] = data['description']
+    if 'price' in data or not partial:
+        try:
+            fields['price'] = float(data['price'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError('price must be a number')
+        if fields['price'] < 0:
+            raise ValueError('price must not be negative')
+    if 'expiry_date' in data:
+        fields['expiry_date'] = date.fromisoformat(data['expiry_date']) if data['expiry_date'] else None
+    return fields
+
+
+@inventory_bp.route('/medicines', methods=['GET'])
+def get_medicines():
+    try:
+        limit, after = _page_args('medicine')
+        query = Medicine.query
+        search = request.args.get('search', type=str)
+        if search:
+            query = query.filter(Medicine.name.ilike(f'%{search.strip()}%'))
+        if after is not None:
+            query = query.filter(Medicine.id > after)
+        rows = query.order_by(Medicine.id).limit(limit + 1).all()
+        return jsonify(_page(rows, limit, 'medicine')), 200
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@inventory_bp.route('/medicines/<int:medicine_id>', methods=['GET'])
+def get_medicine(medicine_id):
+    try:
+        medicine = db.session.get(Medicine, medicine_id)
+        if not medicine:
+            return jsonify({'success': False, 'message': 'Medicine not found'}), 404
+        return jsonify({'success': True, 'data': medicine.to_dict()}), 200
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@inventory_bp.route('/medicines', methods=['POST'])
+def create_medicine():
+    try:
+        data = request.get_json() or {}
+        try:
+            fields = _medicine_fields(data)
+            quantity = int(data.get('quantity') or 0)
+        except (TypeError, ValueError) as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        if quantity < 0:
+            return jsonify({'success': False, 'message': 'quantity must not be negative'}), 400
+
+        medicine = Medicine(quantity=quantity, **fields)
+        db.session.add(medicine)
+        # Opening stock counts towards the running totals
+        adjust_summary(medicine_count=1, total_units=quantity, stock_value=quantity * medicine.price)
+        db.session.commit()
+
+        return jsonify({'success': True, 'data': medicine.to_dict(), 'message': 'Medicine created successfully'}), 201
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@inventory_bp.route('/medicines/<int:medicine_id>', methods=['PUT'])
+def update_medicine(medicine_id):
+    try:
+        medicine = db.session.get(Medicine, medicine_id)
+        if not medicine:
+            return jsonify({'success': False, 'message': 'Medicine not found'}), 404
+
+        data = request.get_json() or {}
+        if 'quantity' in data:
+            return jsonify({'success': False, 'message': 'quantity changes through purchase and sale transactions'}), 400
+        try:
+            fields = _medicine_fields(data, partial=True)
+        except (TypeError, ValueError) as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+
+        old_price = medicine.price
+        for key, value in fields.items():
+            setattr(medicine, key, value)
+        if medicine.price != old_price:
+            # Revalue the stock held once the row is written (and locked) by the flush
+            db.session.flush()
+            held = select(func.coalesce(Medicine.quantity, 0)).where(Medicine.id == medicine_id).scalar_subquery()
+            adjust_summary(stock_value=held * (medicine.price - old_price))
+        db.session.commit()
+
+        return jsonify({'success': True, 'data': medicine.to_dict(), 'message': 'Medicine updated successfully'}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@inventory_bp.route('/medicines/<int:medicine_id>', methods=['DELETE'])
+def delete_medicine(medicine_id):
+    try:
+        medicine = db.session.get(Medicine, medicine_id)
+        if not medicine:
+            return jsonify({'success': False, 'message': 'Medicine not found'}), 404
+        if db.session.query(Transaction.query.filter_by(medicine_id=medicine_id).exists()).scalar():
+            return jsonify({'success': False, 'message': 'Medicine has transactions and cannot be deleted'}), 409
+
+        quantity = medicine.quantity or 0
+        adjust_summary(medicine_count=-1, total_units=-quantity, stock_value=-quantity * medicine.price)
+        delete_stock(medicine_id=medicine_id)
+        delete_expiry_alert(medicine_id)
+        db.session.delete(medicine)
+        db.session.commit()
+        forget_stock(medicine_id=medicine_id)
+
+        return jsonify({'success': True, 'message': 'Medicine deleted successfully'}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@inventory_bp.route('/pharmacies/<pharmacy_id>/stock', methods=['GET'])
+def get_pharmacy_stock(pharmacy_id):
+    try:
+        if not db.session.get(Pharmacy, pharmacy_id):
+            return jsonify({'success': False, 'message': 'Pharmacy not found'}), 404
+        rows = PharmacyStock.query.filter_by(pharmacy_id=pharmacy_id).order_by(PharmacyStock.medicine_id).all()
+        return jsonify({'success': True, 'data': [row.to_dict() for row in rows]}), 200
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@inventory_bp.route('/pharmacies/<pharmacy_id>/stock', methods=['PUT'])
+def update_pharmacy_stock(pharmacy_id):
+    try:
+        if not db.session.get(Pharmacy, pharmacy_id):
+            return jsonify({'success': False, 'message': 'Pharmacy not found'}), 404
+
+        data = request.get_json()
+        # One {medicine_id, quantity, price} object, or {"items": [...]}
+        raw = data.get('items') if isinstance(data, dict) and 'items' in data else [data]
+        if not isinstance(raw, list) or not raw:
+            return jsonify({'success': False, 'message': 'items must be a non-empty list'}), 400
+        items = {}
+        for position, item in enumerate(raw):
+            try:
+                medicine_id = int(item['medicine_id'])
+                quantity = item.get('quantity')
+                if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 0:
+                    raise ValueError('quantity must be a non-negative integer')
+                price = float(item['price']) if item.get('price') is not None else None
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                message = 'medicine_id is required' if isinstance(e, KeyError) else str(e)
+                return jsonify({'success': False, 'message': f'item {position}: {message}'}), 400
+            items[medicine_id] = (medicine_id, quantity, price)
+
+        known = {mid for (mid,) in db.session.query(Medicine.id).filter(Medicine.id.in_(list(items)))}
+        missing = sorted(set(items) - known)
+        if missing:
+            return jsonify({'success': False, 'message': f'unknown medicine_id: {", ".join(map(str, missing))}'}), 400
+
+        set_pharmacy_stock(pharmacy_id, list(items.values()))
+        return jsonify({'success': True, 'data': [{'medicine_id': mid, 'quantity': quantity, 'price': price}
+                                                  for mid, quantity, price in items.values()],
+                        'message': 'Stock updated successfully'}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@inventory_bp.route('/suppliers', methods=['GET'])
+def get_suppliers():
+    try:
+        limit, after = _page_args('supplier')
+        query = Supplier.query
+        if after is not None:
+            query = query.filter(Supplier.id > after)
+        rows = query.order_by(Supplier.id).limit(limit + 1).all()
+        return jsonify(_page(rows, limit, 'supplier')), 200
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@inventory_bp.route('/suppliers', methods=['POST'])
+def create_supplier():
+    try:
+        data = request.get_json() or {}
+        if not data.get('name'):
+            return jsonify({'success': False, 'message': 'name is required'}), 400
+
+        supplier = Supplier(name=data['name'], contact_person=data.get('contact_person'), email=data.get('email'),
+                            phone=data.get('phone'), address=data.get('address'))
+        db.session.add(supplier)
+        db.session.commit()
+
+        return jsonify({'success': True, 'data': supplier.to_dict(), 'message': 'Supplier created successfully'}), 201
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@inventory_bp.route('/inventory/transactions', methods=['POST'])
+def record_transactions():
+    try:
+        data = request.get_json()
+        # One transaction object, or {"transactions": [...]} for a batch
+        batch = isinstance(data, dict) and 'transactions' in data
+        items = data['transactions'] if batch else [data]
+        try:
+            recorded = apply_transactions(parse_transactions(items))
+        except InsufficientStock as e:
+            return jsonify({'success': False, 'message': 'Insufficient stock', 'shortfalls': e.shortfalls}), 409
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+
+        return jsonify({'success': True, 'data': recorded if batch else recorded[0],
+                        'message': 'Transactions recorded successfully'}), 201
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@inventory_bp.route('/inventory/transactions', methods=['GET'])
+def get_transactions():
+    try:
+        limit, before = _page_args('transaction')
+        medicine_id = request.args.get('medicine_id', type=int)
+        query = Transaction.query
+        if medicine_id is not None:
+            query = query.filter(Transaction.medicine_id == medicine_id)
+        if before is not None:
+            query = query.filter(Transaction.id < before)
+        # Newest first
+        rows = query.order_by(Transaction.id.desc()).limit(limit + 1).all()
+        return jsonify(_page(rows, limit, 'transaction')), 200
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@inventory_bp.route('/inventory/summary', methods=['GET'])
+def get_summary():
+    try:
+        return jsonify({'success': True, 'data': get_inventory_summary().to_dict()}), 200
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@inventory_bp.route('/inventory/expiring', methods=['GET'])
+def get_expiring():
+    try:
+        days = request.args.get('days', type=int, default=30)
+        if not 0 <= days <= _MAX_EXPIRY_DAYS:
+            return jsonify({'success': False, 'message': f'days must be between 0 and {_MAX_EXPIRY_DAYS}'}), 400
+        limit = min(request.args.get('limit', type=int, default=100), _MAX_PAGE)
+        if limit <= 0:
+            return jsonify({'success': False, 'message': 'limit must be positive'}), 400
+        supplier_id = request.args.get('supplier_id', type=int)
+        pharmacy_id = request.args.get('pharmacy_id', type=str)
+        include_expired = request.args.get('include_expired', '').lower() in ('1', 'true', 'yes')
+
+        today = date.today()
+        query = expiring_medicines(days, today, pharmacy_id=pharmacy_id, supplier_id=supplier_id,
+                                   include_expired=include_expired)
+        cursor = request.args.get('cursor', type=str)
+        if cursor:
+            expiry, after = decode_cursor(cursor, 'expiring')
+            expiry = date.fromisoformat(expiry)
+            query = query.filter(or_(Medicine.expiry_date > expiry,
+                                     and_(Medicine.expiry_date == expiry, Medicine.id > int(after))))
+        rows = query.limit(limit + 1).all()
+
+        critical, warning, _ = expiry_settings(current_app.config)
+        data = []
+        for medicine, quantity in rows[:limit]:
+            item = medicine.to_dict()
+            item['quantity'] = quantity
+            item['days_left'] = (medicine.expiry_date - today).days
+            item['level'] = expiry_level(medicine.expiry_date, today, critical, warning)
+            data.append(item)
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1][0]
+            next_cursor = encode_cursor('expiring', last.expiry_date.isoformat(), last.id)
+        return jsonify({'success': True, 'data': data, 'next_cursor': next_cursor}), 200
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@inventory_bp.route('/inventory/expiry/alerts', methods=['GET'])
+def get_expiry_alerts():
+    try:
+        limit = min(request.args.get('limit', type=int, default=100), _MAX_PAGE)
+        if limit <= 0:
+            return jsonify({'success': False, 'message': 'limit must be positive'}), 400
+        query = ExpiryAlert.query
+        level = request.args.get('level', type=str)
+        if level:
+            if level not in LEVELS:
+                return jsonify({'success': False, 'message': f'level must be one of: {", ".join(LEVELS)}'}), 400
+            query = query.filter(ExpiryAlert.level == level)
+        cursor = request.args.get('cursor', type=str)
+        if cursor:
+            expiry, after = decode_cursor(cursor, 'expiry_alert')
+            expiry = date.fromisoformat(expiry)
+            query = query.filter(or_(ExpiryAlert.expiry_date > expiry,
+                                     and_(ExpiryAlert.expiry_date == expiry, ExpiryAlert.medicine_id > int(after))))
+        # Soonest to expire first
+        rows = query.order_by(ExpiryAlert.expiry_date, ExpiryAlert.medicine_id).limit(limit + 1).all()
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = encode_cursor('expiry_alert', last.expiry_date.isoformat(), last.medicine_id)
+        return jsonify({'success': True, 'data': [row.to_dict() for row in rows[:limit]],
+                        'next_cursor': next_cursor}), 200
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@inventory_bp.route('/inventory/expiry/summary', methods=['GET'])
+def get_expiry_summary():
+    try:
+        rows = {row.level: row.to_dict() for row in ExpirySummary.query.all()}
+        state = get_expiry_state()
+        return jsonify({'success': True, 'data': {
+            'levels': [rows[level] for level in LEVELS if level in rows],
+            'swept_at': state.finished_at.isoformat() if state and state.finished_at else None
+        }}), 200
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@inventory_bp.route('/inventory/expiry/sweep', methods=['POST'])
+def run_expiry_sweep():
+    try:
+        report = sweep_expiry(current_app.config)
+        if report is None:
+            return jsonify({'success': False, 'message': 'A sweep is already running'}), 409
+        return jsonify({'success': True, 'data': report}), 200
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
@@ -1,18 +1,199 @@
-from flask import Blueprint, request, jsonify  # type: ignore
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context  # type: ignore
+from sqlalchemy import and_, or_, select  # type: ignore
 from pharmacy_tracker_backend import db
-from pharmacy_tracker_backend.database.models import Pharmacy
+from pharmacy_tracker_backend.bulk_import import (
+    CONFLICT_MODES, DEFAULT_CHUNK_SIZE, FORMATS, import_pharmacies, iter_records
+)
+from pharmacy_tracker_backend.cache import cached_response, invalidate_responses
+from pharmacy_tracker_backend.changes import (
+    TokenExpired, changes_since, decode_token, encode_token, latest_position, record_changes, settled_position
+)
+from pharmacy_tracker_backend.clusters import adjust_clusters, cluster_box, locked_positions
+from pharmacy_tracker_backend.database.models import Medicine, Pharmacy, PharmacyHours, PharmacyService
+from pharmacy_tracker_backend.encoding import wants_json
+from pharmacy_tracker_backend.opening_hours import DAY_MINUTES, minute_of_week
+from pharmacy_tracker_backend.pagination import decode_cursor, encode_cursor
+from pharmacy_tracker_backend.read_model import get_read_model, sync_read_model
+from pharmacy_tracker_backend.search import ranked_search, search_filter, search_ranking, search_terms
+from pharmacy_tracker_backend.serialization import (
+    dumps, json_response, parse_fields, pharmacy_columns, serialize_pharmacies
+)
+from pharmacy_tracker_backend.stock import delete_stock, forget_stock, nearest_in_stock
+from pharmacy_tracker_backend.tiles import touch_tiles
+from pharmacy_tracker_backend.geo import (
+    DistanceEngine, forget_pharmacy, get_distance_engine, get_spatial_index, intersect_bbox, parse_bbox, radius_bbox, sync_pharmacy
+)
 try:
     from sqlalchemy.exc import IntegrityError  # type: ignore
 except Exception:  # pragma: no cover
     # Fallback for environments where SQLAlchemy isn't installed (e.g., static analysis)
     class IntegrityError(Exception):
         pass
-import json
+from datetime import datetime
+import io
 
 pharmacies_bp = Blueprint('pharmacies', __name__)
 
+# Largest nearest-N served by the grid index before switching to the vectorized engine
+_INDEX_MAX_K = 200
+# Most origins accepted by one batch nearest request
+_MAX_BATCH_ORIGINS = 1000
+# Largest page of the in-stock search, and most medicines a name may match
+_MAX_IN_STOCK = 100
+_MAX_NAME_MATCHES = 50
+# Keeps IN (...) lists well under SQLite's bound-parameter limit
+_IN_CHUNK = 500
+# Rows fetched per round trip and flushed per chunk when streaming
+_STREAM_BATCH = 500
+# Largest page of changes served per delta sync request
+_MAX_CHANGES = 5000
+# Deepest map zoom accepted by the clustering endpoint
+_MAX_CLUSTER_ZOOM = 24
+# Bulk import formats by Content-Type or upload file extension
+_IMPORT_MIMETYPES = {'text/csv': 'csv', 'application/x-ndjson': 'ndjson', 'application/jsonl': 'ndjson',
+                     'application/json': 'json'}
+_IMPORT_EXTENSIONS = {'csv': 'csv', 'ndjson': 'ndjson', 'jsonl': 'ndjson', 'json': 'json'}
+
+
+def _load_in_order(ids, fields, extra=None, load_all=False, missing=None):
+    """Serialized pharmacies by id, preserving the order of `ids`.
+
+    `extra` maps ids to keys added to their items. `load_all` reads the
+    whole table in one pass instead of by id. Ids not found are appended to
+    the `missing` list when one is given.
+    """
+    query = db.session.query(*pharmacy_columns(fields))
+    if load_all:
+        found = {row[0]: row for row in query}
+    else:
+        found = {}
+        for start in range(0, len(ids), _IN_CHUNK):
+            for row in query.filter(Pharmacy.id.in_(ids[start:start + _IN_CHUNK])):
+                found[row[0]] = row
+    rows = [found[pid] for pid in ids if pid in found]
+    if missing is not None and len(rows) < len(ids):
+        missing.extend(pid for pid in ids if pid not in found)
+    data = serialize_pharmacies(rows, fields)
+    if extra:
+        for item, row in zip(data, rows):
+            item.update(extra[row[0]])
+    return data
+
+
+def _page_response(objects, limit, next_cursor):
+    """A list response assembled from serialized pharmacy objects."""
+    body = b'{"success":true,"data":[' + b','.join(objects) + b']'
+    if limit:
+        body += b',"next_cursor":' + dumps(next_cursor)
+    return Response(body + b'}', mimetype='application/json')
+
+
+def _filtered(filters):
+    return any(value is not None and value != [] for value in filters.values())
+
+
+def _apply_filters(query, filters, with_search=True):
+    """Apply the `search`, `box`, `services` and `open_at` filters of a list request."""
+    if with_search and filters['search']:
+        query = query.filter(search_filter(filters['search']))
+    box = filters['box']
+    if box is not None:
+        query = query.filter(Pharmacy.latitude.between(box[0], box[2]),
+                             Pharmacy.longitude.between(box[1], box[3]))
+    for service in filters['services']:
+        # Semi-join on the (service, pharmacy_id) index
+        offering = select(PharmacyService.pharmacy_id).where(PharmacyService.service == service)
+        query = query.filter(Pharmacy.id.in_(offering))
+    minute = filters['open_at']
+    if minute is not None:
+        # Intervals never pass midnight, so the range on opens_at spans at most a day of the index
+        open_then = select(PharmacyHours.pharmacy_id).where(
+            PharmacyHours.opens_at.between(minute - DAY_MINUTES + 1, minute), PharmacyHours.closes_at > minute)
+        query = query.filter(Pharmacy.id.in_(open_then))
+    return query
+
+
+def _list_query(filters, after, fields, ranking=None):
+    """Query `pharmacy_columns(fields)` rows plus a trailing sort key in list order, after the cursor row.
+
+    Searches are ordered by (relevance, id), scored by `ranking` when given,
+    everything else by (created_at, id).
+    """
+    query = _apply_filters(db.session.query(*pharmacy_columns(fields)), filters, with_search=False)
+    if filters['search']:
+        query, key = ranked_search(query, filters['search'], ranking)
+    else:
+        key = Pharmacy.created_at
+    if after is not None:
+        value, pid = after
+        query = query.filter(or_(key > value, and_(key == value, Pharmacy.id > pid)))
+    return query.add_columns(key).order_by(key, Pharmacy.id)
+
+
+def _rank_by_distance(latitude, longitude, filters, radius_km, limit, after):
+    """Return `(distance_km, id)` pairs in (distance, id) order."""
+    if not _filtered(filters):
+        if limit and limit <= _INDEX_MAX_K:
+            # Ring search over the grid index only touches nearby cells
+            return get_spatial_index().nearest(latitude, longitude, limit, after)
+        # Large or unbounded rankings: one vectorized pass over every pharmacy
+        return get_distance_engine().nearest(latitude, longitude, limit, after)
+
+    if limit and limit <= _INDEX_MAX_K:
+        # The ring search still bounds the work; the other filters become an
+        # id set it checks candidates against
+        index = get_spatial_index()
+        box = filters['box']
+        matching = None
+        if _filtered(dict(filters, box=None)):
+            matching = {pid for pid, in _apply_filters(db.session.query(Pharmacy.id), dict(filters, box=None))}
+
+        def accept(pid):
+            if matching is not None and pid not in matching:
+                return False
+            if box is None:
+                return True
+            lat, lng = index.location(pid)
+            return box[0] <= lat <= box[2] and box[1] <= lng <= box[3]
+
+        return index.nearest(latitude, longitude, limit, after, accept, radius_km)
+
+    # Large or unbounded filtered rankings: the coordinates of the matching
+    # rows go through the vectorized engine; full rows are loaded for the
+    # page only
+    engine = DistanceEngine()
+    engine.load(_apply_filters(db.session.query(Pharmacy.id, Pharmacy.latitude, Pharmacy.longitude), filters))
+    ranked = engine.nearest(latitude, longitude, limit or None, after)
+    if radius_km is not None:
+        ranked = [pair for pair in ranked if pair[0] <= radius_km]
+    return ranked
+
+
+def _stream_pharmacies(query, fields, head=None):
+    """Stream the query as a JSON envelope without holding every row in memory.
+
+    `head` holds extra envelope keys, written before the data.
+    """
+    def generate():
+        yield b'{"success":true,' + (dumps(head)[1:-1] + b',' if head else b'') + b'"data":['
+        sep = b''
+        batch = []
+        for row in query.yield_per(_STREAM_BATCH):
+            batch.append(row)
+            if len(batch) >= _STREAM_BATCH:
+                # Encode the batch as one array and drop its brackets
+                yield sep + dumps(serialize_pharmacies(batch, fields))[1:-1]
+                sep = b','
+                batch = []
+        if batch:
+            yield sep + dumps(serialize_pharmacies(batch, fields))[1:-1]
+        yield b']}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
 
 @pharmacies_bp.route('/pharmacies', methods=['GET'])
+@cached_response
 def get_pharmacies():
     try:
         # Query params - support both lat/lng and latitude/longitude
@@ -20,56 +201,337 @@ def get_pharmacies():
         longitude = request.args.get('lng') or request.args.get('longitude')
         limit = request.args.get('limit', type=int, default=None)
         search = request.args.get('search', type=str)
+        radius_km = request.args.get('radius_km', type=float, default=None)
+        bbox = request.args.get('bbox', type=str)
+        cursor = request.args.get('cursor', type=str)
+        stream = request.args.get('stream', '').lower() in ('1', 'true', 'yes')
+        open_now = request.args.get('open_now', '').lower() in ('1', 'true', 'yes')
+        open_at = request.args.get('open_at', type=str)
+        if not search_terms(search):
+            search = None
+        services = [name.strip() for value in request.args.getlist('service')
+                    for name in value.split(',') if name.strip()]
+        try:
+            fields = parse_fields(request.args.get('fields', type=str))
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
 
         # Convert to float if provided
         if latitude:
             latitude = float(latitude)
         if longitude:
             longitude = float(longitude)
+        has_origin = latitude is not None and longitude is not None
 
-        query = Pharmacy.query
-
-        if search:
-            query = query.filter(Pharmacy.name.ilike(f'%{search}%'))
-
-        pharmacies = query.all()
-
-        # If coordinates provided, compute distances and sort by nearest
-        if latitude is not None and longitude is not None:
-            import math
-            
-            def distance(lat1, lon1, lat2, lon2):
-                # Haversine formula for distance calculation
-                R = 6371  # Earth's radius in km
-                phi1 = math.radians(lat1)
-                phi2 = math.radians(lat2)
-                delta_phi = math.radians(lat2 - lat1)
-                delta_lambda = math.radians(lon2 - lon1)
-                a = math.sin(delta_phi/2)**2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda/2)**2
-                c = 2 * math.asin(math.sqrt(a))
-                return R * c
-            
-            # Add distance to each pharmacy
-            for pharmacy in pharmacies:
-                pharmacy.distance = distance(latitude, longitude, pharmacy.latitude, pharmacy.longitude)
-            
-            # Sort by distance
-            pharmacies = sorted(pharmacies, key=lambda p: p.distance)
-        
-        # Apply limit if provided
+        box = None
+        if bbox:
+            try:
+                box = parse_bbox(bbox)
+            except ValueError as e:
+                return jsonify({'success': False, 'message': str(e)}), 400
+        if radius_km is not None:
+            if not has_origin:
+                return jsonify({'success': False, 'message': 'radius_km requires lat and lng'}), 400
+            if radius_km <= 0:
+                return jsonify({'success': False, 'message': 'radius_km must be positive'}), 400
+            circle_box = radius_bbox(latitude, longitude, radius_km)
+            box = intersect_bbox(box, circle_box) if box else circle_box
+            if box is None:
+                # Nothing can match; same envelope as any other last page
+                body = {'success': True, 'data': []}
+                if limit:
+                    body['next_cursor'] = None
+                return json_response(body)
+
+        # Opening hours are local wall-clock times; open_at without an offset is taken as local too
+        open_minute = None
+        timezone = current_app.config.get('OPENING_HOURS_TIMEZONE', 'UTC')
+        if open_at:
+            try:
+                open_minute = minute_of_week(timezone, datetime.fromisoformat(open_at))
+            except ValueError:
+                return jsonify({'success': False, 'message': 'open_at must be an ISO 8601 date and time'}), 400
+        elif open_now:
+            open_minute = minute_of_week(timezone)
+        filters = {'search': search, 'box': box, 'services': services, 'open_at': open_minute}
+
+        # Cursors carry the sort key of the last row served: (distance, id)
+        # for coordinate queries, (relevance, id) for searches and
+        # (created_at, id) otherwise
+        cursor_kind = 'distance' if has_origin else 'search' if search else 'created'
+        ranking = ranking_key = None
+        if cursor_kind == 'search':
+            # Relevance scores only compare within one ranking of one corpus:
+            # bm25 moves with every write, and a term can switch between
+            # bm25 and name ranking as matches come and go. Search cursors
+            # record both and are refused once either has changed.
+            ranking = search_ranking(search)
+            ranking_key = f'bm25:{latest_position()}' if ranking == 'bm25' else ranking
+        after = None
+        if cursor:
+            try:
+                value, pid, *rest = decode_cursor(cursor, cursor_kind)
+                value = datetime.fromisoformat(value) if cursor_kind == 'created' else float(value)
+                after = (value, str(pid))
+            except (ValueError, TypeError) as e:
+                return jsonify({'success': False, 'message': str(e)}), 400
+            if cursor_kind == 'search' and rest != [ranking_key]:
+                return jsonify({'success': False, 'message': 'search results changed; request the first page again'}), 410
+
+        if stream:
+            if has_origin:
+                return jsonify({'success': False, 'message': 'stream is not supported with lat/lng'}), 400
+            return _stream_pharmacies(_list_query(filters, after, fields, ranking), fields)
+
+        # Fetch one extra row to learn whether another page exists
+        fetch = limit + 1 if limit else None
+        next_cursor = None
+        if has_origin:
+            ranked = _rank_by_distance(latitude, longitude, filters, radius_km, fetch, after)
+            if limit and len(ranked) > limit:
+                ranked = ranked[:limit]
+                next_cursor = encode_cursor(cursor_kind, *ranked[-1])
+            # The read model holds JSON fragments; other layouts are built from rows
+            model = get_read_model() if wants_json() else None
+            if model is not None:
+                distances = {pid: ('distance_km', round(d, 3)) for d, pid in ranked}
+                return _page_response(model.objects([pid for _, pid in ranked], fields, distances), limit,
+                                      next_cursor)
+            # An unfiltered, unlimited ranking covers every pharmacy
+            distances = {pid: {'distance_km': round(d, 3)} for d, pid in ranked}
+            data = _load_in_order([pid for _, pid in ranked], fields, distances,
+                                  load_all=not limit and not _filtered(filters))
+        else:
+            # The read model serves the plain list, with or without a bbox
+            model = get_read_model() if wants_json() and not _filtered(dict(filters, box=None)) else None
+            if model is not None:
+                items = model.page(fields, after, fetch, box)
+                if limit and len(items) > limit:
+                    items = items[:limit]
+                    created_at, pid = items[-1][0]
+                    next_cursor = encode_cursor(cursor_kind, created_at.isoformat(), pid)
+                return _page_response([item for _, item in items], limit, next_cursor)
+
+            query = _list_query(filters, after, fields, ranking)
+            if fetch:
+                query = query.limit(fetch)
+            rows = query.all()
+            if limit and len(rows) > limit:
+                rows = rows[:limit]
+                last = rows[-1]
+                key = last[-1]
+                if cursor_kind == 'search':
+                    next_cursor = encode_cursor(cursor_kind, key, last[0], ranking_key)
+                else:
+                    next_cursor = encode_cursor(cursor_kind, key.isoformat(), last[0])
+            data = serialize_pharmacies(rows, fields)
+
+        body = {'success': True, 'data': data}
         if limit:
-            pharmacies = pharmacies[:limit]
+            body['next_cursor'] = next_cursor
+        return json_response(body)
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@pharmacies_bp.route('/pharmacies/clusters', methods=['GET'])
+@cached_response
+def get_pharmacy_clusters():
+    try:
+        bbox = request.args.get('bbox', type=str)
+        zoom = request.args.get('zoom', type=float)
+        if not bbox or zoom is None:
+            return jsonify({'success': False, 'message': 'bbox and zoom are required'}), 400
+        if not 0 <= zoom <= _MAX_CLUSTER_ZOOM:
+            return jsonify({'success': False, 'message': f'zoom must be between 0 and {_MAX_CLUSTER_ZOOM}'}), 400
+        try:
+            # Fractional zooms cluster like the whole zoom level below
+            found = cluster_box(parse_bbox(bbox), int(zoom), current_app.config)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
 
-        # Optionally, compute distances if coordinates provided
-        data = [p.to_dict() for p in pharmacies]
+        data = [{'count': count, 'latitude': round(lat, 6), 'longitude': round(lng, 6), 'ids': ids}
+                for count, lat, lng, ids in found]
+        return json_response({'success': True, 'data': data, 'zoom': int(zoom)})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
 
+@pharmacies_bp.route('/pharmacies/suggest', methods=['GET'])
+@cached_response
+def suggest_pharmacies():
+    try:
+        term = request.args.get('q', type=str) or request.args.get('search', type=str)
+        limit = min(request.args.get('limit', type=int, default=10), 50)
+
+        query, score = ranked_search(db.session.query(Pharmacy.id, Pharmacy.name, Pharmacy.address), term)
+        if query is None or limit <= 0:
+            return jsonify({'success': True, 'data': []}), 200
+        rows = query.order_by(score, Pharmacy.id).limit(limit).all()
+
+        data = [{'id': pid, 'name': name, 'address': address} for pid, name, address in rows]
         return jsonify({'success': True, 'data': data}), 200
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@pharmacies_bp.route('/pharmacies/nearest', methods=['POST'])
+def rank_nearest_batch():
+    try:
+        data = request.get_json() or {}
+        origins = data.get('origins') or []
+        limit = data.get('limit', 5)
+
+        if not isinstance(origins, list) or not isinstance(limit, int) or limit <= 0:
+            return jsonify({'success': False, 'message': 'origins must be a list and limit a positive integer'}), 400
+        if len(origins) > _MAX_BATCH_ORIGINS:
+            return jsonify({'success': False, 'message': f'at most {_MAX_BATCH_ORIGINS} origins per request'}), 400
+
+        points = []
+        for origin in origins:
+            try:
+                if isinstance(origin, dict):
+                    points.append((float(origin.get('lat', origin.get('latitude'))),
+                                   float(origin.get('lng', origin.get('longitude')))))
+                else:
+                    points.append((float(origin[0]), float(origin[1])))
+            except (TypeError, ValueError, IndexError, KeyError):
+                return jsonify({'success': False, 'message': f'invalid origin: {origin!r}'}), 400
+
+        ranked = get_distance_engine().rank_many(points, limit)
+        result = [[{'id': pid, 'distance_km': round(d, 3)} for d, pid in row] for row in ranked]
+
+        return jsonify({'success': True, 'data': result}), 200
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@pharmacies_bp.route('/pharmacies/in-stock', methods=['GET'])
+def get_pharmacies_in_stock():
+    try:
+        latitude = request.args.get('lat', type=float)
+        if latitude is None:
+            latitude = request.args.get('latitude', type=float)
+        longitude = request.args.get('lng', type=float)
+        if longitude is None:
+            longitude = request.args.get('longitude', type=float)
+        medicine_id = request.args.get('medicine_id', type=int)
+        name = (request.args.get('medicine', type=str) or '').strip()
+        min_quantity = request.args.get('min_quantity', type=int, default=1)
+        limit = min(request.args.get('limit', type=int, default=10), _MAX_IN_STOCK)
+        radius_km = request.args.get('radius_km', type=float, default=None)
+        try:
+            fields = parse_fields(request.args.get('fields', type=str))
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+
+        if latitude is None or longitude is None:
+            return jsonify({'success': False, 'message': 'lat and lng are required'}), 400
+        if medicine_id is None and not name:
+            return jsonify({'success': False, 'message': 'medicine_id or medicine is required'}), 400
+        if min_quantity <= 0 or limit <= 0:
+            return jsonify({'success': False, 'message': 'min_quantity and limit must be positive'}), 400
+        if radius_km is not None and radius_km <= 0:
+            return jsonify({'success': False, 'message': 'radius_km must be positive'}), 400
+
+        if medicine_id is not None:
+            medicine_ids = [medicine_id]
+        else:
+            # Every catalogue entry whose name contains the term, e.g. all strengths of a drug
+            medicine_ids = [mid for (mid,) in db.session.query(Medicine.id).filter(
+                Medicine.name.ilike(f'%{name}%')).order_by(Medicine.id).limit(_MAX_NAME_MATCHES)]
+
+        ranked = nearest_in_stock(latitude, longitude, medicine_ids, min_quantity, limit, radius_km)
+        extra = {pid: {'distance_km': round(d, 3),
+                       'stock': [{'medicine_id': mid, 'quantity': quantity, 'price': price}
+                                 for mid, quantity, price in stock]}
+                 for d, pid, stock in ranked}
+        data = _load_in_order([pid for _, pid, _ in ranked], fields, extra)
+
+        return json_response({'success': True, 'data': data})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@pharmacies_bp.route('/pharmacies/snapshot', methods=['GET'])
+def get_snapshot():
+    try:
+        try:
+            fields = parse_fields(request.args.get('fields', type=str))
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        # Taken before reading: changes made during the read are sent again on the next sync
+        token = encode_token(settled_position())
+        query = _list_query({'search': None, 'box': None, 'services': [], 'open_at': None}, None, fields)
+        return _stream_pharmacies(query, fields, head={'sync_token': token})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@pharmacies_bp.route('/pharmacies/changes', methods=['GET'])
+def get_changes():
+    try:
+        since = request.args.get('since', type=str)
+        limit = min(request.args.get('limit', type=int, default=1000), _MAX_CHANGES)
+        try:
+            fields = parse_fields(request.args.get('fields', type=str))
+            if not since:
+                raise ValueError('since is required; download /api/pharmacies/snapshot for a first sync')
+            position = decode_token(since)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        if limit <= 0:
+            return jsonify({'success': False, 'message': 'limit must be positive'}), 400
+
+        try:
+            upserted, deleted, position, has_more = changes_since(position, limit)
+        except TokenExpired:
+            return jsonify({'success': False, 'message': 'sync token expired; download a new snapshot'}), 410
+        # Pharmacies deleted after this page's last change are reported as deleted
+        data = _load_in_order(upserted, fields, missing=deleted)
+        return json_response({'success': True, 'data': data, 'deleted': deleted,
+                              'sync_token': encode_token(position), 'has_more': has_more})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@pharmacies_bp.route('/pharmacies/bulk', methods=['POST'])
+def bulk_import_pharmacies():
+    try:
+        on_conflict = request.args.get('on_conflict', 'skip')
+        chunk_size = request.args.get('chunk_size', type=int, default=DEFAULT_CHUNK_SIZE)
+        if on_conflict not in CONFLICT_MODES:
+            return jsonify({'success': False, 'message': f'on_conflict must be one of: {", ".join(CONFLICT_MODES)}'}), 400
+        if chunk_size <= 0:
+            return jsonify({'success': False, 'message': 'chunk_size must be positive'}), 400
+
+        # Either a multipart upload or the raw request body, read as a stream
+        upload = request.files.get('file')
+        if upload is not None:
+            stream = upload.stream
+            fmt = _IMPORT_EXTENSIONS.get((upload.filename or '').rsplit('.', 1)[-1].lower())
+        else:
+            stream = request.stream
+            fmt = _IMPORT_MIMETYPES.get(request.mimetype)
+        fmt = request.args.get('format') or fmt
+        if fmt not in FORMATS:
+            return jsonify({'success': False, 'message': f'format must be one of: {", ".join(FORMATS)}'}), 400
+
+        text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+        try:
+            report = import_pharmacies(iter_records(text, fmt), on_conflict, chunk_size)
+        except (ValueError, UnicodeDecodeError) as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+
+        return jsonify({'success': True, 'data': report, 'message': 'Import finished'}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 @pharmacies_bp.route('/pharmacies/<pharmacy_id>', methods=['GET'])
+@cached_response
 def get_pharmacy(pharmacy_id):
     try:
+        model = get_read_model()
+        if model is not None:
+            data = model.get(pharmacy_id)
+            if data is None:
+                return jsonify({'success': False, 'message': 'Pharmacy not found'}), 404
+            return Response(b'{"success":true,"data":' + data + b'}', mimetype='application/json')
+
         pharmacy = Pharmacy.query.get(pharmacy_id)
         if not pharmacy:
             return jsonify({
@@ -99,16 +561,6 @@ def create_pharmacy():
         if not name or not phone or not address:
             return jsonify({'success': False, 'message': 'name, phone_number and address are required'}), 400
 
-        # Ensure services are stored as JSON string
-        services = data.get('services')
-        if services is not None:
-            try:
-                services_str = json.dumps(services) if not isinstance(services, str) else services
-            except Exception:
-                services_str = '[]'
-        else:
-            services_str = None
-
         new_pharmacy = Pharmacy(
             name=name,
             contact_person=data.get('contact_person'),
@@ -117,13 +569,20 @@ def create_pharmacy():
             address=address,
             latitude=data.get('latitude') or 0.0,
             longitude=data.get('longitude') or 0.0,
-            opening_hours=data.get('opening_hours'),
-            services=services_str,
             is_registered_by_pharmacy=bool(data.get('is_registered_by_pharmacy', False))
         )
+        new_pharmacy.set_services(data.get('services'))
+        new_pharmacy.set_opening_hours(data.get('opening_hours'))
 
         db.session.add(new_pharmacy)
+        db.session.flush()
+        touch_tiles([(new_pharmacy.latitude, new_pharmacy.longitude)])
+        adjust_clusters(added=[(new_pharmacy.id, new_pharmacy.latitude, new_pharmacy.longitude)])
+        record_changes([new_pharmacy.id], 'upsert')
         db.session.commit()
+        sync_pharmacy(new_pharmacy)
+        sync_read_model([new_pharmacy.id])
+        invalidate_responses()
 
         return jsonify({'success': True, 'data': new_pharmacy.to_dict(), 'message': 'Pharmacy created successfully'}), 201
     except IntegrityError:
@@ -141,22 +600,32 @@ def update_pharmacy(pharmacy_id):
             return jsonify({'success': False, 'message': 'Pharmacy not found'}), 404
 
         data = request.get_json() or {}
-
-        # Normalize services
-        if 'services' in data:
-            try:
-                services_str = json.dumps(data['services']) if not isinstance(data['services'], str) else data['services']
-                data['services'] = services_str
-            except Exception:
-                data['services'] = None
+        # The committed position, locked against a concurrent move until commit
+        previous = locked_positions([pharmacy.id]).get(pharmacy.id)
+        if previous is None:
+            db.session.rollback()
+            return jsonify({'success': False, 'message': 'Pharmacy not found'}), 404
+        db.session.refresh(pharmacy)
 
         # Only set allowed fields
-        allowed = {'name', 'contact_person', 'phone_number', 'email', 'address', 'latitude', 'longitude', 'opening_hours', 'services', 'is_registered_by_pharmacy'}
+        allowed = {'name', 'contact_person', 'phone_number', 'email', 'address', 'latitude', 'longitude', 'is_registered_by_pharmacy'}
         for key, value in data.items():
             if key in allowed:
                 setattr(pharmacy, key, value)
+        if 'services' in data:
+            pharmacy.set_services(data['services'])
+        if 'opening_hours' in data:
+            pharmacy.set_opening_hours(data['opening_hours'])
 
+        touch_tiles([previous, (pharmacy.latitude, pharmacy.longitude)])
+        if (pharmacy.latitude, pharmacy.longitude) != previous:
+            adjust_clusters(added=[(pharmacy.id, pharmacy.latitude, pharmacy.longitude)],
+                            removed=[(pharmacy.id,) + previous])
+        record_changes([pharmacy.id], 'upsert')
         db.session.commit()
+        sync_pharmacy(pharmacy)
+        sync_read_model([pharmacy.id])
+        invalidate_responses()
 
         return jsonify({'success': True, 'data': pharmacy.to_dict(), 'message': 'Pharmacy updated successfully'}), 200
     except IntegrityError:
@@ -173,8 +642,20 @@ def delete_pharmacy(pharmacy_id):
         if not pharmacy:
             return jsonify({'success': False, 'message': 'Pharmacy not found'}), 404
 
+        position = locked_positions([pharmacy.id]).get(pharmacy.id)
+        if position is None:
+            db.session.rollback()
+            return jsonify({'success': False, 'message': 'Pharmacy not found'}), 404
+        delete_stock(pharmacy_id=pharmacy_id)
+        touch_tiles([position])
+        adjust_clusters(removed=[(pharmacy.id,) + position])
         db.session.delete(pharmacy)
+        record_changes([pharmacy.id], 'delete')
         db.session.commit()
+        forget_pharmacy(pharmacy_id)
+        sync_read_model([pharmacy_id])
+        forget_stock(pharmacy_id=pharmacy_id)
+        invalidate_responses()
 
         return jsonify({'success': True, 'message': 'Pharmacy deleted successfully'}), 200
     except Exception as e:
@@ -0,0 +1,21 @@
+from flask import Blueprint, Response, current_app, request, jsonify  # type: ignore
+from pharmacy_tracker_backend.tiles import get_tile, valid_tile
+
+tiles_bp = Blueprint('tiles', __name__)
+
+
+@tiles_bp.route('/tiles/<int:z>/<int:x>/<int:y>', methods=['GET'])
+def get_map_tile(z, x, y):
+    try:
+        config = current_app.config
+        if not valid_tile(z, x, y, config.get('TILE_MAX_ZOOM', 18)):
+            return jsonify({'success': False, 'message': 'No such tile'}), 404
+
+        body, etag = get_tile(z, x, y, config)
+        headers = {'ETag': f'"{etag}"', 'Cache-Control': f"public, max-age={config.get('TILE_MAX_AGE', 3600)}"}
+        # Weak comparison: a compressed tile is sent with W/ before its ETag
+        if f'"{etag}"' in [tag.strip().removeprefix('W/') for tag in request.headers.get('If-None-Match', '').split(',')]:
+            return Response(status=304, headers=headers)
+        return Response(body, status=200, mimetype='application/json', headers=headers)
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
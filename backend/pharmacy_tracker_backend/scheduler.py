@@ -0,0 +1,95 @@
+"""
+Periodic background jobs run by each server process.
+
+Jobs that must not overlap claim a lease on their own single-row state
+table before doing any work, so it is safe to run the scheduler in every
+worker: whichever gets there first does the work and the others skip that
+round. Idempotent jobs, such as pruning the change log, need no lease.
+"""
+import random
+import threading
+from datetime import timedelta
+
+from sqlalchemy import or_, update  # type: ignore
+from sqlalchemy.exc import IntegrityError  # type: ignore
+
+from pharmacy_tracker_backend import db
+
+_STATE_ID = 1
+
+
+def claim_lease(model, now, seconds):
+    """Take the lease on `model`'s state row until `now + seconds`. Commits; False if someone else holds it."""
+    if db.session.get(model, _STATE_ID) is None:
+        db.session.add(model(id=_STATE_ID))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()  # created by a concurrent job
+    table = model.__table__
+    claimed = db.session.execute(
+        update(table).where(table.c.id == _STATE_ID, or_(table.c.lease_until.is_(None), table.c.lease_until < now))
+        .values(lease_until=now + timedelta(seconds=seconds))).rowcount == 1
+    db.session.commit()
+    return claimed
+
+
+def release_lease(model, **values):
+    """Clear the lease on `model`'s state row, setting `values` alongside, and commit."""
+    table = model.__table__
+    db.session.execute(update(table).where(table.c.id == _STATE_ID).values(lease_until=None, **values))
+    db.session.commit()
+
+
+class PeriodicJob:
+    """Background thread calling `func(app)` every `interval` seconds inside an app context."""
+
+    def __init__(self, app, name, interval, func):
+        self.app = app
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        # Spread the first runs of workers started together
+        delay = random.uniform(1, min(self.interval, 30))
+        while not self._stop.wait(delay):
+            delay = self.interval
+            with self.app.app_context():
+                try:
+                    self.app.logger.debug('%s: %s', self.name, self.func(self.app))
+                except Exception:
+                    self.app.logger.exception('%s failed', self.name)
+                finally:
+                    db.session.remove()
+
+
+def start_background_jobs(app):
+    """Start the app's periodic jobs whose interval setting is above 0. Call once per server process."""
+    from pharmacy_tracker_backend.analytics import refresh_analytics
+    from pharmacy_tracker_backend.changes import prune_changes
+    from pharmacy_tracker_backend.expiry import sweep_expiry
+    from pharmacy_tracker_backend.tiles import refresh_stale_tiles
+
+    jobs = app.extensions.setdefault('background_jobs', {})
+    for name, setting, func in (
+            ('expiry-sweep', 'EXPIRY_SWEEP_INTERVAL_SECONDS', lambda app: sweep_expiry(app.config)),
+            ('analytics-refresh', 'ANALYTICS_REFRESH_SECONDS', lambda app: refresh_analytics()),
+            ('change-log-prune', 'CHANGE_LOG_PRUNE_SECONDS',
+             lambda app: prune_changes(app.config.get('CHANGE_LOG_RETENTION_DAYS', 90))),
+            ('tile-refresh', 'TILE_REFRESH_SECONDS', lambda app: refresh_stale_tiles(app.config))):
+        interval = float(app.config.get(setting, 0))
+        if interval > 0 and name not in jobs:
+            jobs[name] = PeriodicJob(app, name, interval, func)
+            jobs[name].start()
+    return jobs
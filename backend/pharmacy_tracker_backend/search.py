@@ -0,0 +1,175 @@
+"""
+Full-text search over pharmacy names, addresses and services.
+
+On SQLite the `pharmacies_fts` FTS5 table indexes those columns as external
+content of `pharmacies`. Triggers keep it in step with every insert, update
+and delete in the same transaction, whichever code path made the change.
+Queries are prefix matches on every word, so partial input works for
+typeahead; prefix indexes for one to six characters keep those lookups from
+merging posting lists at query time. Results are ranked with bm25. Name matches weigh more than
+address matches, and address matches more than services.
+
+Terms matching more than `_RANK_WINDOW` rows (one or two typed letters,
+or a word in nearly every name) skip bm25, which costs time proportional to
+the whole posting list, and are ranked by where the name matches instead.
+Every match is still returned. Scores of the two rankings do not compare,
+so `search_ranking` names the one a term gets and search cursors record it.
+
+Other databases, and SQLite builds without FTS5, fall back to ILIKE matching
+on the same three columns with the same name-first ranking.
+"""
+import re
+
+from flask import current_app  # type: ignore
+from sqlalchemy import and_, case, column, func, literal_column, or_, select, table, text  # type: ignore
+from sqlalchemy.exc import OperationalError  # type: ignore
+
+from pharmacy_tracker_backend import db
+from pharmacy_tracker_backend.database.models import Pharmacy
+
+# bm25 column weights: name, address, services
+_WEIGHTS = (10.0, 3.0, 1.0)
+# Matches beyond which a term is ranked by its name match instead of by bm25
+_RANK_WINDOW = 1000
+
+_fts = table('pharmacies_fts', column('rowid'))
+_fts_match = literal_column('pharmacies_fts').op('MATCH')
+_pharmacy_rowid = literal_column('pharmacies.rowid')
+
+_SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS pharmacies_fts USING fts5(
+        name, address, services,
+        content='pharmacies', content_rowid='rowid',
+        tokenize='unicode61 remove_diacritics 2', prefix='1 2 3 4 5 6'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS pharmacies_fts_ai AFTER INSERT ON pharmacies BEGIN
+        INSERT INTO pharmacies_fts(rowid, name, address, services)
+        VALUES (new.rowid, new.name, new.address, new.services);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS pharmacies_fts_ad AFTER DELETE ON pharmacies BEGIN
+        INSERT INTO pharmacies_fts(pharmacies_fts, rowid, name, address, services)
+        VALUES ('delete', old.rowid, old.name, old.address, old.services);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS pharmacies_fts_au AFTER UPDATE OF name, address, services ON pharmacies BEGIN
+        INSERT INTO pharmacies_fts(pharmacies_fts, rowid, name, address, services)
+        VALUES ('delete', old.rowid, old.name, old.address, old.services);
+        INSERT INTO pharmacies_fts(rowid, name, address, services)
+        VALUES (new.rowid, new.name, new.address, new.services);
+    END""",
+]
+
+
+def ensure_search_index():
+    """Create the FTS table and triggers if missing. Call inside an app context.
+
+    Returns True when full-text search is available.
+    """
+    available = False
+    if db.engine.dialect.name == 'sqlite':
+        try:
+            with db.engine.begin() as conn:
+                created = not conn.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'pharmacies_fts'")).first()
+                for statement in _SCHEMA:
+                    conn.execute(text(statement))
+                if created:
+                    # Index rows that existed before the table did
+                    conn.execute(text("INSERT INTO pharmacies_fts(pharmacies_fts) VALUES ('rebuild')"))
+            available = True
+        except OperationalError as e:
+            current_app.logger.warning('FTS5 unavailable, falling back to LIKE search: %s', e)
+    current_app.extensions['search_fts'] = available
+    return available
+
+
+def _fts_enabled():
+    available = current_app.extensions.get('search_fts')
+    if available is None:
+        # The schema step did not run in this process; look for the table once
+        available = db.engine.dialect.name == 'sqlite' and db.session.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'pharmacies_fts'")).first() is not None
+        current_app.extensions['search_fts'] = available
+    return available
+
+
+def search_terms(term):
+    """Words of a search term; an empty list means there is nothing to search for."""
+    return re.findall(r'\w+', term or '')
+
+
+def _fts_query(tokens):
+    # Every word must match, each as a prefix; quoting neutralises FTS syntax
+    return ' '.join('"{}"*'.format(token) for token in tokens)
+
+
+def search_filter(term):
+    """A filter clause selecting pharmacies that match `term`, or None for an empty term."""
+    tokens = search_terms(term)
+    if not tokens:
+        return None
+    if _fts_enabled():
+        matches = select(_fts.c.rowid).where(_fts_match(_fts_query(tokens)))
+        return _pharmacy_rowid.in_(matches)
+    return _like_filter(tokens)
+
+
+def _like_filter(tokens):
+    clauses = []
+    for token in tokens:
+        pattern = f'%{token}%'
+        clauses.append(or_(Pharmacy.name.ilike(pattern), Pharmacy.address.ilike(pattern),
+                           Pharmacy.services.ilike(pattern)))
+    return and_(*clauses)
+
+
+def _name_score(tokens):
+    # 0 when the name starts with the first word, 1 when it contains it
+    return case(
+        (Pharmacy.name.ilike(f'{tokens[0]}%'), 0),
+        (Pharmacy.name.ilike(f'%{tokens[0]}%'), 1),
+        else_=2,
+    )
+
+
+def _broad_match(match):
+    """True when `match` selects more than `_RANK_WINDOW` rows."""
+    window = select(_fts.c.rowid).where(_fts_match(match)).limit(1).offset(_RANK_WINDOW)
+    return db.session.execute(window).first() is not None
+
+
+def search_ranking(term):
+    """How `ranked_search` scores matches of `term`: 'bm25' or 'name'.
+
+    Returns None when `term` holds no words.
+    """
+    tokens = search_terms(term)
+    if not tokens:
+        return None
+    if not _fts_enabled() or _broad_match(_fts_query(tokens)):
+        return 'name'
+    return 'bm25'
+
+
+def ranked_search(query, term, ranking=None):
+    """Restrict a Pharmacy query to matches of `term`.
+
+    Returns `(query, score)`, where a lower score is more relevant, or
+    `(None, None)` when `term` holds no words. Pass the `search_ranking`
+    of `term` as `ranking` to score with it rather than choosing again.
+    """
+    tokens = search_terms(term)
+    if not tokens:
+        return None, None
+    if not _fts_enabled():
+        return query.filter(_like_filter(tokens)), _name_score(tokens)
+
+    match = _fts_query(tokens)
+    query = query.join(_fts, _fts.c.rowid == _pharmacy_rowid).filter(_fts_match(match))
+    if ranking is None:
+        ranking = 'name' if _broad_match(match) else 'bm25'
+    if ranking == 'bm25':
+        return query, func.bm25(literal_column('pharmacies_fts'), *_WEIGHTS)
+    # bm25 has to scan the full posting list of a broad prefix such as "ph",
+    # which is far too slow per keystroke. Rank by where the name matches
+    # instead; bm25 comes back as the term narrows.
+    return query, _name_score(tokens)
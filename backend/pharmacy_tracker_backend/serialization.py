@@ -0,0 +1,131 @@
+"""
+Lean serialization for pharmacy responses.
+
+List endpoints select the requested columns as plain tuples instead of
+hydrating `Pharmacy` instances, which skips the identity map, change
+tracking and the per-row `to_dict()`. Each field set gets one serializer,
+generated once as a single dict literal over tuple positions. Pages are
+encoded straight to bytes with orjson when it is installed, falling back to
+the standard library.
+
+Services come from one query per page on `pharmacy_services`, in the order
+the pharmacy listed them, exactly as `Pharmacy.to_dict()` returns them.
+
+`?fields=id,name,latitude,longitude` trims each item to those fields.
+"""
+import json
+from functools import lru_cache
+
+from flask import Response  # type: ignore
+from sqlalchemy import select  # type: ignore
+
+from pharmacy_tracker_backend import db
+from pharmacy_tracker_backend.database.models import Pharmacy, PharmacyService
+
+try:
+    import orjson  # type: ignore
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# Public pharmacy fields, in Pharmacy.to_dict() order
+PHARMACY_FIELDS = ('id', 'name', 'contact_person', 'phone_number', 'email', 'address', 'latitude', 'longitude',
+                   'opening_hours', 'services', 'is_registered_by_pharmacy', 'created_at', 'updated_at')
+_DATETIME_FIELDS = {'created_at', 'updated_at'}
+_services = PharmacyService.__table__
+# Keeps IN (...) lists well under SQLite's bound-parameter limit
+_IN_CHUNK = 500
+
+
+def parse_fields(value):
+    """Fields named in a comma-separated `fields` parameter, in PHARMACY_FIELDS order.
+
+    Every field when `value` is empty. Raises ValueError for unknown names.
+    """
+    if not value:
+        return PHARMACY_FIELDS
+    names = {name.strip() for name in value.split(',') if name.strip()}
+    unknown = sorted(names.difference(PHARMACY_FIELDS))
+    if unknown:
+        raise ValueError(f'unknown fields: {", ".join(unknown)}')
+    return tuple(name for name in PHARMACY_FIELDS if name in names)
+
+
+def _column_names(fields):
+    # The id always comes first: it keys the services lookup and the ordering helpers
+    return ['id'] + [name for name in fields if name not in ('id', 'services')]
+
+
+def pharmacy_columns(fields):
+    """Columns to select for rows passed to the serializer of `fields`. The id is always first."""
+    return [getattr(Pharmacy, name) for name in _column_names(fields)]
+
+
+@lru_cache(maxsize=64)
+def compile_serializer(fields):
+    """Return `serialize(row, services)` building the dict of `fields` from a `pharmacy_columns(fields)` row.
+
+    `services` maps pharmacy ids to service names. Rows may carry extra
+    trailing columns, such as a sort key.
+    """
+    positions = {name: index for index, name in enumerate(_column_names(fields))}
+    items = []
+    for name in fields:
+        if name == 'services':
+            value = 'services.get(row[0], [])'
+        elif name in _DATETIME_FIELDS and orjson is None:
+            # orjson writes naive datetimes exactly as isoformat() does
+            value = f'(row[{positions[name]}].isoformat() if row[{positions[name]}] else None)'
+        else:
+            value = f'row[{positions[name]}]'
+        items.append(f'{name!r}: {value}')
+    source = 'def serialize(row, services):\n    return {' + ', '.join(items) + '}\n'
+    namespace = {}
+    exec(source, namespace)
+    return namespace['serialize']
+
+
+def load_services(ids):
+    """Map each of `ids` that offers services to its service names, in listed order."""
+    services = {}
+    for start in range(0, len(ids), _IN_CHUNK):
+        rows = db.session.execute(
+            select(_services.c.pharmacy_id, _services.c.service)
+            .where(_services.c.pharmacy_id.in_(ids[start:start + _IN_CHUNK]))
+            .order_by(_services.c.pharmacy_id, _services.c.position)).all()
+        for pharmacy_id, service in rows:
+            services.setdefault(pharmacy_id, []).append(service)
+    return services
+
+
+def serialize_pharmacies(rows, fields):
+    """Turn `pharmacy_columns(fields)` rows into response dicts."""
+    serialize = compile_serializer(fields)
+    services = load_services([row[0] for row in rows]) if 'services' in fields else {}
+    return [serialize(row, services) for row in rows]
+
+
+def dumps(value):
+    """Encode `value` as compact JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(',', ':'), default=_default).encode('utf-8')
+
+
+def loads(body):
+    """Decode JSON bytes or text."""
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def _default(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def json_response(body, status=200):
+    """A response written from `dumps(body)`, or in the columnar layout the request asked for (see encoding.py)."""
+    from pharmacy_tracker_backend.encoding import render
+    response = render(body, status)
+    return response if response is not None else Response(dumps(body), status=status, mimetype='application/json')
@@ -0,0 +1,226 @@
+"""
+Per-pharmacy stock and the "nearest pharmacy that has medicine X" query.
+
+`StockIndex` maps each medicine to the pharmacies holding it, with their
+quantity and price. Coordinates come from the spatial index, which already
+holds every pharmacy's location, so an answer never touches the stock or
+pharmacies tables:
+
+- when few pharmacies stock the medicine, they are ranked directly by
+  distance;
+- when many do, the spatial index's ring search runs with a stock
+  predicate and stops as soon as the nearest matches are settled.
+
+Either way the cost follows the number of stocking pharmacies near the
+origin, not the size of every pharmacy's inventory.
+
+Like the spatial index, each worker keeps its own copy, applies its own
+writes and reloads when the table's count or latest `updated_at` changes
+under it, checked at most every `SPATIAL_INDEX_RECHECK_SECONDS`.
+"""
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app  # type: ignore
+from sqlalchemy import and_, bindparam, delete, func, insert, update  # type: ignore
+
+from pharmacy_tracker_backend import db
+from pharmacy_tracker_backend.database.models import PharmacyStock
+from pharmacy_tracker_backend.geo import get_spatial_index, haversine_km
+
+# Stocking pharmacies ranked by a direct scan; more than this uses the ring search
+_SCAN_MAX = 2000
+# Keeps IN (...) lists well under SQLite's bound-parameter limit
+_IN_CHUNK = 500
+
+_stock = PharmacyStock.__table__
+
+
+class StockIndex:
+
+    def __init__(self):
+        self.loaded = False
+        self.signature = None
+        self.checked_at = 0.0
+        self._by_medicine = {}  # medicine_id -> {pharmacy_id: (quantity, price)}
+        self._by_pharmacy = {}  # pharmacy_id -> {medicine_id}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return sum(len(holders) for holders in self._by_medicine.values())
+
+    def load(self, rows):
+        """Replace the contents with `(pharmacy_id, medicine_id, quantity, price)` rows."""
+        with self._lock:
+            self._by_medicine = {}
+            self._by_pharmacy = {}
+            for pharmacy_id, medicine_id, quantity, price in rows:
+                self._set(pharmacy_id, medicine_id, quantity, price)
+            self.loaded = True
+
+    def set(self, pharmacy_id, medicine_id, quantity, price=None):
+        with self._lock:
+            self._set(pharmacy_id, medicine_id, quantity, price)
+
+    def _set(self, pharmacy_id, medicine_id, quantity, price):
+        pharmacy_id = str(pharmacy_id)
+        if quantity and quantity > 0:
+            self._by_medicine.setdefault(medicine_id, {})[pharmacy_id] = (quantity, price)
+            self._by_pharmacy.setdefault(pharmacy_id, set()).add(medicine_id)
+            return
+        # Out of stock pharmacies are not kept
+        holders = self._by_medicine.get(medicine_id)
+        if holders is not None:
+            holders.pop(pharmacy_id, None)
+            if not holders:
+                del self._by_medicine[medicine_id]
+        held = self._by_pharmacy.get(pharmacy_id)
+        if held is not None:
+            held.discard(medicine_id)
+            if not held:
+                del self._by_pharmacy[pharmacy_id]
+
+    def remove_pharmacy(self, pharmacy_id):
+        with self._lock:
+            for medicine_id in list(self._by_pharmacy.get(str(pharmacy_id), ())):
+                self._set(pharmacy_id, medicine_id, 0, None)
+
+    def remove_medicine(self, medicine_id):
+        with self._lock:
+            for pharmacy_id in list(self._by_medicine.get(medicine_id, ())):
+                self._set(pharmacy_id, medicine_id, 0, None)
+
+    def holders(self, medicine_ids, min_quantity=1):
+        """Pharmacies holding at least `min_quantity` of any of `medicine_ids`.
+
+        Returns `{pharmacy_id: [(medicine_id, quantity, price), ...]}`.
+        """
+        found = {}
+        with self._lock:
+            for medicine_id in medicine_ids:
+                for pharmacy_id, (quantity, price) in self._by_medicine.get(medicine_id, {}).items():
+                    if quantity >= min_quantity:
+                        found.setdefault(pharmacy_id, []).append((medicine_id, quantity, price))
+        return found
+
+
+def get_stock_index():
+    """Return the stock index of the current app, loading it on first use."""
+    index = current_app.extensions.get('stock_index')
+    if index is None:
+        index = current_app.extensions.setdefault('stock_index', StockIndex())
+    if not index.loaded:
+        with index._lock:
+            if not index.loaded:
+                _reload(index)
+    else:
+        interval = current_app.config.get('SPATIAL_INDEX_RECHECK_SECONDS', 0)
+        if interval and time.monotonic() - index.checked_at >= interval:
+            with index._lock:
+                if time.monotonic() - index.checked_at >= interval:
+                    index.checked_at = time.monotonic()
+                    if _table_signature() != index.signature:
+                        _reload(index)
+    return index
+
+
+def _table_signature():
+    return tuple(db.session.query(func.count(), func.max(PharmacyStock.updated_at)).select_from(PharmacyStock).one())
+
+
+def _reload(index):
+    index.signature = _table_signature()
+    index.checked_at = time.monotonic()
+    index.load(db.session.query(PharmacyStock.pharmacy_id, PharmacyStock.medicine_id, PharmacyStock.quantity,
+                                PharmacyStock.price).filter(PharmacyStock.quantity > 0))
+
+
+def _loaded_index():
+    index = current_app.extensions.get('stock_index')
+    return index if index is not None and index.loaded else None
+
+
+def set_pharmacy_stock(pharmacy_id, items):
+    """Upsert `(medicine_id, quantity, price)` items for one pharmacy and commit.
+
+    Existing rows are found with one query; updates and inserts are one
+    executemany each.
+    """
+    medicine_ids = [medicine_id for medicine_id, _, _ in items]
+    existing = set()
+    for start in range(0, len(medicine_ids), _IN_CHUNK):
+        existing.update(medicine_id for (medicine_id,) in db.session.query(PharmacyStock.medicine_id).filter(
+            PharmacyStock.pharmacy_id == pharmacy_id,
+            PharmacyStock.medicine_id.in_(medicine_ids[start:start + _IN_CHUNK])))
+
+    now = datetime.utcnow()
+    updates, inserts = [], []
+    for medicine_id, quantity, price in items:
+        if medicine_id in existing:
+            updates.append({'pid': pharmacy_id, 'mid': medicine_id, 'qty': quantity, 'unit_price': price, 'now': now})
+        else:
+            inserts.append({'pharmacy_id': pharmacy_id, 'medicine_id': medicine_id, 'quantity': quantity,
+                            'price': price, 'updated_at': now})
+    try:
+        if updates:
+            db.session.execute(
+                update(_stock).where(and_(_stock.c.pharmacy_id == bindparam('pid'), _stock.c.medicine_id == bindparam('mid')))
+                .values(quantity=bindparam('qty'), price=bindparam('unit_price'), updated_at=bindparam('now')),
+                updates)
+        if inserts:
+            db.session.execute(insert(_stock), inserts)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    index = _loaded_index()
+    if index is not None:
+        for medicine_id, quantity, price in items:
+            index.set(pharmacy_id, medicine_id, quantity, price)
+
+
+def delete_stock(pharmacy_id=None, medicine_id=None):
+    """Delete the stock rows of a pharmacy or a medicine, inside the caller's transaction."""
+    clauses = []
+    if pharmacy_id is not None:
+        clauses.append(_stock.c.pharmacy_id == pharmacy_id)
+    if medicine_id is not None:
+        clauses.append(_stock.c.medicine_id == medicine_id)
+    db.session.execute(delete(_stock).where(and_(*clauses)))
+
+
+def forget_stock(pharmacy_id=None, medicine_id=None):
+    """Drop a deleted pharmacy or medicine from the index, if it is loaded."""
+    index = _loaded_index()
+    if index is None:
+        return
+    if pharmacy_id is not None:
+        index.remove_pharmacy(pharmacy_id)
+    if medicine_id is not None:
+        index.remove_medicine(medicine_id)
+
+
+def nearest_in_stock(lat, lng, medicine_ids, min_quantity=1, k=10, radius_km=None):
+    """Return up to `k` `(distance_km, pharmacy_id, stock)` for the nearest pharmacies holding a medicine.
+
+    `stock` lists `(medicine_id, quantity, price)` for the matching medicines.
+    """
+    holders = get_stock_index().holders(medicine_ids, min_quantity)
+    if not holders:
+        return []
+    spatial = get_spatial_index()
+    if len(holders) <= _SCAN_MAX:
+        ranked = []
+        for pharmacy_id in holders:
+            point = spatial.location(pharmacy_id)
+            if point is not None:
+                ranked.append((haversine_km(lat, lng, point[0], point[1]), pharmacy_id))
+        ranked.sort()
+        ranked = ranked[:k]
+    else:
+        ranked = spatial.nearest(lat, lng, k, accept=holders.__contains__)
+    if radius_km is not None:
+        ranked = [(d, pharmacy_id) for d, pharmacy_id in ranked if d <= radius_km]
+    return [(d, pharmacy_id, holders[pharmacy_id]) for d, pharmacy_id in ranked]
@@ -0,0 +1,213 @@
+"""
+Precomputed map tiles.
+
+A tile, addressed `z/x/y` in the Web Mercator scheme used by web and mobile
+maps, holds what the map screen draws for that square:
+
+- `pins`: pharmacies as `[id, name, lat, lng]`.
+- `clusters`: below `CLUSTER_MAX_ZOOM`, the cells of the cluster hierarchy
+  (see clusters.py) inside the tile that hold more than one pharmacy, as
+  `[count, lat, lng, ids]` with their centroid and a few ids. Cells holding
+  one pharmacy stay pins.
+- `nearest`, from `TILE_NEAREST_MIN_ZOOM` up: every pharmacy within `r + 2h`
+  of the tile center, nearest first, where r is the distance from the
+  center to its K-th nearest pharmacy (`TILE_NEAREST_K`) and h the distance
+  from the center to a corner. The K nearest pharmacies of any location
+  inside the tile are among them, so the client ranks this short list
+  itself instead of calling the nearest endpoint. `complete` is false when
+  the list was cut at `TILE_NEAREST_MAX`; the client then falls back to
+  the API.
+
+Tiles are built on first request and stored with their response body ready
+to send, together with their reach: the box in which a create, update or
+delete can change them. Writes mark the tiles whose reach contains an old or
+new position stale, inside the writing transaction. A request for a stale
+tile rebuilds it and the tile-refresh job (`TILE_REFRESH_SECONDS`) rebuilds
+the others, so only tiles a write touched are ever regenerated.
+
+A rebuild takes the database write lock before reading any pharmacy, so on
+SQLite no write can commit between that read and the store and be missed.
+"""
+import hashlib
+import math
+from datetime import datetime
+
+import numpy as np  # type: ignore
+from sqlalchemy import bindparam, delete, insert, select, update  # type: ignore
+from sqlalchemy.exc import IntegrityError  # type: ignore
+
+from pharmacy_tracker_backend import db
+from pharmacy_tracker_backend.clusters import cells, cells_in
+from pharmacy_tracker_backend.database.models import MapTile, Pharmacy
+from pharmacy_tracker_backend.geo import (
+    EARTH_RADIUS_KM, haversine_km, radius_bbox, tile_bounds, tile_center, tile_radius_km
+)
+from pharmacy_tracker_backend.serialization import dumps
+
+_tiles = MapTile.__table__
+_pharmacies = Pharmacy.__table__
+# Decimal places kept for coordinates in tile bodies (about 10 cm)
+_DIGITS = 6
+# Slack around tile edges, so rounding never drops a pharmacy on a boundary
+_EDGE_DEG = 1e-9
+# Written points closer than this many degrees share one stale-marking query
+_TOUCH_CELL_DEG = 0.05
+# Half the Earth's circumference: a radius reaching every point
+_WORLD_KM = math.pi * EARTH_RADIUS_KM
+_WORLD = (-90.0, -180.0, 90.0, 180.0)
+
+
+def valid_tile(z, x, y, max_zoom):
+    return 0 <= z <= max_zoom and 0 <= x < (1 << z) and 0 <= y < (1 << z)
+
+
+def _rows_in(conn, box):
+    min_lat, min_lng, max_lat, max_lng = box
+    return conn.execute(
+        select(_pharmacies.c.id, _pharmacies.c.name, _pharmacies.c.latitude, _pharmacies.c.longitude)
+        .where(_pharmacies.c.latitude.between(min_lat, max_lat),
+               _pharmacies.c.longitude.between(min_lng, max_lng))).all()
+
+
+def _within(conn, lat, lng, radius_km):
+    """`(distance, row)` for every pharmacy within `radius_km` of a point, nearest first."""
+    near = []
+    for row in _rows_in(conn, radius_bbox(lat, lng, radius_km)):
+        distance = haversine_km(lat, lng, row[2], row[3])
+        if distance <= radius_km:
+            near.append((distance, row))
+    near.sort(key=lambda item: (item[0], item[1][0]))
+    return near
+
+
+def _pin(row):
+    return [row[0], row[1], round(row[2], _DIGITS), round(row[3], _DIGITS)]
+
+
+def _pins_and_clusters(conn, z, x, y, config):
+    """Pins and clusters of the pharmacies inside a tile."""
+    if z < config.get('CLUSTER_MAX_ZOOM', 16):
+        bits = config.get('CLUSTER_CELL_BITS', 3)
+        found = cells_in(conn, z + bits, x << bits, y << bits, ((x + 1) << bits) - 1, ((y + 1) << bits) - 1)
+        single = [ids[0] for count, _, _, ids in found if count == 1]
+        names = {}
+        if single:
+            names = dict(conn.execute(
+                select(_pharmacies.c.id, _pharmacies.c.name).where(_pharmacies.c.id.in_(single))).all())
+        pins = [_pin((ids[0], names.get(ids[0]), lat, lng)) for count, lat, lng, ids in found if count == 1]
+        clusters = [[count, round(lat, _DIGITS), round(lng, _DIGITS), ids] for count, lat, lng, ids in found if count > 1]
+        return pins, clusters
+
+    min_lat, min_lng, max_lat, max_lng = tile_bounds(z, x, y)
+    rows = _rows_in(conn, (min_lat - _EDGE_DEG, min_lng - _EDGE_DEG, max_lat + _EDGE_DEG, max_lng + _EDGE_DEG))
+    if not rows:
+        return [], []
+    xs, ys = cells(np.array([row[2] for row in rows]), np.array([row[3] for row in rows]), z)
+    return [_pin(row) for row, tile_x, tile_y in zip(rows, xs.tolist(), ys.tolist()) if (tile_x, tile_y) == (x, y)], []
+
+
+def _nearest(conn, z, x, y, k, cap):
+    """`(candidates, complete, reach)` for the nearest-pharmacy list of a tile."""
+    lat, lng = tile_center(z, x, y)
+    corner = tile_radius_km(z, x, y)
+    radius = max(2 * corner, 1.0)
+    while True:
+        near = _within(conn, lat, lng, radius)
+        if len(near) >= k or radius >= _WORLD_KM:
+            break
+        radius = min(radius * 4, _WORLD_KM)
+    if len(near) < k:
+        # Fewer than K pharmacies exist, so a new one anywhere joins the list
+        return near, True, _WORLD
+    reach_km = near[k - 1][0] + 2 * corner
+    # Widen to the reach, stopping early once more than `cap` pharmacies are in range
+    while radius < reach_km and len(near) <= cap:
+        radius = min(radius * 2, reach_km)
+        near = _within(conn, lat, lng, radius)
+    near = [item for item in near if item[0] <= reach_km]
+    return near[:cap], len(near) <= cap, radius_bbox(lat, lng, reach_km)
+
+
+def build_tile(conn, z, x, y, config):
+    """Return `(data, reach)` for a tile, reading pharmacies through `conn`."""
+    min_lat, min_lng, max_lat, max_lng = tile_bounds(z, x, y)
+    reach = (min_lat - _EDGE_DEG, min_lng - _EDGE_DEG, max_lat + _EDGE_DEG, max_lng + _EDGE_DEG)
+    pins, clusters = _pins_and_clusters(conn, z, x, y, config)
+    data = {'z': z, 'x': x, 'y': y, 'pins': pins, 'clusters': clusters, 'nearest': None}
+
+    if z >= config.get('TILE_NEAREST_MIN_ZOOM', 12):
+        k = config.get('TILE_NEAREST_K', 10)
+        candidates, complete, nearest_reach = _nearest(conn, z, x, y, k, config.get('TILE_NEAREST_MAX', 100))
+        data['nearest'] = {'k': k, 'complete': complete, 'pharmacies': [_pin(row) for _, row in candidates]}
+        reach = (min(reach[0], nearest_reach[0]), min(reach[1], nearest_reach[1]),
+                 max(reach[2], nearest_reach[2]), max(reach[3], nearest_reach[3]))
+    return data, reach
+
+
+def _key(z, x, y):
+    return (_tiles.c.z == z) & (_tiles.c.x == x) & (_tiles.c.y == y)
+
+
+def refresh_tile(z, x, y, config, only_stale=False):
+    """Build a tile and store it. Returns `(body, etag)`, or None when `only_stale` and it is fresh."""
+    now = datetime.utcnow()
+    try:
+        with db.engine.begin() as conn:
+            # A no-op write takes the write lock first, so the pharmacies read below stay current until commit
+            conn.execute(update(_tiles).where(_key(z, x, y)).values(stale=_tiles.c.stale))
+            current = conn.execute(select(_tiles.c.body, _tiles.c.etag, _tiles.c.stale).where(_key(z, x, y))).first()
+            if current is not None and not current.stale:
+                return None if only_stale else (current.body, current.etag)
+
+            data, reach = build_tile(conn, z, x, y, config)
+            data['generated_at'] = now.isoformat()
+            body = dumps({'success': True, 'data': data})
+            etag = hashlib.sha1(body).hexdigest()
+            conn.execute(delete(_tiles).where(_key(z, x, y)))
+            conn.execute(insert(_tiles).values(
+                z=z, x=x, y=y, body=body, etag=etag, stale=False, generated_at=now,
+                reach_min_lat=reach[0], reach_min_lng=reach[1], reach_max_lat=reach[2], reach_max_lng=reach[3]))
+    except IntegrityError:
+        pass  # stored by another worker at the same moment; ours is just as current
+    return body, etag
+
+
+def get_tile(z, x, y, config):
+    """`(body, etag)` of a tile, building it when it is missing or stale."""
+    row = db.session.execute(select(_tiles.c.body, _tiles.c.etag, _tiles.c.stale).where(_key(z, x, y))).first()
+    if row is not None and not row.stale:
+        return row.body, row.etag
+    return refresh_tile(z, x, y, config)
+
+
+def touch_tiles(points):
+    """Mark stale every stored tile a change at one of `points` may affect, inside the caller's transaction."""
+    boxes = {}
+    for lat, lng in points:
+        if lat is None or lng is None:
+            continue
+        lat, lng = float(lat), float(lng)
+        cell = (math.floor(lat / _TOUCH_CELL_DEG), math.floor(lng / _TOUCH_CELL_DEG))
+        box = boxes.get(cell)
+        boxes[cell] = (lat, lng, lat, lng) if box is None else (
+            min(box[0], lat), min(box[1], lng), max(box[2], lat), max(box[3], lng))
+    if not boxes:
+        return
+    db.session.execute(
+        update(_tiles).where(
+            _tiles.c.stale.is_(False),
+            _tiles.c.reach_min_lat <= bindparam('box_max_lat'), _tiles.c.reach_max_lat >= bindparam('box_min_lat'),
+            _tiles.c.reach_min_lng <= bindparam('box_max_lng'), _tiles.c.reach_max_lng >= bindparam('box_min_lng'))
+        .values(stale=True),
+        [{'box_min_lat': box[0], 'box_min_lng': box[1], 'box_max_lat': box[2], 'box_max_lng': box[3]}
+         for box in boxes.values()])
+
+
+def refresh_stale_tiles(config, limit=200):
+    """Rebuild up to `limit` stale tiles, lowest zoom last. Returns how many were rebuilt."""
+    stale = db.session.execute(
+        select(_tiles.c.z, _tiles.c.x, _tiles.c.y).where(_tiles.c.stale.is_(True))
+        .order_by(_tiles.c.z.desc()).limit(limit)).all()
+    db.session.commit()
+    # Another worker may have got to a tile first; only_stale skips those
+    return sum(refresh_tile(z, x, y, config, only_stale=True) is not None for z, x, y in stale)
@@ -1,9 +1,63 @@
 #!/usr/bin/env python
+"""
+Start the backend.
+
+    python run.py            # Flask development server with the debugger
+    python run.py serve      # production server, see gunicorn.conf.py
+    python run.py serve --async --workers 4
+
+"""
+import argparse
 import os
-from pharmacy_tracker_backend import create_app, db
+import sys
 
-app = create_app()
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
 
-if __name__ == '__main__':
+
+def serve(args):
+    """Run the app under gunicorn with the settings in gunicorn.conf.py."""
+    try:
+        from gunicorn.app.wsgiapp import run  # type: ignore
+    except ImportError:
+        sys.exit('gunicorn is not installed: pip install gunicorn (and gevent for --async)')
+
+    # Command-line flags override the environment, which gunicorn.conf.py reads
+    overrides = {'SERVE_MODE': 'async' if args.use_async else None, 'WEB_CONCURRENCY': args.workers,
+                 'THREADS': args.threads, 'WORKER_CONNECTIONS': args.connections,
+                 'KEEPALIVE': args.keepalive, 'BIND': args.bind}
+    for name, value in overrides.items():
+        if value is not None:
+            os.environ[name] = str(value)
+
+    sys.argv = ['gunicorn', '--chdir', BACKEND_DIR, '--config', os.path.join(BACKEND_DIR, 'gunicorn.conf.py'),
+                'wsgi:app']
+    run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command')
+    serve_parser = commands.add_parser('serve', help='run under gunicorn')
+    serve_parser.add_argument('--async', dest='use_async', action='store_true', help='gevent workers')
+    serve_parser.add_argument('--workers', type=int)
+    serve_parser.add_argument('--threads', type=int, help='threads per worker (sync mode)')
+    serve_parser.add_argument('--connections', type=int, help='concurrent connections per worker (async mode)')
+    serve_parser.add_argument('--keepalive', type=int, help='seconds to keep idle connections open')
+    serve_parser.add_argument('--bind', help='host:port, defaults to 0.0.0.0:$PORT')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(args)
+        return
+
+    from pharmacy_tracker_backend import create_app
+    from pharmacy_tracker_backend.scheduler import start_background_jobs
+
+    app = create_app()
+    start_background_jobs(app)
     port = int(os.environ.get('PORT', 4000))
     app.run(debug=True, host='0.0.0.0', port=port)
+
+
+if __name__ == '__main__':
+    main()
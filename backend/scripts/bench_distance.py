@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+Benchmark nearest-pharmacy ranking: the original per-row Haversine loop plus
+full sort versus the vectorized DistanceEngine.
+
+Uses synthetic coordinates spread over Rwanda, so no database is needed.
+Run from the `backend` folder:
+
+    python scripts/bench_distance.py
+    python scripts/bench_distance.py --sizes 1000 100000 --origins 200
+
+"""
+import argparse
+import math
+import random
+import time
+
+from pharmacy_tracker_backend.geo.distance import DistanceEngine
+
+
+def loop_nearest(rows, lat, lng, k):
+    # Mirrors the handler before the distance engine: per-row math calls, full sort
+    def distance(lat1, lon1, lat2, lon2):
+        R = 6371
+        phi1 = math.radians(lat1)
+        phi2 = math.radians(lat2)
+        delta_phi = math.radians(lat2 - lat1)
+        delta_lambda = math.radians(lon2 - lon1)
+        a = math.sin(delta_phi/2)**2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda/2)**2
+        return R * 2 * math.asin(math.sqrt(a))
+
+    ranked = sorted(rows, key=lambda r: distance(lat, lng, r[1], r[2]))
+    return ranked[:k]
+
+
+def best_of(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--origins', type=int, default=100, help='origins ranked per rank_many call')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f'{"rows":>9} {"loop+sort":>12} {"engine":>12} {"speedup":>8} {"load":>10} {"batch/origin":>13}')
+
+    rng = random.Random(42)
+    for size in args.sizes:
+        rows = [(str(i), rng.uniform(-2.85, -1.05), rng.uniform(28.85, 30.9)) for i in range(size)]
+        lat, lng = -1.9536, 29.8739
+
+        engine = DistanceEngine()
+        load = best_of(lambda: engine.load(rows), 1)
+
+        loop_time = best_of(lambda: loop_nearest(rows, lat, lng, args.k), 1 if size >= 1000000 else args.repeat)
+        engine_time = best_of(lambda: engine.nearest(lat, lng, args.k), args.repeat)
+
+        origins = [(rng.uniform(-2.85, -1.05), rng.uniform(28.85, 30.9)) for _ in range(args.origins)]
+        batch_time = best_of(lambda: engine.rank_many(origins, args.k), 1) / len(origins)
+
+        expected = [r[0] for r in loop_nearest(rows, lat, lng, args.k)]
+        got = [pid for _, pid in engine.nearest(lat, lng, args.k)]
+        assert got == expected, 'engine and loop disagree'
+
+        print(f'{size:>9} {loop_time * 1000:>10.2f}ms {engine_time * 1000:>10.2f}ms '
+              f'{loop_time / engine_time:>7.1f}x {load * 1000:>8.1f}ms {batch_time * 1000:>11.3f}ms')
+
+
+if __name__ == '__main__':
+    main()
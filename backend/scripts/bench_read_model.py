@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+Measure the memory footprint of the in-process read model against the same
+pharmacies loaded as ORM instances with their services, and the time to
+serve a page from each.
+
+Loads synthetic pharmacies into a throwaway SQLite database and reports
+bytes per 100k rows, as traced by tracemalloc. Run from the `backend`
+folder:
+
+    python scripts/bench_read_model.py
+    python scripts/bench_read_model.py --rows 20000
+
+"""
+import argparse
+import gc
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+
+def traced(fn):
+    """`(result, bytes allocated and still held by the result)`."""
+    gc.collect()
+    tracemalloc.start()
+    result = fn()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def best_of(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--limit', type=int, default=50, help='page size for the timing')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    os.environ['CACHE_BACKEND'] = 'none'
+    from pharmacy_tracker_backend import create_app, db
+    from pharmacy_tracker_backend.bulk_import import import_pharmacies
+    from pharmacy_tracker_backend.database.models import Pharmacy
+    from pharmacy_tracker_backend.read_model import PharmacyReadModel, _read_rows
+    from pharmacy_tracker_backend.serialization import PHARMACY_FIELDS
+
+    app = create_app()
+    rng = random.Random(42)
+    services = ['Delivery', 'Vaccinations', '24 hours', 'Lab tests', 'Consultation']
+    records = [(i + 1, {'name': f'Pharmacy {i}', 'phone': f'+250788{i:06d}', 'email': f'p{i}@example.com',
+                        'address': f'KG {i} St, Kigali', 'latitude': rng.uniform(-2.85, -1.05),
+                        'longitude': rng.uniform(28.85, 30.9), 'opening_hours': 'Mon-Sat 08:00-20:00',
+                        'services': rng.sample(services, rng.randint(0, 3))}, None)
+               for i in range(args.rows)]
+
+    with app.test_request_context():
+        import_pharmacies(iter(records), 'skip', 1000)
+        del records
+
+        def orm_load():
+            db.session.expunge_all()
+            return Pharmacy.query.all()  # services load with them (selectin)
+
+        def model_load():
+            model = PharmacyReadModel()
+            model.load(*_read_rows())
+            return model
+
+        orm, orm_bytes = traced(orm_load)
+        orm_page = best_of(lambda: [p.to_dict() for p in orm[:args.limit]], args.repeat)
+        orm = None  # released before the model is traced
+        db.session.expunge_all()
+        model, model_bytes = traced(model_load)
+        model_page = best_of(lambda: model.page(PHARMACY_FIELDS, limit=args.limit), args.repeat)
+        estimate = model.memory_bytes()
+
+    scale = 100000 / args.rows
+    print(f'{args.rows} rows, reported per 100k rows')
+    print(f'{"ORM objects":>14} {orm_bytes * scale / 2**20:>9.1f}MB {orm_bytes / args.rows:>8.0f}B/row')
+    print(f'{"read model":>14} {model_bytes * scale / 2**20:>9.1f}MB {model_bytes / args.rows:>8.0f}B/row'
+          f'  (memory_bytes(): {estimate * scale / 2**20:.1f}MB)')
+    print(f'{"ratio":>14} {orm_bytes / model_bytes:>9.1f}x')
+    print(f'{"page of " + str(args.limit):>14} ORM to_dict() {orm_page * 1000:.2f}ms, read model {model_page * 1000:.2f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""
+Benchmark serializing a page of pharmacies: ORM instances with to_dict()
+and jsonify versus tuple rows, a compiled serializer and the fast encoder.
+
+Loads synthetic pharmacies into a throwaway SQLite database. Run from the
+`backend` folder:
+
+    python scripts/bench_serialization.py
+    python scripts/bench_serialization.py --rows 50000 --fields id,name,latitude,longitude
+
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+
+def best_of(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--fields', default='', help='sparse fieldset for the lean path, e.g. id,name')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    os.environ['CACHE_BACKEND'] = 'none'
+    from pharmacy_tracker_backend import create_app, db
+    from pharmacy_tracker_backend.bulk_import import import_pharmacies
+    from pharmacy_tracker_backend.database.models import Pharmacy
+    from pharmacy_tracker_backend.serialization import (
+        dumps, orjson, parse_fields, pharmacy_columns, serialize_pharmacies
+    )
+
+    app = create_app()
+    rng = random.Random(42)
+    services = ['Delivery', 'Vaccinations', '24 hours', 'Lab tests', 'Consultation']
+    records = [(i + 1, {'name': f'Pharmacy {i}', 'phone': f'+250788{i:06d}', 'email': f'p{i}@example.com',
+                        'address': f'KG {i} St, Kigali', 'latitude': rng.uniform(-2.85, -1.05),
+                        'longitude': rng.uniform(28.85, 30.9), 'opening_hours': 'Mon-Sat 08:00-20:00',
+                        'services': rng.sample(services, rng.randint(0, 3))}, None)
+               for i in range(args.rows)]
+    fields = parse_fields(args.fields)
+
+    with app.test_request_context():
+        import_pharmacies(iter(records), 'skip', 1000)
+
+        def orm_rows():
+            db.session.expunge_all()
+            return Pharmacy.query.all()
+
+        def orm_path():
+            return app.json.response({'success': True, 'data': [p.to_dict() for p in orm_rows()]}).get_data()
+
+        def lean_rows():
+            return db.session.query(*pharmacy_columns(fields)).all()
+
+        def lean_path():
+            return dumps({'success': True, 'data': serialize_pharmacies(lean_rows(), fields)})
+
+        rows = orm_rows()
+        data = [p.to_dict() for p in rows]
+        lean = lean_rows()
+        lean_data = serialize_pharmacies(lean, fields)
+        stages = [
+            ('ORM load', best_of(orm_rows, args.repeat)),
+            ('to_dict()', best_of(lambda: [p.to_dict() for p in rows], args.repeat)),
+            ('jsonify', best_of(lambda: app.json.response({'data': data}).get_data(), args.repeat)),
+            ('ORM total', best_of(orm_path, args.repeat)),
+            ('tuple load', best_of(lean_rows, args.repeat)),
+            ('serialize', best_of(lambda: serialize_pharmacies(lean, fields), args.repeat)),
+            ('encode', best_of(lambda: dumps({'data': lean_data}), args.repeat)),
+            ('lean total', best_of(lean_path, args.repeat)),
+        ]
+
+    print(f'{args.rows} rows, fields: {args.fields or "all"}, encoder: {"orjson" if orjson else "json"}')
+    for name, seconds in stages:
+        print(f'{name:>12} {seconds * 1000:>9.1f}ms {seconds / args.rows * 1e6:>8.2f}us/row')
+    before, after = stages[3][1], stages[-1][1]
+    print(f'{"speedup":>12} {before / after:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
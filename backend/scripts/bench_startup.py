@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+Measure how long a fresh process takes to answer its first requests.
+
+Each run starts a new interpreter. It times importing the package,
+create_app() and then the first list and nearest requests through the test
+client. The whole process is timed as well, interpreter start included.
+Medians over `--repeat` runs are printed, or written as JSON with `--json`
+(this is how scripts/benchmark.py records them). The database must already
+be migrated. Run from the `backend` folder:
+
+    python scripts/migrate.py
+    python scripts/bench_startup.py
+    python scripts/bench_startup.py --database /tmp/pharmacy-benchmark/pharmacies-100000.db --repeat 10
+
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Milliseconds reported per run, in the order they happen
+FIELDS = ('import_ms', 'create_app_ms', 'first_list_ms', 'first_nearest_ms', 'ready_ms', 'process_ms')
+
+
+def child():
+    """Time this process's startup and print it as JSON. Nothing of the app may be imported before."""
+    started = time.perf_counter()
+    from pharmacy_tracker_backend import create_app
+    imported = time.perf_counter()
+    app = create_app()
+    created = time.perf_counter()
+    client = app.test_client()
+    client.get('/api/pharmacies?limit=50')
+    listed = time.perf_counter()
+    client.get('/api/pharmacies?lat=-1.9536&lng=29.8739&limit=10')
+    ranked = time.perf_counter()
+    print(json.dumps({
+        'import_ms': (imported - started) * 1000,
+        'create_app_ms': (created - imported) * 1000,
+        'first_list_ms': (listed - created) * 1000,
+        'first_nearest_ms': (ranked - listed) * 1000,
+        # Until the first response: what a new worker costs before it is useful
+        'ready_ms': (listed - started) * 1000,
+    }))
+
+
+def measure(database, repeat):
+    """Median startup timings, in milliseconds, of `repeat` fresh processes on `database`."""
+    path = os.pathsep.join(filter(None, [BACKEND_DIR, os.environ.get('PYTHONPATH')]))
+    env = dict(os.environ, PYTHONPATH=path, CACHE_BACKEND='none')
+    if database:
+        env['DATABASE_URL'] = 'sqlite:///' + database
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child'], cwd=BACKEND_DIR, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        run = json.loads(output.strip().splitlines()[-1])
+        run['process_ms'] = (time.perf_counter() - started) * 1000
+        runs.append(run)
+    return {name: round(statistics.median(run[name] for run in runs), 1) for name in FIELDS}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', help='SQLite file to start on; DATABASE_URL otherwise')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='print the medians as one JSON object')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child()
+        return
+
+    timings = measure(args.database, args.repeat)
+    if args.json:
+        print(json.dumps(timings))
+        return
+    print(f'median of {args.repeat} fresh processes')
+    for name in FIELDS:
+        print(f'{name[:-3]:>16} {timings[name]:>9.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
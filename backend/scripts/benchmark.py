@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+"""
+Benchmark the pharmacy API at several dataset sizes.
+
+For each size a synthetic dataset is generated around the Rwanda base
+locations of `seed_pharmacies.py` and loaded into its own SQLite database.
+A local production server (`run.py serve`) is started on it, and each
+scenario is driven for a fixed time by concurrent keep-alive clients:
+nearest-N, search, list, get-by-id and create. Each scenario records
+p50/p95/p99 latency, throughput and errors. The run also records the peak
+RSS of the server workers and the startup cost of a fresh process (import,
+create_app() and first requests, see bench_startup.py). Results go to a
+JSON file that a later run can be compared against.
+
+Run from the `backend` folder:
+
+    python scripts/benchmark.py --sizes 1000 100000
+    python scripts/benchmark.py --output before.json
+    python scripts/benchmark.py --output after.json --compare before.json
+
+Datasets are kept in `--data-dir` and reused by later runs of the same size.
+Generating the 1M dataset takes several minutes and about 2.5 GB of disk.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from bench_startup import measure as measure_startup
+from load_test import percentile
+from seed_pharmacies import BASE_LOCATIONS, sample_pharmacy
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ('nearest', 'search', 'list', 'get', 'create')
+# Search terms: the base locations, whole and as typed prefixes
+_TERMS = [name.split()[0].lower() for name, _, _ in BASE_LOCATIONS] + ['kic', 'musa', 'block 7']
+# A p95 this much slower than the compared run is flagged
+_REGRESSION = 1.10
+
+
+def generate(path, size, seed):
+    """Create a SQLite database at `path` holding `size` synthetic pharmacies."""
+    from pharmacy_tracker_backend import create_base_app, db
+    from pharmacy_tracker_backend.bulk_import import import_pharmacies
+    from pharmacy_tracker_backend.config import Config
+
+    class DatasetConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + path
+        SQLALCHEMY_ENGINE_OPTIONS = {}
+        DATABASE_REPLICA_URL = None
+
+    rng = random.Random(seed)
+    # Phone numbers must be unique, so they follow the row number
+    records = ((i, dict(sample_pharmacy(i, rng), phone_number=f'+2507{i:08d}'), None) for i in range(1, size + 1))
+    app = create_base_app(DatasetConfig)
+    with app.app_context():
+        report = import_pharmacies(records, 'skip', 5000)
+        # Fold the WAL into the database file before it is renamed
+        db.session.execute(db.text('PRAGMA wal_checkpoint(TRUNCATE)'))
+    if report['inserted'] != size:
+        raise SystemExit(f'dataset load failed: {report}')
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(database, workers, cache):
+    port = _free_port()
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + database, CACHE_BACKEND=cache)
+    process = subprocess.Popen(
+        [sys.executable, 'run.py', 'serve', '--workers', str(workers), '--bind', f'127.0.0.1:{port}'],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    deadline = time.monotonic() + 300
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit('server exited during startup')
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/health')
+            if conn.getresponse().status == 200:
+                conn.close()
+                return process, port
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise SystemExit('server did not start')
+
+
+def stop_server(process):
+    os.killpg(process.pid, signal.SIGTERM)
+    try:
+        process.wait(30)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+
+def peak_rss_mb(pid):
+    """Peak resident memory of `pid` and its children, per process, from /proc. Empty where /proc is missing."""
+    peaks = {}
+    try:
+        names = os.listdir('/proc')
+    except OSError:
+        return peaks
+    for name in names:
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/status') as status:
+                fields = dict(line.split(':', 1) for line in status if ':' in line)
+        except OSError:
+            continue
+        if int(name) == pid or int(fields.get('PPid', '0')) == pid:
+            peaks[int(name)] = int(fields.get('VmHWM', '0 kB').split()[0]) / 1024
+    return peaks
+
+
+def _request(scenario, rng, ids, counter):
+    """`(method, path, body)` for one request of `scenario`."""
+    base = rng.choice(BASE_LOCATIONS)
+    lat, lng = base[1] + rng.uniform(-0.05, 0.05), base[2] + rng.uniform(-0.05, 0.05)
+    if scenario == 'nearest':
+        return 'GET', f'/api/pharmacies?lat={lat:.5f}&lng={lng:.5f}&limit=10', None
+    if scenario == 'search':
+        return 'GET', f'/api/pharmacies?search={rng.choice(_TERMS).replace(" ", "+")}&limit=20', None
+    if scenario == 'list':
+        return 'GET', '/api/pharmacies?limit=50', None
+    if scenario == 'get':
+        return 'GET', f'/api/pharmacies/{rng.choice(ids)}', None
+    number = next(counter)
+    body = dict(sample_pharmacy(number, rng), phone_number=f'+2508{number:08d}')
+    return 'POST', '/api/pharmacies', json.dumps(body)
+
+
+def _client(port, scenario, ids, counter, warmup_until, deadline, seed, results):
+    rng = random.Random(seed)
+    latencies, errors = [], 0
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    while True:
+        start = time.perf_counter()
+        if time.monotonic() >= deadline:
+            break
+        method, path, body = _request(scenario, rng, ids, counter)
+        try:
+            conn.request(method, path, body=body, headers={'Content-Type': 'application/json'} if body else {})
+            response = conn.getresponse()
+            response.read()
+            ok = response.status < 300
+        except (OSError, http.client.HTTPException):
+            ok = False
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        if time.monotonic() < warmup_until:
+            continue
+        if ok:
+            latencies.append(time.perf_counter() - start)
+        else:
+            errors += 1
+    conn.close()
+    results.append((latencies, errors))
+
+
+def run_scenario(port, scenario, ids, concurrency, duration, warmup, counter):
+    results = []
+    warmup_until = time.monotonic() + warmup
+    deadline = warmup_until + duration
+    threads = [threading.Thread(target=_client, args=(port, scenario, ids, counter, warmup_until, deadline, i,
+                                                      results))
+               for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies = [value for batch, _ in results for value in batch]
+    return {
+        'requests': len(latencies),
+        'errors': sum(errors for _, errors in results),
+        'rps': round(len(latencies) / duration, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'max_ms': round(max(latencies, default=0) * 1000, 2),
+    }
+
+
+def fetch_ids(port, count=500):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    conn.request('GET', f'/api/pharmacies?limit={count}&fields=id')
+    ids = [item['id'] for item in json.loads(conn.getresponse().read())['data']]
+    conn.close()
+    return ids
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(run, previous):
+    """Print p95, throughput and startup changes against an earlier results file."""
+    before = {(row['size'], row['scenario']): row for row in previous['results']}
+    print(f'\ncompared with {previous.get("commit") or "?"} ({previous.get("started_at", "?")})')
+    regressions = 0
+    for row in run['results']:
+        old = before.get((row['size'], row['scenario']))
+        if old is None or not old['p95_ms'] or not old['rps']:
+            continue
+        flag = ''
+        if row['p95_ms'] > old['p95_ms'] * _REGRESSION:
+            flag = '  REGRESSION'
+            regressions += 1
+        print(f"{row['size']:>9} {row['scenario']:<8} p95 {old['p95_ms']:>8.2f} -> {row['p95_ms']:>8.2f}ms "
+              f"({row['p95_ms'] / old['p95_ms'] - 1:+.0%})  rps {old['rps']:>8.1f} -> {row['rps']:>8.1f} "
+              f"({row['rps'] / old['rps'] - 1:+.0%}){flag}")
+
+    # Results written before startup was measured have no `startup`
+    startups = {dataset['size']: dataset['startup'] for dataset in previous.get('datasets', []) if 'startup' in dataset}
+    for dataset in run['datasets']:
+        old = startups.get(dataset['size'])
+        if not old or not old['ready_ms']:
+            continue
+        new = dataset['startup']
+        flag = ''
+        if new['ready_ms'] > old['ready_ms'] * _REGRESSION:
+            flag = '  REGRESSION'
+            regressions += 1
+        print(f"{dataset['size']:>9} startup  ready {old['ready_ms']:>8.1f} -> {new['ready_ms']:>8.1f}ms "
+              f"({new['ready_ms'] / old['ready_ms'] - 1:+.0%})  import {old['import_ms']:.0f} -> "
+              f"{new['import_ms']:.0f}ms  create_app {old['create_app_ms']:.0f} -> {new['create_app_ms']:.0f}ms{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--duration', type=float, default=10.0, help='measured seconds per scenario')
+    parser.add_argument('--warmup', type=float, default=2.0, help='unmeasured seconds before each scenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent clients')
+    parser.add_argument('--workers', type=int, default=2, help='server worker processes')
+    parser.add_argument('--cache', choices=('none', 'memory'), default='none',
+                        help='response cache of the server; off by default so handlers are measured')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'pharmacy-benchmark'))
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--startup-repeat', type=int, default=5, help='fresh processes timed per dataset')
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--compare', help='earlier results file to compare with')
+    parser.add_argument('--generate', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.generate:
+        generate(args.output, args.generate, args.seed)
+        return
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    run = {
+        'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'settings': {name: getattr(args, name) for name in ('duration', 'warmup', 'concurrency', 'workers', 'cache',
+                                                             'seed')},
+        'datasets': [],
+        'results': [],
+    }
+    for size in args.sizes:
+        base = os.path.join(args.data_dir, f'pharmacies-{size}')
+        database = base + '.db'
+        if not os.path.exists(database):
+            print(f'generating {size} pharmacies...', flush=True)
+            started = time.perf_counter()
+            # A separate process keeps the loader's memory out of this one
+            subprocess.run([sys.executable, __file__, '--generate', str(size), '--seed', str(args.seed),
+                            '--output', base + '.tmp.db'], check=True)
+            os.replace(base + '.tmp.db', database)
+            print(f'  loaded in {time.perf_counter() - started:.1f}s')
+        # Writes of the create scenario go to a copy, so every run starts from the same data
+        work = base + '.run.db'
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(work + suffix):
+                os.remove(work + suffix)
+        shutil.copyfile(database, work)
+
+        started = time.perf_counter()
+        process, port = start_server(work, args.workers, args.cache)
+        startup = time.perf_counter() - started
+        try:
+            ids = fetch_ids(port)
+            # Phone numbers of created pharmacies, clear of the dataset's
+            counter = itertools.count(size * 10)
+            for scenario in args.scenarios:
+                row = dict(size=size, scenario=scenario,
+                           **run_scenario(port, scenario, ids, args.concurrency, args.duration, args.warmup, counter))
+                run['results'].append(row)
+                print(f"{size:>9} {scenario:<8} {row['rps']:>8.1f} req/s  p50 {row['p50_ms']:>8.2f}ms  "
+                      f"p95 {row['p95_ms']:>8.2f}ms  p99 {row['p99_ms']:>8.2f}ms  errors {row['errors']}", flush=True)
+            peaks = peak_rss_mb(process.pid)
+        finally:
+            stop_server(process)
+        # The server has migrated the copy, so these runs only check the schema
+        cold = measure_startup(work, args.startup_repeat)
+        run['datasets'].append({
+            'size': size,
+            'database_mb': round(os.path.getsize(database) / 1e6, 1),
+            'server_startup_s': round(startup, 2),
+            'peak_rss_mb_max': round(max(peaks.values(), default=0), 1),
+            'peak_rss_mb_total': round(sum(peaks.values()), 1),
+            'startup': cold,
+        })
+        print(f"{size:>9} startup {startup:.2f}s, peak RSS {run['datasets'][-1]['peak_rss_mb_max']} MB per process, "
+              f"{run['datasets'][-1]['peak_rss_mb_total']} MB total")
+        print(f"{size:>9} fresh process: import {cold['import_ms']:.0f}ms, create_app {cold['create_app_ms']:.0f}ms, "
+              f"first list {cold['first_list_ms']:.0f}ms, first nearest {cold['first_nearest_ms']:.0f}ms", flush=True)
+
+    with open(args.output, 'w') as out:
+        json.dump(run, out, indent=2)
+    print(f'results written to {args.output}')
+    if args.compare:
+        with open(args.compare) as previous:
+            if compare(run, json.load(previous)):
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+"""
+Build the map tiles around every pharmacy ahead of the first requests, e.g.
+after a bulk import or a deploy to a fresh database. Tiles already stored
+and fresh are left alone. Run from the `backend` folder:
+
+    python scripts/build_tiles.py
+    python scripts/build_tiles.py --zoom 12-16
+
+"""
+import argparse
+import sys
+import time
+
+from pharmacy_tracker_backend import create_base_app, db
+from pharmacy_tracker_backend.database.models import Pharmacy
+from pharmacy_tracker_backend.geo import tile_for
+from pharmacy_tracker_backend.tiles import refresh_tile
+
+
+def zoom_range(value):
+    first, _, last = value.partition('-')
+    zooms = range(int(first), int(last or first) + 1)
+    if not zooms:
+        raise argparse.ArgumentTypeError('zoom range is empty')
+    return zooms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--zoom', type=zoom_range, default=zoom_range('10-16'),
+                        help='zoom level or range of levels to build (default 10-16)')
+    args = parser.parse_args()
+
+    app = create_base_app()
+    with app.app_context():
+        if args.zoom[-1] > app.config['TILE_MAX_ZOOM']:
+            parser.error(f"zoom levels above TILE_MAX_ZOOM ({app.config['TILE_MAX_ZOOM']}) are never served")
+        points = db.session.query(Pharmacy.latitude, Pharmacy.longitude).all()
+        db.session.commit()
+        for z in args.zoom:
+            start = time.perf_counter()
+            tiles = sorted({tile_for(lat, lng, z) for lat, lng in points})
+            built = sum(refresh_tile(z, x, y, app.config, only_stale=True) is not None for x, y in tiles)
+            print(f'zoom {z}: {len(tiles)} tiles, {built} built in {time.perf_counter() - start:.2f}s')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""
+Load a pharmacy registry dump into the database.
+
+Accepts CSV (header row with the JSON field names), NDJSON or a JSON array.
+Rows that fail validation or clash with an existing pharmacy are listed at
+the end; the rest of the file is still loaded. Run from the `backend`
+folder:
+
+    python scripts/import_pharmacies.py registry.csv
+    python scripts/import_pharmacies.py registry.ndjson --on-conflict update
+    cat registry.ndjson | python scripts/import_pharmacies.py - --format ndjson
+
+"""
+import argparse
+import io
+import sys
+import time
+
+from pharmacy_tracker_backend import create_base_app
+from pharmacy_tracker_backend.bulk_import import (
+    CONFLICT_MODES, DEFAULT_CHUNK_SIZE, FORMATS, import_pharmacies, iter_records
+)
+
+_EXTENSIONS = {'csv': 'csv', 'ndjson': 'ndjson', 'jsonl': 'ndjson', 'json': 'json'}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help="input file, or - for stdin")
+    parser.add_argument('--format', choices=FORMATS, help='defaults to the file extension')
+    parser.add_argument('--on-conflict', choices=CONFLICT_MODES, default='skip',
+                        help='what to do with pharmacies whose phone number already exists')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='rows per transaction')
+    parser.add_argument('--show-errors', type=int, default=20, help='row errors to print')
+    args = parser.parse_args()
+
+    fmt = args.format or _EXTENSIONS.get(args.path.rsplit('.', 1)[-1].lower())
+    if fmt is None:
+        parser.error('cannot tell the format from the file name; pass --format')
+
+    if args.path == '-':
+        stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8-sig', newline='')
+    else:
+        stream = open(args.path, encoding='utf-8-sig', newline='')
+
+    app = create_base_app()
+    with app.app_context(), stream:
+        start = time.perf_counter()
+        report = import_pharmacies(iter_records(stream, fmt), args.on_conflict, args.chunk_size)
+        elapsed = time.perf_counter() - start
+
+    print(f"Read {report['received']} rows in {elapsed:.1f}s: {report['inserted']} inserted, "
+          f"{report['updated']} updated, {report['skipped']} skipped, {report['failed']} failed")
+    for error in report['errors'][:args.show_errors]:
+        print(f"  line {error['line']}: {error['message']}")
+    if report['failed'] > args.show_errors:
+        print(f"  ... and {report['failed'] - args.show_errors} more")
+    return 1 if report['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
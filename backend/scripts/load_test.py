@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""
+Load test the read endpoints of a running server.
+
+Fast clients send a mix of nearest, search, list and detail requests over
+keep-alive connections as quickly as they can. Optional slow clients trickle
+each request out over a few seconds, the way a phone on a poor connection
+does, and tie up whatever the server dedicates to an open request.
+
+    python run.py serve --workers 2 &
+    python scripts/load_test.py --duration 20 --concurrency 32
+    python scripts/load_test.py --slow-clients 64 --slow-seconds 3
+
+Only the standard library is needed. The client shares the machine with the
+server when both run locally, so treat results as relative numbers.
+"""
+import argparse
+import http.client
+import json
+import random
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+# Spread of origins and search terms used by the request mix
+_ORIGIN = (-1.9536, 29.8739)
+_TERMS = ['ph', 'pharm', 'kigali', 'care', 'health', 'plus', 'central']
+
+
+def build_paths(base_path, ids, rng):
+    lat = _ORIGIN[0] + rng.uniform(-0.3, 0.3)
+    lng = _ORIGIN[1] + rng.uniform(-0.3, 0.3)
+    paths = [
+        f'{base_path}/api/pharmacies?lat={lat:.5f}&lng={lng:.5f}&limit=10',
+        f'{base_path}/api/pharmacies?lat={lat:.5f}&lng={lng:.5f}&radius_km=5&limit=20',
+        f'{base_path}/api/pharmacies/suggest?q={rng.choice(_TERMS)}',
+        f'{base_path}/api/pharmacies?search={rng.choice(_TERMS)}&limit=20',
+        f'{base_path}/api/pharmacies?limit=50',
+    ]
+    if ids:
+        paths.append(f'{base_path}/api/pharmacies/{rng.choice(ids)}')
+    return paths
+
+
+def fetch_ids(host, port, base_path):
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    conn.request('GET', f'{base_path}/api/pharmacies?limit=200')
+    body = json.loads(conn.getresponse().read())
+    conn.close()
+    return [item['id'] for item in body.get('data', [])]
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))]
+
+
+def fast_client(host, port, base_path, ids, deadline, seed, results):
+    rng = random.Random(seed)
+    latencies, errors = [], 0
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    while time.monotonic() < deadline:
+        path = rng.choice(build_paths(base_path, ids, rng))
+        start = time.perf_counter()
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - start)
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=30)
+    conn.close()
+    results.append((latencies, errors))
+
+
+def slow_client(host, port, base_path, deadline, trickle_seconds, seed, counter):
+    rng = random.Random(seed)
+    while time.monotonic() < deadline:
+        request = (f'GET {rng.choice(build_paths(base_path, [], rng))} HTTP/1.1\r\n'
+                   f'Host: {host}\r\nConnection: close\r\n\r\n').encode('ascii')
+        pieces = 10
+        step = max(1, len(request) // pieces)
+        try:
+            with socket.create_connection((host, port), timeout=trickle_seconds + 30) as sock:
+                for start in range(0, len(request), step):
+                    sock.sendall(request[start:start + step])
+                    time.sleep(trickle_seconds / pieces)
+                while sock.recv(65536):
+                    pass
+            counter.append(1)
+        except OSError:
+            time.sleep(0.1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:4000')
+    parser.add_argument('--concurrency', type=int, default=16, help='fast clients')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds')
+    parser.add_argument('--slow-clients', type=int, default=0)
+    parser.add_argument('--slow-seconds', type=float, default=2.0, help='time each slow request takes to send')
+    parser.add_argument('--json', action='store_true', help='print the summary as JSON')
+    args = parser.parse_args()
+
+    url = urlsplit(args.url)
+    host, port, base_path = url.hostname, url.port or 80, url.path.rstrip('/')
+    ids = fetch_ids(host, port, base_path)
+
+    deadline = time.monotonic() + args.duration
+    results, slow_done = [], []
+    threads = [threading.Thread(target=fast_client, args=(host, port, base_path, ids, deadline, i, results))
+               for i in range(args.concurrency)]
+    threads += [threading.Thread(target=slow_client,
+                                 args=(host, port, base_path, deadline, args.slow_seconds, 10000 + i, slow_done))
+                for i in range(args.slow_clients)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    latencies = [value for batch, _ in results for value in batch]
+    summary = {
+        'concurrency': args.concurrency,
+        'slow_clients': args.slow_clients,
+        'seconds': round(elapsed, 2),
+        'requests': len(latencies),
+        'errors': sum(errors for _, errors in results),
+        'slow_requests': len(slow_done),
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'max_ms': round(max(latencies, default=0) * 1000, 2),
+    }
+    if args.json:
+        print(json.dumps(summary))
+        return
+    print(f"{summary['requests']} requests in {summary['seconds']}s, {summary['errors']} errors, "
+          f"{summary['slow_requests']} slow requests completed")
+    print(f"throughput {summary['rps']} req/s  latency p50 {summary['p50_ms']}ms  p95 {summary['p95_ms']}ms  "
+          f"p99 {summary['p99_ms']}ms  max {summary['max_ms']}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+"""
+Run the schema step: create missing tables and indexes, set up the search
+index, backfill legacy columns and rebuild derived tables that are out of
+date. Run it once per deploy, before the new code serves requests, and
+after writing to the database behind the API's back. Run from the
+`backend` folder:
+
+    python scripts/migrate.py
+    python scripts/migrate.py --check    # exit status 1 when a migration is due
+
+"""
+import argparse
+import sys
+import time
+
+from pharmacy_tracker_backend import create_base_app
+from pharmacy_tracker_backend.config import Config
+from pharmacy_tracker_backend.database.migrate import migrate_schema, schema_current
+
+
+class MigrateConfig(Config):
+    # This script decides when to migrate
+    SCHEMA_AUTO_MIGRATE = False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--check', action='store_true', help='only report whether the schema is current')
+    args = parser.parse_args()
+
+    app = create_base_app(MigrateConfig)
+    with app.app_context():
+        if args.check:
+            current = schema_current()
+            print('Schema is current' if current else 'Schema needs migrating')
+            return 0 if current else 1
+        start = time.perf_counter()
+        timings = migrate_schema()
+        elapsed = time.perf_counter() - start
+
+    for name, seconds in timings:
+        print(f'{name:>24} {seconds * 1000:>9.1f}ms')
+    print(f'Schema migrated in {elapsed:.2f}s')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
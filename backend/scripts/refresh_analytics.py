@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+"""
+Roll new transactions into the analytics tables, e.g. from cron when the
+server's own job is disabled with ANALYTICS_REFRESH_SECONDS=0. Run from the
+`backend` folder:
+
+    python scripts/refresh_analytics.py
+    python scripts/refresh_analytics.py --rebuild    # recompute from every transaction
+
+"""
+import argparse
+import sys
+import time
+
+from pharmacy_tracker_backend import create_base_app
+from pharmacy_tracker_backend.analytics import DEFAULT_BATCH_SIZE, rebuild_analytics, refresh_analytics
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rebuild', action='store_true', help='empty the rollups and start over')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='transactions per commit')
+    args = parser.parse_args()
+
+    app = create_base_app()
+    with app.app_context():
+        start = time.perf_counter()
+        refresh = rebuild_analytics if args.rebuild else refresh_analytics
+        report = refresh(args.batch_size)
+        elapsed = time.perf_counter() - start
+
+    if report is None:
+        print('Another refresh is running')
+        return 1
+    print(f"Rolled up {report['processed']} transactions in {elapsed:.2f}s, "
+          f"up to transaction {report['last_transaction_id']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
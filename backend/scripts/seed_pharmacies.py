@@ -11,49 +11,50 @@ is importable, for example in PowerShell:
     $env:PYTHONPATH = "d:\PERSONAL PROJECTS\pharmacy-tracker\backend" ; python scripts/seed_pharmacies.py
 
 """
-from pharmacy_tracker_backend import create_app, db
+from pharmacy_tracker_backend import create_base_app, db
+from pharmacy_tracker_backend.changes import record_changes
+from pharmacy_tracker_backend.clusters import adjust_clusters
 from pharmacy_tracker_backend.database.models import Pharmacy
+from pharmacy_tracker_backend.tiles import touch_tiles
 import random
-import json
 
 
-def build_sample_pharmacies():
-    # A list of sample base locations (name, lat, lng)
-    bases = [
-        ('Kigali Central', -1.9536, 29.8739),
-        ('Nyarugenge', -1.95, 29.87),
-        ('Gasabo', -1.96, 29.88),
-        ('Kicukiro', -1.98, 30.05),
-        ('Huye', -2.7566, 29.25),
-        ('Gisenyi', -1.7, 29.26),
-        ('Butare', -2.595, 29.74),
-        ('Musanze', -1.5, 29.63),
-        ('Kigali Airport', -1.9686, 30.1395),
-        ('Kigali Heights', -1.944, 30.062)
-    ]
+# Sample base locations (name, lat, lng)
+BASE_LOCATIONS = [
+    ('Kigali Central', -1.9536, 29.8739),
+    ('Nyarugenge', -1.95, 29.87),
+    ('Gasabo', -1.96, 29.88),
+    ('Kicukiro', -1.98, 30.05),
+    ('Huye', -2.7566, 29.25),
+    ('Gisenyi', -1.7, 29.26),
+    ('Butare', -2.595, 29.74),
+    ('Musanze', -1.5, 29.63),
+    ('Kigali Airport', -1.9686, 30.1395),
+    ('Kigali Heights', -1.944, 30.062)
+]
+
+
+def sample_pharmacy(i, rng=random):
+    """A sample pharmacy near a random base location."""
+    base = rng.choice(BASE_LOCATIONS)
+    # jitter coordinates modestly around base
+    lat = base[1] + rng.uniform(-0.02, 0.02)
+    lng = base[2] + rng.uniform(-0.03, 0.03)
+    services = ['Prescriptions', 'OTC', 'Vaccinations'] if rng.random() > 0.6 else ['Prescriptions', 'OTC']
+    return {
+        'name': f"Sample Pharmacy {i}",
+        'phone_number': f"+2507{rng.randint(10000000,99999999)}",
+        'address': f"{base[0]} - Block {rng.randint(1,50)}",
+        'latitude': lat,
+        'longitude': lng,
+        'opening_hours': '8:00 AM - 9:00 PM',
+        'services': services,
+        'is_registered_by_pharmacy': True
+    }
 
-    sample = []
-    for i in range(1, 61):
-        base = random.choice(bases)
-        name = f"Sample Pharmacy {i}"
-        # jitter coordinates modestly around base
-        lat = base[1] + random.uniform(-0.02, 0.02)
-        lng = base[2] + random.uniform(-0.03, 0.03)
-        phone = f"+2507{random.randint(10000000,99999999)}"
-        address = f"{base[0]} - Block {random.randint(1,50)}"
-        services = ['Prescriptions', 'OTC', 'Vaccinations'] if random.random() > 0.6 else ['Prescriptions', 'OTC']
-        sample.append({
-            'name': name,
-            'phone_number': phone,
-            'address': address,
-            'latitude': lat,
-            'longitude': lng,
-            'opening_hours': '8:00 AM - 9:00 PM',
-            'services': services,
-            'is_registered_by_pharmacy': True
-        })
-
-    return sample
+
+def build_sample_pharmacies():
+    return [sample_pharmacy(i) for i in range(1, 61)]
 
 
 def real_pharmacy_names():
@@ -78,7 +79,7 @@ def real_pharmacy_names():
 
 
 def seed(target_count=50):
-    app = create_app()
+    app = create_base_app()
     with app.app_context():
         count = Pharmacy.query.count()
         print(f'Current pharmacy count: {count}')
@@ -90,6 +91,7 @@ def seed(target_count=50):
         # Remove already used names from the pool
         available_names = [n for n in names if n not in used_names]
 
+        renamed = []
         if placeholder_pharmacies:
             print(f'Renaming {len(placeholder_pharmacies)} placeholder pharmacies...')
             for ph in placeholder_pharmacies:
@@ -98,6 +100,11 @@ def seed(target_count=50):
                 new_name = available_names.pop(0)
                 print(f"Renaming '{ph.name}' -> '{new_name}'")
                 ph.name = new_name
+                renamed.append(ph)
+            # Map tiles carry the names
+            touch_tiles([(ph.latitude, ph.longitude) for ph in renamed])
+            # Logged like API writes, so delta sync clients pick them up
+            record_changes([ph.id for ph in renamed], 'upsert')
             try:
                 db.session.commit()
             except Exception as e:
@@ -118,33 +125,38 @@ def seed(target_count=50):
         used_names = set(p.name for p in Pharmacy.query.with_entities(Pharmacy.name).all())
         available_names = [n for n in real_pharmacy_names() if n not in used_names]
 
+        # Avoid duplicates by phone number, checked in one query for the whole batch
+        phones = [s['phone_number'] for s in samples]
+        taken = {phone for (phone,) in Pharmacy.query.with_entities(Pharmacy.phone_number)
+                 .filter(Pharmacy.phone_number.in_(phones))}
+
+        added = []
         for s in samples:
             # Assign a real name if available, otherwise keep generated name
             assigned_name = s['name']
             if available_names:
                 assigned_name = available_names.pop(0)
-            # Avoid duplicates by phone number
-            exists = Pharmacy.query.filter_by(phone_number=s['phone_number']).first()
-            if exists:
+            if s['phone_number'] in taken:
                 continue
-            try:
-                services_str = json.dumps(s['services']) if s.get('services') is not None else None
-            except Exception:
-                services_str = None
-
+            taken.add(s['phone_number'])
             p = Pharmacy(
                 name=assigned_name,
                 phone_number=s['phone_number'],
                 address=s['address'],
                 latitude=s['latitude'],
                 longitude=s['longitude'],
-                opening_hours=s['opening_hours'],
-                services=services_str,
                 is_registered_by_pharmacy=s['is_registered_by_pharmacy']
             )
+            p.set_services(s.get('services'))
+            p.set_opening_hours(s['opening_hours'])
             db.session.add(p)
+            added.append(p)
 
         try:
+            db.session.flush()  # assigns the ids
+            touch_tiles([(p.latitude, p.longitude) for p in added])
+            adjust_clusters(added=[(p.id, p.latitude, p.longitude) for p in added])
+            record_changes([p.id for p in added], 'upsert')
             db.session.commit()
         except Exception as e:
             db.session.rollback()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+"""
+Run one expiry sweep, e.g. from cron when the server's own scheduler is
+disabled with EXPIRY_SWEEP_INTERVAL_SECONDS=0. Run from the `backend` folder:
+
+    python scripts/sweep_expiry.py
+    python scripts/sweep_expiry.py --date 2025-07-01
+
+"""
+import argparse
+import sys
+import time
+from datetime import date
+
+from pharmacy_tracker_backend import create_base_app
+from pharmacy_tracker_backend.expiry import sweep_expiry
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--date', type=date.fromisoformat, help='sweep as of this day instead of today')
+    args = parser.parse_args()
+
+    app = create_base_app()
+    with app.app_context():
+        start = time.perf_counter()
+        report = sweep_expiry(app.config, args.date)
+        elapsed = time.perf_counter() - start
+
+    if report is None:
+        print('Another sweep is running')
+        return 1
+    kind = 'incremental' if report['incremental'] else 'full'
+    print(f"{kind} sweep as of {report['as_of']} in {elapsed:.2f}s: "
+          f"{report['checked']} medicines checked, {report['changed']} alerts changed")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
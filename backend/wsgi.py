@@ -0,0 +1,10 @@
+"""WSGI entry point for production servers, e.g. `gunicorn -c gunicorn.conf.py wsgi:app`."""
+from pharmacy_tracker_backend import create_app
+from pharmacy_tracker_backend.read_model import load_read_model
+from pharmacy_tracker_backend.scheduler import start_background_jobs
+
+app = create_app()
+# Runs in every worker; jobs take a lease, so only one worker runs each round
+start_background_jobs(app)
+# Fill the in-memory read model before the first request, when it is enabled
+load_read_model(app)